@@ -2,6 +2,8 @@ import json
 import os
 import random
 import re
+from functools import partial
+from multiprocessing import Pool
 
 # 判断是否是grounding任务
 def is_grounding_task(conversations):
@@ -78,8 +80,36 @@ def save_data_as_jsonl(data, output_file):
             json.dump(item, f, ensure_ascii=False)
             f.write('\n')
 
+# 转换单个标注文件（串行与并行模式共用）
+def convert_label_file(label_path, img_dir):
+    try:
+        with open(label_path, 'r', encoding='utf-8') as file:
+            data = json.load(file)
+
+        # is_grounding_task 接受对话列表，extract_qa_pairs 接受标注列表
+        if is_grounding_task(data["conversations"]):
+            if valid_grounding(data, label_path):
+                return convert_vary_2grounding(data, img_dir)
+            return None
+        return extract_qa_pairs([data], img_dir)
+    except Exception as e:
+        print(f"处理训练集文件 {label_path} 时发生错误: {e}")
+        return None
+
+# 按输入顺序产出转换结果，workers > 1 时使用进程池分块并行
+def iter_converted(label_paths, img_dir, workers=1, chunksize=64):
+    if workers <= 1:
+        for label_path in label_paths:
+            yield convert_label_file(label_path, img_dir)
+        return
+
+    worker = partial(convert_label_file, img_dir=img_dir)
+    with Pool(processes=workers) as pool:
+        for converted_data in pool.imap(worker, label_paths, chunksize=chunksize):
+            yield converted_data
+
 # 主转换函数
-def process_dataset(img_dir_labels, output_dir, split_ratio=0.8):
+def process_dataset(img_dir_labels, output_dir, split_ratio=0.8, workers=1, chunksize=64):
     for dataset_name, dataset in img_dir_labels.items():
         img_dir = dataset['images']
         label_dir = dataset['annotations']
@@ -88,30 +118,16 @@ def process_dataset(img_dir_labels, output_dir, split_ratio=0.8):
         val_data = []
         all_data = []
         # 获取所有标注文件
-        label_files = [f for f in os.listdir(label_dir) if f.endswith('.json')]
+        with os.scandir(label_dir) as entries:
+            label_files = [entry.name for entry in entries if entry.name.endswith('.json') and entry.is_file()]
         
         random.shuffle(label_files)  # 打乱文件顺序
-        
-        
-        # train_files = label_files[:train_size]
-        # val_files = label_files[train_size:]
+        label_paths = [os.path.join(label_dir, f) for f in label_files]
         
         # 处理训练集文件
-        for label_file in label_files:
-            label_path = os.path.join(label_dir, label_file)
-            try:
-                with open(label_path, 'r', encoding='utf-8') as file:
-                    data = json.load(file)
-                    
-                    if is_grounding_task(data):
-                        if(valid_grounding(label_path)):
-                            converted_data = convert_vary_2grounding(data, img_dir)
-                    else:
-                        converted_data = extract_qa_pairs(data, img_dir)
-                    
-                    all_data.append(converted_data)       
-            except Exception as e:
-                print(f"处理训练集文件 {label_path} 时发生错误: {e}")
+        for converted_data in iter_converted(label_paths, img_dir, workers, chunksize):
+            if converted_data is not None:
+                all_data.append(converted_data)
         
         train_size = int(len(all_data) * split_ratio)  # 计算训练集大小
         train_data = all_data[:train_size]
@@ -130,10 +146,13 @@ def process_dataset(img_dir_labels, output_dir, split_ratio=0.8):
             print(f"已保存验证集数据到 {val_output_path}")
 
 
-def valid_grounding(json_path):
+# 校验grounding标注，json_data 为已解析的字典（传入路径时兼容旧用法，先读取文件）
+def valid_grounding(json_data, json_path=''):
     try:
-        with open(json_path, 'r', encoding='utf-8') as json_file:
-            json_data = json.load(json_file)
+        if isinstance(json_data, str):
+            json_path = json_path or json_data
+            with open(json_data, 'r', encoding='utf-8') as json_file:
+                json_data = json.load(json_file)
         
         question = json_data['conversations'][0]['value']
         answer = json_data['conversations'][1]['value']
@@ -159,48 +178,49 @@ def valid_grounding(json_path):
 
 
 
-# 测试数据列表
-img_dir_labels = {
-    'alg_base_vqa':{
-        'images':"/data2/liangqh/Datasets/alg_base/",
-        'annotations':"/data2/liangqh/Datasets/alg_base/alg_base_vqa/",
-    },
-    'tower_data':{
-        'images': "/data2/liangqh/Datasets/Tower_dataset/",
-        'annotations': "/data2/liangqh/Datasets/Tower_dataset/labels/",
-    },
-    'alg_base_Cap':{
-        'images':"/data2/liangqh/Datasets/alg_base/",
-        'annotations':"/data2/liangqh/Datasets/alg_base/GLM4v_captions/",
-    },
-    "Tower_bigdata":{
-        "images":"/data2/liangqh/Datasets/Tower_dataset/",
-        "annotations":"/data2/liangqh/Datasets/Tower_dataset/bigdata_json/label_json_box/",
-    },
-    "Tower_bigdata_cap":{
-        "images":"/data2/liangqh/Datasets/Tower_dataset/bigdata/",
-        "annotations":"/data2/liangqh/Datasets/Tower_dataset/bigdata_json/bigdata_cap/",
-    },
-    "Tower_data_1":{
-        "images":"/data2/liangqh/Datasets/Tower_dataset/Tower_data_1/images/",
-        "annotations":"/data2/liangqh/Datasets/Tower_dataset/Tower_data_1/jsons/"
-    },
-    "Tower_data_1_ref":{
-        "images":"/data3/liangqh/Datasets/Tower_data/Tower_data_2/images/",
-        "annotations":"/data3/liangqh/Datasets/Tower_data/Tower_data_2/jsons/",
-    },
-    "alg_base_regionCap":{
-        "images":"/data2/liangqh/Datasets/alg_base/",
-        "annotations":"/data2/liangqh/Datasets/alg_base/algbase_regionCap/",
-    },
-    "Tower_bigdata_regionCap":{
-        "images":"/data2/liangqh/Datasets/Tower_dataset/bigdata/",
-        "annotations":"/data2/liangqh/Datasets/Tower_dataset/bigdata_json/bigdata_regionCap/",
-    },
-}
-
-output_dir = '/path/to/output'  # 设定输出路径
-split_ratio = 0.8  # 80% 训练集，20% 验证集
-
-# 执行处理
-process_dataset(img_dir_labels, output_dir, split_ratio)
+if __name__ == '__main__':
+    # 测试数据列表
+    img_dir_labels = {
+        'alg_base_vqa':{
+            'images':"/data2/liangqh/Datasets/alg_base/",
+            'annotations':"/data2/liangqh/Datasets/alg_base/alg_base_vqa/",
+        },
+        'tower_data':{
+            'images': "/data2/liangqh/Datasets/Tower_dataset/",
+            'annotations': "/data2/liangqh/Datasets/Tower_dataset/labels/",
+        },
+        'alg_base_Cap':{
+            'images':"/data2/liangqh/Datasets/alg_base/",
+            'annotations':"/data2/liangqh/Datasets/alg_base/GLM4v_captions/",
+        },
+        "Tower_bigdata":{
+            "images":"/data2/liangqh/Datasets/Tower_dataset/",
+            "annotations":"/data2/liangqh/Datasets/Tower_dataset/bigdata_json/label_json_box/",
+        },
+        "Tower_bigdata_cap":{
+            "images":"/data2/liangqh/Datasets/Tower_dataset/bigdata/",
+            "annotations":"/data2/liangqh/Datasets/Tower_dataset/bigdata_json/bigdata_cap/",
+        },
+        "Tower_data_1":{
+            "images":"/data2/liangqh/Datasets/Tower_dataset/Tower_data_1/images/",
+            "annotations":"/data2/liangqh/Datasets/Tower_dataset/Tower_data_1/jsons/"
+        },
+        "Tower_data_1_ref":{
+            "images":"/data3/liangqh/Datasets/Tower_data/Tower_data_2/images/",
+            "annotations":"/data3/liangqh/Datasets/Tower_data/Tower_data_2/jsons/",
+        },
+        "alg_base_regionCap":{
+            "images":"/data2/liangqh/Datasets/alg_base/",
+            "annotations":"/data2/liangqh/Datasets/alg_base/algbase_regionCap/",
+        },
+        "Tower_bigdata_regionCap":{
+            "images":"/data2/liangqh/Datasets/Tower_dataset/bigdata/",
+            "annotations":"/data2/liangqh/Datasets/Tower_dataset/bigdata_json/bigdata_regionCap/",
+        },
+    }
+
+    output_dir = '/path/to/output'  # 设定输出路径
+    split_ratio = 0.8  # 80% 训练集，20% 验证集
+
+    # 执行处理
+    process_dataset(img_dir_labels, output_dir, split_ratio)
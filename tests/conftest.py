@@ -0,0 +1,53 @@
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def make_label(i, variant=0):
+    """第 i 个测试标注：grounding、区域描述、多轮问答轮换；variant 不同时内容不同。"""
+    kind = i % 3
+    if kind == 0:
+        conversations = [{'from': 'human', 'value': f'<image>\n找到 <ref>塔{variant}</ref>'},
+                         {'from': 'gpt', 'value': f'<ref>塔{variant}</ref><box>[[{i % 500},20,{600 + variant},700]]</box>'}]
+    elif kind == 1:
+        conversations = [{'from': 'human', 'value': f'<image>\n描述<box>[[10,{i % 300},300,{400 + variant}]]</box>'},
+                         {'from': 'gpt', 'value': f'区域{i}-{variant}'}]
+    else:
+        conversations = [{'from': 'human', 'value': '<image>\n这是什么'}, {'from': 'gpt', 'value': f'铁塔{i}-{variant}'},
+                         {'from': 'human', 'value': '颜色'}, {'from': 'gpt', 'value': f'红色{variant}'}]
+    return {'image': f'img{i}.jpg', 'height': 480 + i % 7, 'width': 640, 'conversations': conversations}
+
+
+def write_label(label_dir, i, variant=0, mtime_ns=None):
+    path = os.path.join(label_dir, f'{i:04d}.json')
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(make_label(i, variant), f, ensure_ascii=False)
+    if mtime_ns is not None:
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+    return path
+
+
+def read_outputs(output_dir, name):
+    """{集合: 排序后的输出行}，只比较记录内容与所属集合，不比较顺序。"""
+    outputs = {}
+    for split in ('train', 'val'):
+        path = os.path.join(output_dir, f'{name}_{split}.jsonl')
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                outputs[split] = sorted(f)
+        else:
+            outputs[split] = []
+    return outputs
+
+
+@pytest.fixture
+def label_dir(tmp_path):
+    directory = tmp_path / 'labels'
+    directory.mkdir()
+    for i in range(60):
+        write_label(str(directory), i)
+    return str(directory)
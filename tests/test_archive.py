@@ -0,0 +1,45 @@
+import json
+import os
+
+import pytest
+
+import vary2qwen_tets as v2q
+from conftest import read_outputs, write_label
+from vary2qwen_archive import list_label_archives, pack_label_dir
+
+WALK = dict(recursive=True, exclude=['skip*'])
+
+
+@pytest.fixture
+def nested_dir(tmp_path):
+    directory = tmp_path / 'labels'
+    for sub, first in (('', 0), ('a', 20), ('a/b', 40), ('skip', 60)):
+        os.makedirs(str(directory / sub), exist_ok=True)
+        for i in range(first, first + 20):
+            write_label(str(directory / sub), i)
+    write_label(str(directory), 90)
+    os.rename(str(directory / '0090.json'), str(directory / 'skip_me.json'))
+    # 之前打包留下的清单不是标注文件
+    with open(str(directory / 'old.archives.json'), 'w', encoding='utf-8') as f:
+        json.dump({'shards': []}, f)
+    return str(directory)
+
+
+def convert(label_dir, img_dir, output_dir, **options):
+    os.makedirs(output_dir, exist_ok=True)
+    v2q.process_label_dir('ds', label_dir, img_dir, output_dir, streaming=True, **options)
+    return read_outputs(output_dir, 'ds')
+
+
+@pytest.mark.parametrize('fmt', ['tar', 'zip'])
+def test_pack_matches_direct_conversion(nested_dir, tmp_path, fmt):
+    shard_dir = str(tmp_path / 'shards')
+    manifest_path = pack_label_dir(nested_dir, shard_dir, 'ds', files_per_shard=25, fmt=fmt, **WALK)
+    with open(manifest_path, encoding='utf-8') as f:
+        manifest = json.load(f)
+    assert manifest['files'] == 60 and [shard['files'] for shard in manifest['shards']] == [25, 25, 10]
+    assert len(list_label_archives(shard_dir)) == 3
+
+    direct = convert(nested_dir, nested_dir, str(tmp_path / 'direct'), **WALK)
+    packed = convert(shard_dir, nested_dir, str(tmp_path / 'packed'))
+    assert packed == direct and len(direct['train']) + len(direct['val']) > 0
@@ -0,0 +1,80 @@
+import hashlib
+import os
+
+import vary2qwen_dedup
+from vary2qwen_cache import DigestCache
+from vary2qwen_dedup import ImageHasher
+
+
+def digest(i):
+    return hashlib.blake2b(str(i).encode(), digest_size=16).hexdigest()
+
+
+def write_files(directory, n):
+    paths = []
+    for i in range(n):
+        path = os.path.join(directory, f'{i}.jpg')
+        with open(path, 'wb') as f:
+            f.write(b'image %d' % i)
+        paths.append(path)
+    return paths
+
+
+def test_digest_cache_round_trip_and_invalidation(tmp_path):
+    paths = write_files(str(tmp_path), 50)
+    cache_path = str(tmp_path / 'hashes.bin')
+    cache = DigestCache(cache_path)
+    for i, path in enumerate(paths):
+        cache.put(path, digest(i))
+    cache.save()
+    assert os.path.getsize(cache_path) == len(DigestCache.MAGIC) + 50 * DigestCache.ENTRY.size
+
+    reloaded = DigestCache(cache_path)
+    assert len(reloaded) == 50
+    assert [reloaded.get(path) for path in paths] == [digest(i) for i in range(50)]
+    # 文件修改后条目失效
+    with open(paths[3], 'ab') as f:
+        f.write(b'x')
+    assert reloaded.get(paths[3]) is None
+    assert reloaded.get(str(tmp_path / 'missing.jpg')) is None
+
+
+def test_digest_cache_saves_merge_with_other_processes(tmp_path):
+    paths = write_files(str(tmp_path), 40)
+    cache_path = str(tmp_path / 'hashes.bin')
+    first, second = DigestCache(cache_path), DigestCache(cache_path)
+    for i, path in enumerate(paths[:30]):
+        first.put(path, digest(i))
+    for i, path in enumerate(paths[20:], 20):
+        second.put(path, digest(i + 1000))
+    first.save()
+    second.save()
+
+    merged = DigestCache(cache_path)
+    assert len(merged) == 40
+    # 后保存的条目覆盖先保存的
+    assert [merged.get(path) for path in paths] == \
+        [digest(i) for i in range(20)] + [digest(i + 1000) for i in range(20, 40)]
+
+
+def test_digest_cache_ignores_unknown_file(tmp_path):
+    cache_path = str(tmp_path / 'hashes.bin')
+    with open(cache_path, 'w') as f:
+        f.write('{"a": [1, 2, "00"]}')
+    cache = DigestCache(cache_path)
+    assert len(cache) == 0
+    path = write_files(str(tmp_path), 1)[0]
+    cache.put(path, digest(0))
+    cache.save()
+    assert DigestCache(cache_path).get(path) == digest(0)
+
+
+def test_image_hasher_reads_cached_hashes(tmp_path, monkeypatch):
+    paths = write_files(str(tmp_path), 10)
+    cache_path = str(tmp_path / 'hashes.bin')
+    hasher = ImageHasher(cache_path)
+    expected = [hasher.hash(path) for path in paths]
+    hasher.save()
+
+    monkeypatch.setattr(vary2qwen_dedup, 'file_hash', lambda path: 'not cached')
+    assert [ImageHasher(cache_path).hash(path) for path in paths] == expected
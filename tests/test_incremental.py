@@ -0,0 +1,156 @@
+import os
+
+import pytest
+
+import vary2qwen_tets as v2q
+from conftest import read_outputs, write_label
+from vary2qwen_manifest import ConversionManifest
+
+
+def convert(label_dir, output_dir, **options):
+    return v2q.process_label_dir('ds', label_dir, label_dir, str(output_dir), **options)
+
+
+def fresh_outputs(label_dir, tmp_path, **options):
+    output_dir = tmp_path / 'fresh'
+    output_dir.mkdir(exist_ok=True)
+    convert(label_dir, output_dir, **options)
+    return read_outputs(str(output_dir), 'ds')
+
+
+def counters(summary):
+    return {key[len('incremental.'):]: n for key, n in summary.get('counters', {}).items()
+            if key.startswith('incremental.')}
+
+
+def change_files(label_dir):
+    # 修改、删除、新增、只更新 mtime 各若干个文件
+    for i in range(0, 5):
+        write_label(label_dir, i, variant=1, mtime_ns=1_900_000_000_000_000_000 + i)
+    for i in range(10, 15):
+        os.remove(os.path.join(label_dir, f'{i:04d}.json'))
+    for i in range(100, 105):
+        write_label(label_dir, i)
+    for i in range(20, 23):
+        os.utime(os.path.join(label_dir, f'{i:04d}.json'), ns=(1_910_000_000_000_000_000, 1_910_000_000_000_000_000))
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_incremental_rerun_matches_full_conversion(label_dir, tmp_path, workers):
+    output_dir = tmp_path / 'out'
+    output_dir.mkdir()
+    first = convert(label_dir, output_dir, incremental=True, workers=workers, checkpoint_every=7)
+    assert counters(first)['converted'] == 60
+    assert read_outputs(str(output_dir), 'ds') == fresh_outputs(label_dir, tmp_path, streaming=True)
+
+    change_files(label_dir)
+    second = convert(label_dir, output_dir, incremental=True, workers=workers, checkpoint_every=7)
+    assert counters(second) == {'converted': 10, 'touched': 3, 'skipped': 47, 'removed': 5, 'compacted': 1}
+    assert read_outputs(str(output_dir), 'ds') == fresh_outputs(label_dir, tmp_path, streaming=True)
+
+    # 没有变化时不再转换，输出不变
+    third = convert(label_dir, output_dir, incremental=True, workers=workers)
+    assert counters(third).get('converted', 0) == 0
+    assert read_outputs(str(output_dir), 'ds') == fresh_outputs(label_dir, tmp_path, streaming=True)
+
+
+def test_incremental_matches_streaming_and_buffered_records(label_dir, tmp_path):
+    output_dir = tmp_path / 'out'
+    output_dir.mkdir()
+    convert(label_dir, output_dir, incremental=True)
+    incremental = read_outputs(str(output_dir), 'ds')
+    buffered = fresh_outputs(label_dir, tmp_path)
+    # 缓冲模式随机划分，只比较全部记录
+    assert sorted(incremental['train'] + incremental['val']) == sorted(buffered['train'] + buffered['val'])
+
+
+def test_crash_mid_run_resumes_from_last_checkpoint(label_dir, tmp_path, monkeypatch):
+    output_dir = tmp_path / 'out'
+    output_dir.mkdir()
+    convert(label_dir, output_dir, incremental=True)
+    change_files(label_dir)
+
+    apply_file_result = v2q.apply_file_result
+    calls = []
+
+    def crashing(*args):
+        calls.append(args[2])
+        if len(calls) > 8:
+            raise KeyboardInterrupt
+        return apply_file_result(*args)
+
+    monkeypatch.setattr(v2q, 'apply_file_result', crashing)
+    with pytest.raises(KeyboardInterrupt):
+        convert(label_dir, output_dir, incremental=True, checkpoint_every=3)
+    monkeypatch.setattr(v2q, 'apply_file_result', apply_file_result)
+
+    convert(label_dir, output_dir, incremental=True, checkpoint_every=3)
+    assert read_outputs(str(output_dir), 'ds') == fresh_outputs(label_dir, tmp_path, streaming=True)
+
+
+@pytest.mark.parametrize('fraction', [0.3, 0.5, 0.9])
+def test_truncated_manifest_recovers(label_dir, tmp_path, fraction):
+    output_dir = tmp_path / 'out'
+    output_dir.mkdir()
+    convert(label_dir, output_dir, incremental=True, checkpoint_every=5)
+    manifest_path = os.path.join(str(output_dir), 'ds.manifest.jsonl')
+    # 在一行中间截断清单，模拟写清单时中断
+    size = os.path.getsize(manifest_path)
+    with open(manifest_path, 'r+b') as f:
+        f.truncate(int(size * fraction))
+    change_files(label_dir)
+
+    convert(label_dir, output_dir, incremental=True, checkpoint_every=5)
+    assert read_outputs(str(output_dir), 'ds') == fresh_outputs(label_dir, tmp_path, streaming=True)
+    manifest = ConversionManifest.load(manifest_path)
+    assert sorted(manifest.files) == sorted(f for f in os.listdir(label_dir) if f.endswith('.json'))
+    assert not manifest.compaction_needed
+
+
+def test_uncommitted_output_is_discarded(label_dir, tmp_path):
+    output_dir = tmp_path / 'out'
+    output_dir.mkdir()
+    convert(label_dir, output_dir, incremental=True)
+    # 中断的运行在最后一次提交之后写了半条记录和半行清单
+    with open(os.path.join(str(output_dir), 'ds_train.jsonl'), 'ab') as f:
+        f.write(b'{"query": "half')
+    with open(os.path.join(str(output_dir), 'ds.manifest.jsonl'), 'ab') as f:
+        f.write(b'{"file": "0001.json", "size"')
+
+    convert(label_dir, output_dir, incremental=True)
+    assert read_outputs(str(output_dir), 'ds') == fresh_outputs(label_dir, tmp_path, streaming=True)
+
+
+def test_output_shorter_than_manifest_triggers_full_rebuild(label_dir, tmp_path):
+    output_dir = tmp_path / 'out'
+    output_dir.mkdir()
+    convert(label_dir, output_dir, incremental=True)
+    train_path = os.path.join(str(output_dir), 'ds_train.jsonl')
+    with open(train_path, 'r+b') as f:
+        f.truncate(os.path.getsize(train_path) // 2)
+
+    convert(label_dir, output_dir, incremental=True)
+    assert read_outputs(str(output_dir), 'ds') == fresh_outputs(label_dir, tmp_path, streaming=True)
+
+
+def test_manifest_compact_keeps_only_live_spans(tmp_path):
+    output_path = str(tmp_path / 'ds_train.jsonl')
+    manifest = ConversionManifest(str(tmp_path / 'ds.manifest.jsonl'))
+    stat = os.stat_result((0, 0, 0, 0, 0, 0, 3, 0, 0, 0))
+    with open(output_path, 'wb') as f:
+        f.write(b'a\nbb\nccc\n')
+    manifest.update('a', stat, 'sha-a', [['train', 0, 2]])
+    manifest.update('b', stat, 'sha-b', [['train', 2, 3]])
+    manifest.update('c', stat, 'sha-c', [['train', 5, 4]])
+    manifest.checkpoint({'train': 9})
+    manifest.remove('b')
+    manifest.checkpoint({'train': 9})
+
+    reloaded = ConversionManifest.load(manifest.path)
+    assert reloaded.compaction_needed
+    reloaded.compact({'train': output_path})
+    with open(output_path, 'rb') as f:
+        assert f.read() == b'a\nccc\n'
+    reloaded = ConversionManifest.load(manifest.path)
+    assert reloaded.outputs == {'train': 6} and not reloaded.compaction_needed
+    assert reloaded.files['c']['spans'] == [['train', 2, 4]]
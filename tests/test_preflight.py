@@ -0,0 +1,39 @@
+import os
+
+import numpy as np
+import pytest
+
+cv2 = pytest.importorskip('cv2')
+
+from vary2qwen_preflight import check_image
+
+
+def encode(ext, *params):
+    image = (np.random.RandomState(0).rand(120, 160, 3) * 255).astype('uint8')
+    return cv2.imencode(ext, image, list(params))[1].tobytes()
+
+
+JPEG = encode('.jpg')
+PROGRESSIVE = encode('.jpg', cv2.IMWRITE_JPEG_PROGRESSIVE, 1)
+PNG = encode('.png')
+
+
+@pytest.mark.parametrize('name, data, status', [
+    ('plain.jpg', JPEG, 'ok'),
+    ('progressive.jpg', PROGRESSIVE, 'ok'),
+    # 结束标记之后附加的数据（填充、MPF 中的第二幅图）不算截断
+    ('padded.jpg', JPEG + b'\x00' * 5000, 'ok'),
+    ('mpf.jpg', JPEG + b'\x00' * 3000 + JPEG, 'ok'),
+    ('padded.png', PNG + b'\x00' * 5000, 'ok'),
+    ('cut.jpg', JPEG[:len(JPEG) // 2], 'truncated'),
+    ('cut_progressive.jpg', PROGRESSIVE[:-300], 'truncated'),
+    ('cut.png', PNG[:-20], 'truncated'),
+    ('broken.jpg', b'\xff\xd8\xff\xc0\x00', 'bad_header'),
+    # 无法识别的格式在 header 级别不下结论
+    ('image.tif', b'II*\x00' + b'\x00' * 100, 'ok'),
+])
+def test_check_image_header(tmp_path, name, data, status):
+    path = os.path.join(str(tmp_path), name)
+    with open(path, 'wb') as f:
+        f.write(data)
+    assert check_image(path)[0] == status
@@ -0,0 +1,39 @@
+import os
+
+from conftest import write_label
+from vary2qwen_archive import pack_label_dir
+from vary2qwen_schedule import Job, count_jobs, count_label_files
+
+
+def make_nested(directory):
+    for sub, first in (('', 0), ('a', 10), ('a/b', 20), ('skip', 30)):
+        os.makedirs(os.path.join(directory, sub), exist_ok=True)
+        for i in range(first, first + 10):
+            write_label(os.path.join(directory, sub), i)
+
+
+def test_count_label_files_follows_walk_options(tmp_path):
+    label_dir = str(tmp_path / 'labels')
+    make_nested(label_dir)
+    assert count_label_files(label_dir) == 10
+    assert count_label_files(label_dir, recursive=True) == 40
+    assert count_label_files(label_dir, exclude=['skip'], recursive=True) == 30
+    assert count_label_files(label_dir, include=['a/*'], recursive=True) == 20
+
+
+def test_count_label_files_uses_archives_only_without_labels(tmp_path):
+    label_dir = str(tmp_path / 'labels')
+    make_nested(label_dir)
+    shard_dir = str(tmp_path / 'shards')
+    pack_label_dir(label_dir, shard_dir, 'ds', files_per_shard=15, recursive=True)
+    assert count_label_files(shard_dir) == 40
+    assert count_label_files(os.path.join(shard_dir, 'ds-00000.tar')) == 15
+
+
+def test_count_jobs_uses_dataset_options(tmp_path):
+    label_dir = str(tmp_path / 'labels')
+    make_nested(label_dir)
+    dataset = {'annotations': label_dir, 'images': label_dir, 'options': {'exclude': ['skip']}}
+    jobs = [Job('flat', dict(dataset, options={}), {}), Job('nested', dataset, {'recursive': True})]
+    count_jobs(jobs)
+    assert [job.files for job in jobs] == [10, 30]
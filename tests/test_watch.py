@@ -0,0 +1,116 @@
+import json
+import os
+import struct
+import threading
+import time
+
+import vary2qwen_tets as v2q
+from conftest import make_label, read_outputs, write_label
+from vary2qwen_manifest import ConversionManifest
+from vary2qwen_discover import LabelWalker
+from vary2qwen_watch import PollingWatcher, watch_label_dir
+
+
+def start_watch(label_dir, output_dir, **options):
+    stop = threading.Event()
+    totals = []
+    options = dict(dict(poll_interval=0.05, settle=0.05, max_delay=0.2, rescan_interval=0.3, compact_idle=None),
+                   **options)
+    thread = threading.Thread(target=lambda: totals.append(
+        watch_label_dir('ds', label_dir, label_dir, str(output_dir), stop=stop, **options)))
+    thread.start()
+    return stop, thread, totals
+
+
+def wait_until(condition, timeout=20.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def manifest_current(output_dir, label_dir):
+    # 清单中的文件与标注目录中的文件一一对应，且大小、mtime 都是最新的
+    manifest = ConversionManifest.load(os.path.join(str(output_dir), 'ds.manifest.jsonl'))
+    names = sorted(f for f in os.listdir(label_dir) if f.endswith('.json'))
+    if sorted(manifest.files) != names:
+        return False
+    return all(manifest.unchanged(name, os.stat(os.path.join(label_dir, name))) for name in names)
+
+
+def fresh_outputs(label_dir, tmp_path, **options):
+    output_dir = tmp_path / 'fresh'
+    output_dir.mkdir(exist_ok=True)
+    v2q.process_label_dir('ds', label_dir, label_dir, str(output_dir), streaming=True, **options)
+    return read_outputs(str(output_dir), 'ds')
+
+
+def test_polling_watcher_reports_added_and_removed(tmp_path):
+    label_dir = str(tmp_path)
+    write_label(label_dir, 1)
+    watcher = PollingWatcher(label_dir, LabelWalker(), interval=0.01)
+    write_label(label_dir, 2)
+    os.remove(os.path.join(label_dir, '0001.json'))
+    assert wait_until(lambda: watcher.read(0.05) == ({'0002.json': os.path.join(label_dir, '0002.json')},
+                                                     {'0001.json'}), timeout=5)
+    watcher.close()
+
+
+def test_watch_create_modify_delete_matches_full_conversion(label_dir, tmp_path):
+    output_dir = tmp_path / 'out'
+    output_dir.mkdir()
+    stop, thread, totals = start_watch(label_dir, output_dir)
+    try:
+        # 启动时补齐已有文件
+        assert wait_until(lambda: manifest_current(output_dir, label_dir))
+
+        for i in range(200, 203):
+            write_label(label_dir, i)
+        for i in range(3, 5):
+            write_label(label_dir, i, variant=1, mtime_ns=1_900_000_000_000_000_000 + i)
+        for i in range(30, 32):
+            os.remove(os.path.join(label_dir, f'{i:04d}.json'))
+        assert wait_until(lambda: manifest_current(output_dir, label_dir))
+    finally:
+        stop.set()
+        thread.join(30)
+    assert not thread.is_alive()
+    assert totals and totals[0]['converted'] == 5 and totals[0]['removed'] == 2
+    # 退出时压缩掉修改、删除留下的旧记录
+    assert read_outputs(str(output_dir), 'ds') == fresh_outputs(label_dir, tmp_path)
+
+
+def write_png(path, height, width):
+    ihdr = struct.pack('>II', width, height) + b'\x08\x02\x00\x00\x00'
+    with open(path, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n' + struct.pack('>I', len(ihdr)) + b'IHDR' + ihdr + b'\x00' * 4)
+
+
+def test_watch_saves_probed_sizes(tmp_path):
+    label_dir = str(tmp_path / 'labels')
+    os.makedirs(label_dir)
+    output_dir = tmp_path / 'out'
+    output_dir.mkdir()
+    size_cache = str(tmp_path / 'sizes.json')
+    write_label(label_dir, 99)
+    stop, thread, _ = start_watch(label_dir, output_dir, probe_sizes='missing', size_cache=size_cache)
+    try:
+        # 等启动时的补齐完成，之后的文件由监视会话转换
+        assert wait_until(lambda: manifest_current(output_dir, label_dir))
+        for i in range(3):
+            write_png(os.path.join(label_dir, f'img{i}.jpg'), 300 + i, 500)
+            label = make_label(i)
+            del label['height'], label['width']
+            with open(os.path.join(label_dir, f'{i:04d}.json'), 'w', encoding='utf-8') as f:
+                json.dump(label, f, ensure_ascii=False)
+        assert wait_until(lambda: manifest_current(output_dir, label_dir))
+        # 每批写出后即保存，无需等到停止监视
+        assert wait_until(lambda: os.path.exists(size_cache))
+        with open(size_cache, encoding='utf-8') as f:
+            cached = json.load(f)
+    finally:
+        stop.set()
+        thread.join(30)
+    assert sorted(value for _, _, value in cached.values()) == [[300, 500], [301, 500], [302, 500]]
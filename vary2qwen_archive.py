@@ -0,0 +1,182 @@
+import argparse
+import json
+import os
+import re
+import tarfile
+import time
+import zipfile
+from itertools import count, islice
+
+# 标注归档：把一个标注文件夹中的大量小 json 打包成若干 tar/zip 分片 {name}-00000.tar ...，
+# 转换时按顺序流式读取成员，免去网络文件系统上逐个 listdir/open 的元数据开销。
+# 打包时同时生成清单 {name}.archives.json，记录每个分片的文件数，用于显示进度和估计工作量。
+ARCHIVE_SUFFIXES = ('.tar', '.tar.gz', '.tgz', '.zip')
+ARCHIVE_MANIFEST_SUFFIX = '.archives.json'
+ARCHIVE_FORMATS = ('tar', 'zip')
+READ_BUFFER = 16 * 1024 * 1024
+
+
+def archive_path(output_dir, name, shard_id, fmt='tar'):
+    return os.path.join(output_dir, f'{name}-{shard_id:05d}.{fmt}')
+
+
+def archive_manifest_path(output_dir, name):
+    return os.path.join(output_dir, name + ARCHIVE_MANIFEST_SUFFIX)
+
+
+def list_label_archives(label_path):
+    """
+    标注输入为归档时返回按名称排序的归档路径：label_path 本身是归档，或是包含归档分片的目录。
+    普通的标注文件夹返回空列表。
+    """
+    if os.path.isfile(label_path):
+        return [label_path] if label_path.endswith(ARCHIVE_SUFFIXES) else []
+    with os.scandir(label_path) as entries:
+        return sorted(entry.path for entry in entries
+                      if entry.name.endswith(ARCHIVE_SUFFIXES) and entry.is_file())
+
+
+def count_archive_members(archive_paths):
+    """
+    归档中的标注文件总数：优先读取同目录下的打包清单，zip 读取中央目录；
+    无法得知（没有清单的 tar）时返回 None。
+    """
+    known = {}
+    for directory in {os.path.dirname(path) for path in archive_paths}:
+        with os.scandir(directory or '.') as entries:
+            manifests = [entry.path for entry in entries if entry.name.endswith(ARCHIVE_MANIFEST_SUFFIX)]
+        for manifest in manifests:
+            with open(manifest, 'r', encoding='utf-8') as f:
+                for shard in json.load(f)['shards']:
+                    known[os.path.join(directory, shard['path'])] = shard['files']
+    total = 0
+    for path in archive_paths:
+        if path in known:
+            total += known[path]
+        elif path.endswith('.zip'):
+            with zipfile.ZipFile(path) as zf:
+                total += sum(1 for info in zf.infolist() if _is_label_member(info.filename, info.is_dir()))
+        else:
+            return None
+    return total
+
+
+def _is_label_member(member_name, is_dir=False):
+    return not is_dir and member_name.endswith('.json')
+
+
+def _iter_tar(path, metrics=None):
+    with open(path, 'rb', buffering=READ_BUFFER) as f, tarfile.open(fileobj=f, mode='r|*') as tar:
+        start = time.perf_counter()
+        for member in tar:
+            if _is_label_member(member.name, not member.isfile()):
+                raw = tar.extractfile(member).read()
+                if metrics is not None:
+                    metrics.tick('read', start)
+                yield os.path.join(path, member.name), raw
+                start = time.perf_counter()
+            # 流式模式下 TarFile 仍会记下每个成员的 TarInfo，百万级成员时需随读随清
+            tar.members = []
+
+
+def _iter_zip(path, metrics=None):
+    with open(path, 'rb', buffering=READ_BUFFER) as f, zipfile.ZipFile(f) as zf:
+        # 按成员在文件中的位置读取，保证顺序读盘
+        for info in sorted(zf.infolist(), key=lambda info: info.header_offset):
+            if _is_label_member(info.filename, info.is_dir()):
+                start = time.perf_counter()
+                raw = zf.read(info)
+                if metrics is not None:
+                    metrics.tick('read', start)
+                yield os.path.join(path, info.filename), raw
+
+
+def iter_archive_members(archive_paths, metrics=None):
+    """
+    依次产出各归档中标注文件的 (路径, 原始内容)，路径为 {归档路径}/{成员名}，仅用于日志。
+    tar 以流模式读取（支持 gzip 等压缩），zip 按成员在文件中的位置读取；读取耗时计入 metrics 的 read。
+    """
+    for path in archive_paths:
+        if path.endswith('.zip'):
+            yield from _iter_zip(path, metrics)
+        else:
+            yield from _iter_tar(path, metrics)
+
+
+def pack_label_dir(label_dir, output_dir, name=None, files_per_shard=100000, fmt='tar',
+                   include=None, exclude=None, recursive=False, walk_threads=8):
+    """
+    将标注文件夹打包为归档分片 {output_dir}/{name}-00000.tar ...，并写出清单 {name}.archives.json。
+    标注文件由 vary2qwen_discover.LabelWalker 按转换时相同的顺序发现，成员名为相对标注目录的路径、不压缩，
+    流式转换的输出与以相同 include/exclude/recursive 直接转换该文件夹一致。
+    output_dir 中同名的旧分片会被删除。
+
+    Args:
+        name (str): 分片名前缀，默认为标注文件夹名。
+        files_per_shard (int): 每个分片的标注文件数。
+        fmt (str): 'tar' 或 'zip'（不压缩）。
+        include, exclude, recursive, walk_threads: 同 vary2qwen_tets.process_label_dir。
+    Returns:
+        str: 清单文件路径。
+    """
+    if fmt not in ARCHIVE_FORMATS:
+        raise ValueError(f"不支持的归档格式: {fmt}")
+    name = name or os.path.basename(os.path.normpath(label_dir))
+    os.makedirs(output_dir, exist_ok=True)
+    shard_re = re.compile(re.escape(name) + r'-\d{5}\.(tar|zip)')
+    for old_path in list_label_archives(output_dir):
+        if shard_re.fullmatch(os.path.basename(old_path)):
+            os.remove(old_path)
+
+    # vary2qwen_discover 在模块级导入本模块，这里延迟导入以免循环
+    from vary2qwen_discover import LabelWalker
+    label_files = LabelWalker(include, exclude, recursive, walk_threads).walk(label_dir)
+    shards = []
+    total = 0
+    for shard_id in count():
+        members = list(islice(label_files, files_per_shard))
+        if not members:
+            break
+        path = archive_path(output_dir, name, shard_id, fmt)
+        tmp_path = path + '.tmp'
+        if fmt == 'zip':
+            with zipfile.ZipFile(tmp_path, 'w', zipfile.ZIP_STORED) as zf:
+                for label_file in members:
+                    zf.write(label_file.path, label_file.name)
+        else:
+            with tarfile.open(tmp_path, 'w') as tar:
+                for label_file in members:
+                    tar.add(label_file.path, label_file.name)
+        os.replace(tmp_path, path)
+        total += len(members)
+        shards.append({'path': os.path.basename(path), 'files': len(members), 'bytes': os.path.getsize(path)})
+        print(f"已打包 {path}（{len(members)} 个文件）")
+
+    manifest_path = archive_manifest_path(output_dir, name)
+    manifest = {'label_dir': os.path.abspath(label_dir), 'format': fmt, 'files': total, 'shards': shards}
+    with open(manifest_path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(manifest_path + '.tmp', manifest_path)
+    return manifest_path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='将标注文件夹打包为 tar/zip 分片，转换时流式读取')
+    parser.add_argument('label_dir', help='标注文件夹')
+    parser.add_argument('output_dir', help='分片输出目录，转换时作为该数据集的 annotations')
+    parser.add_argument('--name', default=None, help='分片名前缀，默认为标注文件夹名')
+    parser.add_argument('--files-per-shard', type=int, default=100000, help='每个分片的标注文件数')
+    parser.add_argument('--format', choices=ARCHIVE_FORMATS, default='tar', help='归档格式')
+    parser.add_argument('--include', nargs='+', help='标注文件的 glob 规则，默认 *.json')
+    parser.add_argument('--exclude', nargs='+', help='排除的文件/目录 glob 规则')
+    parser.add_argument('--recursive', action='store_true', help='递归打包子目录中的标注文件')
+    parser.add_argument('--walk-threads', type=int, default=8, help='递归查找时并行列目录的线程数')
+    args = parser.parse_args(argv)
+    manifest_path = pack_label_dir(args.label_dir, args.output_dir, args.name, args.files_per_shard, args.format,
+                                   include=args.include, exclude=args.exclude, recursive=args.recursive,
+                                   walk_threads=args.walk_threads)
+    print(f"清单已保存到 {manifest_path}")
+
+
+if __name__ == '__main__':
+    main()
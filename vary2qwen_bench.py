@@ -0,0 +1,266 @@
+import argparse
+import copy
+import json
+import os
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import vary2qwen_tets as v2q
+
+CLASSNAMES = ['铁塔', '绝缘子', '防震锤', '导线', '间隔棒', '鸟巢', '塔材', '均压环']
+REGION_CAPTIONS = ['绝缘子串完好，无破损', '塔材表面有明显锈蚀', '导线上挂有异物', '防震锤发生位移']
+VQA_PAIRS = [('图中是否有鸟巢？', '有，位于塔头左侧。'), ('铁塔是否倾斜？', '没有明显倾斜。'),
+             ('图中有几串绝缘子？', '共有三串绝缘子。')]
+
+DEFAULT_MIX = {'grounding': 0.5, 'vqa': 0.3, 'region': 0.2}
+
+
+def _random_box(rng):
+    x1, y1 = rng.randint(0, 900), rng.randint(0, 900)
+    return [x1, y1, rng.randint(x1 + 1, 999), rng.randint(y1 + 1, 999)]
+
+
+def make_grounding_sample(rng, image, boxes_per_caption, classes_per_sample=2):
+    classnames = rng.sample(CLASSNAMES, classes_per_sample)
+    question = '<image>\n找到' + ','.join(f'<ref>{c}</ref>' for c in classnames)
+    answer = ','.join(
+        f'<ref>{c}</ref><box>' + json.dumps([_random_box(rng) for _ in range(boxes_per_caption)]) + '</box>'
+        for c in classnames)
+    return {"image": image, "conversations": [{"from": "human", "value": question},
+                                               {"from": "gpt", "value": answer}]}
+
+
+def make_region_sample(rng, image, boxes_per_caption):
+    boxes = json.dumps([_random_box(rng) for _ in range(boxes_per_caption)])
+    return {"image": image, "conversations": [{"from": "human", "value": f'<image>\n描述区域<box>{boxes}</box>'},
+                                               {"from": "gpt", "value": rng.choice(REGION_CAPTIONS)}]}
+
+
+def make_vqa_sample(rng, image, turns=2):
+    conversations = []
+    for i, (question, answer) in enumerate(rng.sample(VQA_PAIRS, turns)):
+        conversations.append({"from": "human", "value": ('<image>\n' if i == 0 else '') + question})
+        conversations.append({"from": "gpt", "value": answer})
+    return {"image": image, "conversations": conversations}
+
+
+def make_sample(rng, task, index, boxes_per_caption, image_sizes=((1080, 1920), (1920, 1080), (1000, 1000))):
+    image = f'img_{index:07d}.jpg'
+    if task == 'grounding':
+        data = make_grounding_sample(rng, image, boxes_per_caption)
+    elif task == 'region':
+        data = make_region_sample(rng, image, boxes_per_caption)
+    else:
+        data = make_vqa_sample(rng, image)
+    data["height"], data["width"] = rng.choice(image_sizes)
+    return data
+
+
+def generate_synthetic_dataset(root, num_files=1000, boxes_per_caption=3, mix=None, seed=0, name='synthetic'):
+    """
+    生成Vary格式的合成标注文件夹 root/name/，用于基准测试。
+
+    Args:
+        num_files (int): 标注文件数。
+        boxes_per_caption (int): 每个类别/区域的框数。
+        mix (dict): grounding、vqa、region 三类样本的比例。
+    Returns:
+        str: 生成的标注文件夹路径。
+    """
+    mix = mix or DEFAULT_MIX
+    rng = random.Random(seed)
+    tasks, weights = zip(*mix.items())
+    label_dir = os.path.join(root, name)
+    os.makedirs(label_dir, exist_ok=True)
+    for i in range(num_files):
+        task = rng.choices(tasks, weights)[0]
+        data = make_sample(rng, task, i, boxes_per_caption)
+        with open(os.path.join(label_dir, f'{i:07d}.json'), 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+    return label_dir
+
+
+def peak_rss_mb():
+    """当前进程及已结束子进程的峰值常驻内存（MB），平台不支持时返回 None。"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    self_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    # Linux 单位为KB，macOS 为字节
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return round(max(self_rss, children_rss) / scale, 1)
+
+
+def _timed(name, func, items, repeat=1):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for item in items:
+            func(item)
+    seconds = time.perf_counter() - start
+    count = len(items) * repeat
+    return {'name': name, 'records': count, 'seconds': round(seconds, 4),
+            'records_per_sec': round(count / seconds, 1) if seconds > 0 else None,
+            'peak_rss_mb': peak_rss_mb()}
+
+
+def bench_functions(label_dir, repeat=3):
+    """对单个转换函数分别计时。会修改输入的函数在计时前预先复制好输入。"""
+    samples = []
+    for label_file in sorted(os.listdir(label_dir)):
+        with open(os.path.join(label_dir, label_file), 'r', encoding='utf-8') as f:
+            samples.append(json.load(f))
+    grounding = [d for d in samples if v2q.is_grounding_task(d)]
+    others = [d for d in samples if not v2q.is_grounding_task(d)]
+
+    captions = [d["conversations"][1]['value'] for d in grounding]
+    objects = [(v2q.extract_obj(c), (int(d["height"]), int(d["width"]))) for c, d in zip(captions, grounding)]
+
+    results = []
+    # extract_obj 带有缓存，这里清空缓存以测量真实解析开销
+    results.append(_timed('extract_obj', lambda c: (v2q.tokenize_grounded_caption.cache_clear(), v2q.extract_obj(c)),
+                          captions, repeat))
+    results.append(_timed('od_restore_bbox', lambda o: v2q.od_restore_bbox(*o), objects, repeat))
+    results.append(_timed('convert_vary_2grounding', v2q.convert_vary_2grounding,
+                          [copy.deepcopy(d) for d in grounding * repeat]))
+    results.append(_timed('extract_qa_pairs', v2q.extract_qa_pairs,
+                          [copy.deepcopy(d) for d in others * repeat]))
+    return results
+
+
+def bench_end_to_end(sourdir, workers=1, streaming=False):
+    output_dir = tempfile.mkdtemp(prefix='vary2qwen_bench_out_')
+    try:
+        start = time.perf_counter()
+        summaries = v2q.process_dataset(sourdir, output_dir, workers=workers, streaming=streaming)
+        seconds = time.perf_counter() - start
+        records = 0
+        for output_file in os.listdir(output_dir):
+            with open(os.path.join(output_dir, output_file), 'rb') as f:
+                records += sum(1 for _ in f)
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+    return {'name': f'process_dataset(workers={workers}, streaming={streaming})', 'records': records,
+            'seconds': round(seconds, 4), 'records_per_sec': round(records / seconds, 1) if seconds > 0 else None,
+            'peak_rss_mb': peak_rss_mb(), 'summaries': summaries}
+
+
+STARTUP_MODULES = ('vary2qwen_tets', 'vary2qwen_view', 'vary2qwen_cli')
+_IMPORT_SCRIPT = ("import sys, time; start = time.perf_counter(); import {module}; "
+                  "sys.stdout.write(str(time.perf_counter() - start))")
+
+
+def _worker_ready(_):
+    return os.getpid()
+
+
+def bench_imports(modules=STARTUP_MODULES, repeat=5):
+    """在新的解释器中导入各模块，取中位数：import 为导入耗时，process 为整个进程（含解释器启动）的耗时。"""
+    module_dir = os.path.dirname(os.path.abspath(__file__))
+    results = []
+    for module in modules:
+        import_seconds, process_seconds = [], []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            output = subprocess.run([sys.executable, '-c', _IMPORT_SCRIPT.format(module=module)], cwd=module_dir,
+                                    capture_output=True, text=True, check=True).stdout
+            process_seconds.append(time.perf_counter() - start)
+            import_seconds.append(float(output))
+        results.append({'name': f'import {module}', 'import_ms': round(statistics.median(import_seconds) * 1000, 1),
+                        'process_ms': round(statistics.median(process_seconds) * 1000, 1)})
+    return results
+
+
+def bench_pool_startup(workers=4, repeat=3):
+    """进程池从创建到第一个任务返回的耗时，分别测 spawn 与 fork 两种启动方式。"""
+    import multiprocessing
+    results = []
+    for method in ('spawn', 'fork'):
+        if method not in multiprocessing.get_all_start_methods():
+            continue
+        context = multiprocessing.get_context(method)
+        latencies = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            with context.Pool(workers, initializer=v2q._init_worker, initargs=(None, None)) as pool:
+                next(pool.imap_unordered(_worker_ready, range(workers)))
+                latencies.append(time.perf_counter() - start)
+        results.append({'name': f'pool first task ({method}, workers={workers})',
+                        'first_task_ms': round(statistics.median(latencies) * 1000, 1)})
+    return results
+
+
+def bench_worker_startup(workers=4, repeat=5):
+    return bench_imports(repeat=repeat) + bench_pool_startup(workers, repeat)
+
+
+def run_benchmarks(num_files=1000, boxes_per_caption=3, mix=None, workers=(1,), repeat=3, seed=0, workdir=None,
+                   startup_repeat=5):
+    """
+    生成合成数据并运行全部基准测试。
+
+    Returns:
+        dict: 可直接保存为 json 的结果。
+    """
+    sourdir = workdir or tempfile.mkdtemp(prefix='vary2qwen_bench_')
+    try:
+        label_dir = generate_synthetic_dataset(sourdir, num_files, boxes_per_caption, mix, seed)
+        results = bench_functions(label_dir, repeat)
+        for worker_count in workers:
+            results.append(bench_end_to_end(sourdir, worker_count))
+            results.append(bench_end_to_end(sourdir, worker_count, streaming=True))
+    finally:
+        if workdir is None:
+            shutil.rmtree(sourdir, ignore_errors=True)
+    return {'config': {'num_files': num_files, 'boxes_per_caption': boxes_per_caption,
+                       'mix': mix or DEFAULT_MIX, 'workers': list(workers), 'repeat': repeat, 'seed': seed},
+            'python': sys.version.split()[0], 'cpu_count': os.cpu_count(),
+            'results': results, 'startup': bench_worker_startup(max(workers), startup_repeat)}
+
+
+def parse_mix(text):
+    # 例如 "grounding=0.5,vqa=0.3,region=0.2"
+    mix = {}
+    for item in text.split(','):
+        task, weight = item.split('=')
+        if task not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f"未知的样本类型: {task}")
+        mix[task] = float(weight)
+    return mix
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='vary2qwen 转换性能基准测试')
+    parser.add_argument('--files', type=int, default=1000, help='合成标注文件数')
+    parser.add_argument('--boxes', type=int, default=3, help='每个类别/区域的框数')
+    parser.add_argument('--mix', type=parse_mix, default=None, help='样本比例，如 grounding=0.5,vqa=0.3,region=0.2')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1], help='端到端测试使用的进程数，可给多个')
+    parser.add_argument('--repeat', type=int, default=3, help='单函数测试的重复次数')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--startup-repeat', type=int, default=5, help='启动耗时测试的重复次数')
+    parser.add_argument('--output', default='bench_results.json', help='结果json路径')
+    args = parser.parse_args(argv)
+
+    report = run_benchmarks(args.files, args.boxes, args.mix, args.workers, args.repeat, args.seed,
+                            startup_repeat=args.startup_repeat)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    for result in report['results']:
+        print(f"{result['name']:<45} {result['records']:>8} 条  {result['records_per_sec']} 条/秒  "
+              f"峰值内存 {result['peak_rss_mb']} MB")
+    for result in report['startup']:
+        if 'import_ms' in result:
+            print(f"{result['name']:<45} 导入 {result['import_ms']} ms  进程 {result['process_ms']} ms")
+        else:
+            print(f"{result['name']:<45} 首个任务 {result['first_task_ms']} ms")
+    print(f"结果已保存到 {args.output}")
+
+
+if __name__ == '__main__':
+    main()
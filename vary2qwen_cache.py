@@ -0,0 +1,291 @@
+import hashlib
+import json
+import mmap
+import os
+import struct
+import threading
+
+
+class StatCache:
+    """
+    以文件路径为键、以 (mtime, 大小) 校验有效性的持久化缓存。
+
+    文件被修改后 mtime 或大小变化，对应条目自动失效。缓存保存为一个 json 文件：
+        {路径: [mtime_ns, size, 值], ...}
+    保存时会先读取磁盘上的最新内容再合并本进程新增的条目，多个进程先后保存不会互相覆盖。
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.entries = {}
+        self._new = {}
+        if path and os.path.exists(path):
+            self.entries = self._read(path)
+
+    @staticmethod
+    def _read(path):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"读取缓存 {path} 失败，将重新建立: {e}")
+            return {}
+
+    @staticmethod
+    def key(file_path):
+        return os.path.abspath(file_path)
+
+    def get(self, file_path, stat=None):
+        """
+        返回缓存的值；文件不存在、未缓存或已修改时返回 None。
+        """
+        entry = self.entries.get(self.key(file_path))
+        if entry is None:
+            return None
+        if stat is None:
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                return None
+        if entry[0] != stat.st_mtime_ns or entry[1] != stat.st_size:
+            return None
+        return entry[2]
+
+    def put(self, file_path, value, stat=None):
+        if stat is None:
+            stat = os.stat(file_path)
+        entry = [stat.st_mtime_ns, stat.st_size, value]
+        key = self.key(file_path)
+        self.entries[key] = entry
+        self._new[key] = entry
+
+    def drain(self):
+        """取出并清空本进程新增的条目，用于从子进程传回主进程。"""
+        new, self._new = self._new, {}
+        return new
+
+    def merge(self, entries):
+        self.entries.update(entries)
+        self._new.update(entries)
+
+    def save(self):
+        if not self.path or not self._new:
+            return
+        entries = self._read(self.path) if os.path.exists(self.path) else {}
+        entries.update(self._new)
+        tmp_path = f'{self.path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(entries, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp_path, self.path)
+        self.entries = entries
+        self._new = {}
+
+
+class DigestCache:
+    """
+    与 StatCache 用法相同、专门保存16字节摘要（如图像内容哈希）的紧凑缓存。
+
+    每个条目固定40字节：路径的64位哈希、mtime_ns、大小、摘要，按路径哈希排序保存为一个二进制文件，
+    读取时以 mmap 映射后二分查找，不把条目载入内存；多个转换进程映射同一个文件时共用系统页缓存。
+    本进程新增的条目保存在 _new 中，save 时与磁盘上的最新内容按序合并，多个进程先后保存不会互相覆盖。
+    值以十六进制字符串传入、传出。
+    """
+
+    MAGIC = b'V2QDIG01'
+    ENTRY = struct.Struct('<QqQ16s')
+
+    def __init__(self, path=None):
+        self.path = path
+        self._new = {}
+        self._file = None
+        self._map = None
+        self._count = 0
+        self._open()
+
+    def _open(self):
+        self.close()
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            f = open(self.path, 'rb')
+        except OSError as e:
+            print(f"读取缓存 {self.path} 失败，将重新建立: {e}")
+            return
+        size = os.fstat(f.fileno()).st_size
+        if size <= len(self.MAGIC) or (size - len(self.MAGIC)) % self.ENTRY.size \
+                or f.read(len(self.MAGIC)) != self.MAGIC:
+            if size:
+                print(f"缓存 {self.path} 格式不符，将重新建立")
+            f.close()
+            return
+        self._file = f
+        self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._count = (size - len(self.MAGIC)) // self.ENTRY.size
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._file.close()
+        self._file = self._map = None
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    @staticmethod
+    def key(file_path):
+        digest = hashlib.blake2b(os.path.abspath(file_path).encode('utf-8'), digest_size=8).digest()
+        return int.from_bytes(digest, 'little')
+
+    def _entry(self, i):
+        return self.ENTRY.unpack_from(self._map, len(self.MAGIC) + i * self.ENTRY.size)
+
+    def _lookup(self, key):
+        entry = self._new.get(key)
+        if entry is not None:
+            return entry
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            entry = self._entry(mid)
+            if entry[0] < key:
+                lo = mid + 1
+            elif entry[0] > key:
+                hi = mid
+            else:
+                return entry[1:]
+        return None
+
+    def get(self, file_path, stat=None):
+        """
+        返回缓存的值；文件不存在、未缓存或已修改时返回 None。
+        """
+        entry = self._lookup(self.key(file_path))
+        if entry is None:
+            return None
+        if stat is None:
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                return None
+        if entry[0] != stat.st_mtime_ns or entry[1] != stat.st_size:
+            return None
+        return entry[2].hex()
+
+    def put(self, file_path, value, stat=None):
+        if stat is None:
+            stat = os.stat(file_path)
+        self._new[self.key(file_path)] = (stat.st_mtime_ns, stat.st_size, bytes.fromhex(value))
+
+    def drain(self):
+        """取出并清空本进程新增的条目，用于从子进程传回主进程。"""
+        new, self._new = self._new, {}
+        return new
+
+    def merge(self, entries):
+        self._new.update(entries)
+
+    def save(self):
+        if not self.path or not self._new:
+            return
+        # 重新映射磁盘上的最新内容，与新增条目按键合并，相同的键以新增条目为准
+        self._open()
+        new = sorted(self._new.items())
+        tmp_path = f'{self.path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(self.MAGIC)
+            j = 0
+            for i in range(self._count):
+                entry = self._entry(i)
+                while j < len(new) and new[j][0] < entry[0]:
+                    f.write(self.ENTRY.pack(new[j][0], *new[j][1]))
+                    j += 1
+                if j < len(new) and new[j][0] == entry[0]:
+                    continue
+                f.write(self.ENTRY.pack(*entry))
+            for key, entry in new[j:]:
+                f.write(self.ENTRY.pack(key, *entry))
+        os.replace(tmp_path, self.path)
+        self._new = {}
+        self._open()
+
+
+class BlobCache:
+    """
+    按总字节数限制的磁盘缓存，键为字符串，值为字节串，每个值保存为 {cache_dir}/xx/哈希 一个文件。
+
+    以文件 mtime 记录最近使用时间：命中时更新 mtime，总大小超过 max_bytes 时按 mtime 删除最久未使用的文件，
+    直到降到上限的 90%。写入先写临时文件再改名，多个进程、线程可共用同一目录；
+    各进程只按自己看到的写入估计总大小，淘汰时再扫描目录得到准确值。
+    """
+
+    def __init__(self, cache_dir, max_bytes=2 * 1024 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self.nbytes = sum(size for _, size, _ in self._entries())
+
+    def _path(self, key):
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).hexdigest()
+        return os.path.join(self.cache_dir, digest[:2], digest[2:])
+
+    def _entries(self):
+        # [(mtime_ns, 大小, 路径)]，不含写入中的临时文件
+        entries = []
+        with os.scandir(self.cache_dir) as subdirs:
+            for subdir in subdirs:
+                if not subdir.is_dir():
+                    continue
+                with os.scandir(subdir.path) as files:
+                    for entry in files:
+                        if entry.name.endswith('.tmp'):
+                            continue
+                        try:
+                            stat = entry.stat()
+                        except OSError:
+                            continue
+                        entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+        return entries
+
+    def get(self, key):
+        """返回缓存的字节串，未缓存时返回 None。"""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return data
+
+    def put(self, key, data):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self.nbytes += len(data)
+            if self.nbytes > self.max_bytes:
+                self.evict()
+
+    def evict(self, target_bytes=None):
+        """删除最久未使用的文件，直到总大小不超过 target_bytes（默认为上限的 90%）。"""
+        if target_bytes is None:
+            target_bytes = int(self.max_bytes * 0.9)
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= target_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+        self.nbytes = total
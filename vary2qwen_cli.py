@@ -0,0 +1,251 @@
+"""
+vary2qwen 命令行入口。
+
+    python -m vary2qwen_cli convert datasets.json [-o 输出目录] [--only 名称 ...] [--workers N] ...
+    python -m vary2qwen_cli list datasets.json
+    python -m vary2qwen_cli watch datasets.json [--only 名称 ...] [--poll 秒] [--index]
+    python -m vary2qwen_cli review 输出.jsonl [--rows 3] [--cols 4] [--caption 类别] [--sample N]
+    python -m vary2qwen_cli pack 标注目录 分片输出目录 [--files-per-shard N] [--format tar|zip] [--recursive]
+    python -m vary2qwen_cli bench [基准测试参数 ...]
+    python -m vary2qwen_cli stats [统计参数 ...]
+
+配置文件为 json，格式见 datasets.example.json：
+    {
+        "output_dir": 输出目录,
+        "split_ratio": 0.8,
+        "options": {process_label_dir 的公共参数，如 "workers": 16, "streaming": true},
+        "datasets": {名称: {"images": 图像目录, "annotations": 标注目录, "options": {只对该数据集生效的参数}}},
+        "schedule": {"workers": 全局进程预算, "per_volume": 2, "volume_limits": {挂载点: 上限}}
+    }
+命令行给出的参数优先于配置文件中的 options。
+convert --concurrent 按 schedule 并发转换各数据集（见 vary2qwen_schedule），此时 workers 为全局进程预算。
+watch 持续监视各数据集的标注目录，增量转换新到达的文件（见 vary2qwen_watch），Ctrl-C 停止。
+转换模块只在执行 convert、watch 时才导入。
+"""
+import argparse
+import json
+import os
+import sys
+
+
+def load_config(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    if not isinstance(config.get('datasets'), dict):
+        raise ValueError(f"{path} 中缺少 datasets")
+    for name, dataset in config['datasets'].items():
+        missing = [key for key in ('images', 'annotations') if key not in dataset]
+        if missing:
+            raise ValueError(f"{path} 中数据集 {name} 缺少 {', '.join(missing)}")
+    return config
+
+
+def select_datasets(datasets, only=None):
+    if not only:
+        return datasets
+    unknown = [name for name in only if name not in datasets]
+    if unknown:
+        raise SystemExit(f"配置中没有这些数据集: {', '.join(unknown)}")
+    return {name: datasets[name] for name in only}
+
+
+# 命令行参数到 process_label_dir 参数的对应，值为 None 的参数不覆盖配置文件
+CONVERT_OPTIONS = ('workers', 'chunksize', 'streaming', 'incremental', 'split_by', 'probe_sizes', 'size_cache',
+                   'dedup', 'hash_cache', 'preflight', 'preflight_cache', 'preflight_threads',
+                   'index', 'records_per_shard', 'include', 'exclude', 'recursive', 'walk_threads',
+                   'bytes_per_shard', 'shuffle_seed', 'save_metrics', 'progress_interval')
+
+
+def cmd_convert(args):
+    config = load_config(args.config)
+    output_dir = args.output or config.get('output_dir')
+    if not output_dir:
+        raise SystemExit("未指定输出目录：请在配置中给出 output_dir 或使用 -o")
+    split_ratio = args.split_ratio if args.split_ratio is not None else config.get('split_ratio', 0.8)
+    options = dict(config.get('options', {}))
+    for key in CONVERT_OPTIONS:
+        value = getattr(args, key)
+        if value is not None:
+            options[key] = value
+    datasets = select_datasets(config['datasets'], args.only)
+
+    os.makedirs(output_dir, exist_ok=True)
+    failed = []
+    if args.concurrent:
+        from vary2qwen_schedule import schedule_datasets
+        schedule = dict(config.get('schedule', {}))
+        schedule.setdefault('workers', options.pop('workers', None))
+        options.pop('workers', None)
+        if args.workers is not None:
+            schedule['workers'] = args.workers
+        if args.per_volume is not None:
+            schedule['per_volume'] = args.per_volume
+        report = schedule_datasets(datasets, output_dir, split_ratio, report_path=args.schedule_report,
+                                   **schedule, **options)
+        summaries, failed = report['summaries'], report['failed']
+    else:
+        from vary2qwen_tets import process_datasets
+        summaries = process_datasets(datasets, output_dir, split_ratio, **options)
+    if args.summary:
+        with open(args.summary, 'w', encoding='utf-8') as f:
+            json.dump(summaries, f, ensure_ascii=False, indent=2)
+        print(f"运行汇总已保存到 {args.summary}")
+    if failed:
+        raise SystemExit(f"以下数据集转换失败: {', '.join(failed)}")
+
+
+# 命令行参数到 watch_label_dir 参数的对应
+WATCH_ARGS = {'poll': 'poll_interval', 'settle': 'settle', 'rescan_interval': 'rescan_interval',
+              'compact_idle': 'compact_idle', 'index': 'index', 'split_by': 'split_by', 'workers': 'workers',
+              'include': 'include', 'exclude': 'exclude', 'recursive': 'recursive'}
+
+
+def cmd_watch(args):
+    from vary2qwen_watch import watch_datasets
+    config = load_config(args.config)
+    output_dir = args.output or config.get('output_dir')
+    if not output_dir:
+        raise SystemExit("未指定输出目录：请在配置中给出 output_dir 或使用 -o")
+    split_ratio = args.split_ratio if args.split_ratio is not None else config.get('split_ratio', 0.8)
+    options = dict(config.get('options', {}))
+    for arg, key in WATCH_ARGS.items():
+        value = getattr(args, arg)
+        if value is not None:
+            options[key] = value
+    os.makedirs(output_dir, exist_ok=True)
+    totals = watch_datasets(select_datasets(config['datasets'], args.only), output_dir, split_ratio, **options)
+    failed = [name for name, total in totals.items() if 'error' in total]
+    if failed:
+        raise SystemExit(f"以下数据集监视失败: {', '.join(failed)}")
+
+
+def cmd_list(args):
+    config = load_config(args.config)
+    for name, dataset in select_datasets(config['datasets'], args.only).items():
+        label_dir = dataset['annotations']
+        if os.path.exists(label_dir):
+            from vary2qwen_schedule import count_dataset_files
+            status = f"{count_dataset_files(dataset, config.get('options'))} 个标注文件"
+        else:
+            status = "标注目录不存在"
+        print(f"{name}\t{status}\t图像: {dataset['images']}\t标注: {label_dir}")
+
+
+def cmd_review(args):
+    from vary2qwen_view import review_jsonl
+    review_jsonl(args.jsonl, args.rows, args.cols, sample=args.sample, seed=args.seed, caption=args.caption,
+                 tile_size=args.tile_size, threads=args.threads, font_path=args.font, cache_dir=args.cache_dir)
+
+
+def cmd_pack(args):
+    from vary2qwen_archive import pack_label_dir
+    manifest_path = pack_label_dir(args.label_dir, args.output_dir, args.name, args.files_per_shard, args.format,
+                                   include=args.include, exclude=args.exclude, recursive=args.recursive,
+                                   walk_threads=args.walk_threads)
+    print(f"清单已保存到 {manifest_path}")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='python -m vary2qwen_cli', description='Vary 标注转换为 Qwen 格式')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    convert = subparsers.add_parser('convert', help='按配置文件转换数据集')
+    convert.add_argument('config', help='数据集配置文件（json）')
+    convert.add_argument('-o', '--output', help='输出目录，覆盖配置中的 output_dir')
+    convert.add_argument('--only', nargs='+', help='只转换这些数据集')
+    convert.add_argument('--split-ratio', type=float, help='训练集比例')
+    convert.add_argument('--workers', type=int, help='转换进程数')
+    convert.add_argument('--chunksize', type=int, help='每次分发给子进程的文件数')
+    convert.add_argument('--streaming', action='store_true', default=None, help='流式按哈希划分写出')
+    convert.add_argument('--incremental', action='store_true', default=None, help='增量转换')
+    convert.add_argument('--split-by', choices=['image', 'record'], help='流式模式下的划分依据')
+    convert.add_argument('--probe-sizes', choices=['missing', 'verify'], help='从图像文件头读取宽高')
+    convert.add_argument('--size-cache', help='图像尺寸缓存文件')
+    convert.add_argument('--dedup', choices=['drop', 'flag'], help='跨数据集去重')
+    convert.add_argument('--hash-cache', help='图像哈希缓存文件')
+    convert.add_argument('--preflight', choices=['header', 'decode'], help='写出前预检图像')
+    convert.add_argument('--preflight-cache', help='图像预检结果缓存文件')
+    convert.add_argument('--preflight-threads', type=int, help='图像预检线程数')
+    convert.add_argument('--include', nargs='+', help='标注文件的 glob 规则，默认 *.json')
+    convert.add_argument('--exclude', nargs='+', help='排除的文件/目录 glob 规则')
+    convert.add_argument('--recursive', action='store_true', default=None, help='递归查找子目录中的标注文件')
+    convert.add_argument('--walk-threads', type=int, help='递归查找时并行列目录的线程数')
+    convert.add_argument('--index', action='store_true', default=None, help='为输出建立偏移索引与类别索引')
+    convert.add_argument('--records-per-shard', type=int, help='按记录数切分输出')
+    convert.add_argument('--bytes-per-shard', type=int, help='按字节数切分输出')
+    convert.add_argument('--shuffle-seed', type=int, help='分片输出后以该种子全局打乱')
+    convert.add_argument('--save-metrics', action='store_true', default=None, help='保存每个数据集的运行汇总')
+    convert.add_argument('--progress-interval', type=float, help='每隔多少秒打印一次进度')
+    convert.add_argument('--concurrent', action='store_true', help='在全局进程预算（--workers）内并发转换各数据集')
+    convert.add_argument('--per-volume', type=int, help='并发转换时每个挂载点上同时运行的数据集数')
+    convert.add_argument('--schedule-report', help='并发转换时将调度报告保存到该 json 文件')
+    convert.add_argument('--summary', help='将全部数据集的运行汇总保存到该 json 文件')
+    convert.set_defaults(func=cmd_convert)
+
+    listing = subparsers.add_parser('list', help='列出配置中的数据集及标注文件数')
+    listing.add_argument('config', help='数据集配置文件（json）')
+    listing.add_argument('--only', nargs='+', help='只列出这些数据集')
+    listing.set_defaults(func=cmd_list)
+
+    watch = subparsers.add_parser('watch', help='持续监视标注目录，增量转换新增或修改的标注文件')
+    watch.add_argument('config', help='数据集配置文件（json）')
+    watch.add_argument('-o', '--output', help='输出目录，覆盖配置中的 output_dir')
+    watch.add_argument('--only', nargs='+', help='只监视这些数据集')
+    watch.add_argument('--split-ratio', type=float, help='训练集比例')
+    watch.add_argument('--split-by', choices=['image', 'record'], help='划分依据')
+    watch.add_argument('--poll', type=float, help='改用轮询，每隔该秒数检查一次（默认使用 inotify）')
+    watch.add_argument('--settle', type=float, help='等待同一批文件到达的静默时间（秒）')
+    watch.add_argument('--rescan-interval', type=float, help='每隔多少秒全量核对一次标注目录')
+    watch.add_argument('--compact-idle', type=float, help='空闲多少秒后压缩输出中的失效记录')
+    watch.add_argument('--index', action='store_true', default=None, help='同步更新偏移索引与类别索引')
+    watch.add_argument('--workers', type=int, help='启动时补齐所用的转换进程数')
+    watch.add_argument('--include', nargs='+', help='标注文件的 glob 规则，默认 *.json')
+    watch.add_argument('--exclude', nargs='+', help='排除的文件/目录 glob 规则')
+    watch.add_argument('--recursive', action='store_true', default=None, help='监视各级子目录')
+    watch.set_defaults(func=cmd_watch)
+
+    review = subparsers.add_parser('review', help='分页网格审阅转换输出，见 vary2qwen_view.MosaicViewer')
+    review.add_argument('jsonl', help='输出 jsonl 文件')
+    review.add_argument('--rows', type=int, default=3, help='每页行数')
+    review.add_argument('--cols', type=int, default=4, help='每页列数')
+    review.add_argument('--tile-size', type=int, default=320, help='缩略图边长（像素）')
+    review.add_argument('--threads', type=int, default=8, help='后台渲染线程数')
+    review.add_argument('--caption', default=None, help='只审阅包含该类别的记录')
+    review.add_argument('--sample', type=int, default=None, help='随机抽查的记录数')
+    review.add_argument('--seed', type=int, default=None, help='抽查的随机种子')
+    review.add_argument('--font', default=None, help='中文字体文件路径')
+    review.add_argument('--cache-dir', default=None, help='缩略图与叠加图的磁盘缓存目录')
+    review.set_defaults(func=cmd_review)
+
+    pack = subparsers.add_parser('pack', help='将标注文件夹打包为 tar/zip 分片，见 vary2qwen_archive')
+    pack.add_argument('label_dir', help='标注文件夹')
+    pack.add_argument('output_dir', help='分片输出目录，转换时作为该数据集的 annotations')
+    pack.add_argument('--name', default=None, help='分片名前缀，默认为标注文件夹名')
+    pack.add_argument('--files-per-shard', type=int, default=100000, help='每个分片的标注文件数')
+    pack.add_argument('--format', choices=['tar', 'zip'], default='tar', help='归档格式')
+    pack.add_argument('--include', nargs='+', help='标注文件的 glob 规则，默认 *.json')
+    pack.add_argument('--exclude', nargs='+', help='排除的文件/目录 glob 规则')
+    pack.add_argument('--recursive', action='store_true', help='递归打包子目录中的标注文件')
+    pack.add_argument('--walk-threads', type=int, default=8, help='递归查找时并行列目录的线程数')
+    pack.set_defaults(func=cmd_pack)
+
+    # bench、stats 的参数原样交给 vary2qwen_bench.main、vary2qwen_stats.main，见 main
+    subparsers.add_parser('bench', help='运行性能基准测试，参数见 python -m vary2qwen_cli bench -h', add_help=False)
+    subparsers.add_parser('stats', help='统计输出或原始标注，参数见 python -m vary2qwen_cli stats -h', add_help=False)
+    return parser
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if argv[:1] == ['bench']:
+        from vary2qwen_bench import main as bench_main
+        return bench_main(argv[1:])
+    if argv[:1] == ['stats']:
+        from vary2qwen_stats import main as stats_main
+        return stats_main(argv[1:])
+    args = build_parser().parse_args(argv)
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,185 @@
+import hashlib
+import json
+import re
+import unicodedata
+from array import array
+from functools import lru_cache
+
+from vary2qwen_cache import DigestCache
+
+DEDUP_MODES = ('drop', 'flag')
+
+
+class HashSet:
+    """
+    只保存64位整数键的开放寻址哈希集合，每个槽8字节，装载率超过一半时扩容一倍。
+    键本身应是均匀的哈希值（如 key64 的结果），流式去重时内存约为同等 Python set 的十分之一。
+    """
+
+    def __init__(self, capacity=1 << 16):
+        size = 8
+        while size < capacity * 2:
+            size <<= 1
+        self._slots = array('Q', bytes(8 * size))
+        self._mask = size - 1
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def _find(self, key):
+        # 返回键所在的槽，或应当插入的空槽
+        slots = self._slots
+        i = key & self._mask
+        while True:
+            value = slots[i]
+            if value == 0 or value == key:
+                return i
+            i = (i + 1) & self._mask
+
+    def add(self, key):
+        """加入键，返回之前是否不存在。"""
+        key = key or 1  # 0 表示空槽
+        i = self._find(key)
+        if self._slots[i] == key:
+            return False
+        self._slots[i] = key
+        self._count += 1
+        if self._count * 2 > len(self._slots):
+            self._grow()
+        return True
+
+    def __contains__(self, key):
+        key = key or 1
+        return self._slots[self._find(key)] == key
+
+    def _grow(self):
+        old = self._slots
+        self._slots = array('Q', bytes(16 * len(old)))
+        self._mask = len(self._slots) - 1
+        for key in old:
+            if key:
+                self._slots[self._find(key)] = key
+
+
+def key64(*parts):
+    """将若干字符串合成一个64位整数键。"""
+    digest = hashlib.blake2b('\x1f'.join(parts).encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little')
+
+
+def file_hash(path, chunk_size=1 << 20):
+    """图像文件内容的哈希（blake2b-128 十六进制）。"""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ImageHasher:
+    """
+    带持久化缓存的图像内容哈希，缓存按路径与mtime失效。
+    多个数据集共用同一批图像目录时只需读取一次图像内容。
+    缓存为 DigestCache，各转换进程映射同一个缓存文件而不各自载入一份。
+    """
+
+    def __init__(self, cache_path=None):
+        self.cache = DigestCache(cache_path)
+
+    def hash(self, image_path):
+        """返回图像内容哈希；图像不存在或无法读取时返回 None。"""
+        value = self.cache.get(image_path)
+        if value is None:
+            try:
+                value = file_hash(image_path)
+                self.cache.put(image_path, value)
+            except OSError:
+                return None
+        return value
+
+    def save(self):
+        self.cache.save()
+
+
+_SPACE_RE = re.compile(r'\s+')
+
+
+def normalize_text(text):
+    """去重用的文本规范化：全角转半角、去掉 <image> 标记、合并空白、转小写。"""
+    text = unicodedata.normalize('NFKC', text).replace('<image>', ' ')
+    return _SPACE_RE.sub(' ', text).strip().lower()
+
+
+def record_text(record):
+    """
+    记录中用于判断重复的文本：问答取规范化后的 query 与 response；
+    grounding 记录的 response 是固定的占位符，改用全部目标的类别和框。
+    """
+    query = normalize_text(record.get("query", ''))
+    if "objects" in record:
+        answer = json.dumps(record["objects"], ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    else:
+        answer = normalize_text(record.get("response", ''))
+    return query + '\x1f' + answer
+
+
+class Deduplicator:
+    """
+    跨数据集的流式去重。
+
+    同一图像内容（不论路径）上规范化后相同的问答或grounding标注视为重复，只保留第一次出现的记录。
+    已见过的记录只以64位键保存在 HashSet 中，内存与记录内容无关。
+    split_key 返回图像内容哈希，用作训练集/验证集的划分键，同一张图（即使路径不同）总是落在同一集合。
+    无法读取的图像退回按路径判断。
+
+    Args:
+        mode (str): 'drop' 丢弃重复记录；'flag' 保留但记录到重复日志。
+        cache_path (str): 图像哈希缓存文件路径，多个数据集可共用同一个缓存。
+    """
+
+    def __init__(self, mode='drop', cache_path=None):
+        if mode not in DEDUP_MODES:
+            raise ValueError(f"不支持的去重方式: {mode}")
+        # vary2qwen_tets 在模块级导入本模块，这里延迟导入以免循环
+        from vary2qwen_tets import record_image
+        self.mode = mode
+        self._record_image = record_image
+        self.hasher = ImageHasher(cache_path)
+        self.records = HashSet()
+        self.duplicates = 0
+        # 同一张图的多条问答通常相邻，缓存最近的结果以免重复 stat
+        self._image_key = lru_cache(maxsize=65536)(self._compute_image_key)
+
+    def _compute_image_key(self, image_path):
+        digest = self.hasher.hash(image_path) if image_path else None
+        return digest if digest is not None else 'path:' + image_path
+
+    def split_key(self, record):
+        return self._image_key(self._record_image(record))
+
+    def is_duplicate(self, record):
+        image_key = self.split_key(record)
+        if self.records.add(key64(image_key, record_text(record))):
+            return False
+        self.duplicates += 1
+        return True
+
+    def filter(self, records, log=None):
+        """
+        返回应写出的记录：'drop' 模式下去掉重复记录，'flag' 模式下全部保留。
+        给定 log（文本文件）时每条重复记录写一行 {"image", "image_key", "query"}。
+        """
+        kept = []
+        for record in records:
+            if self.is_duplicate(record):
+                if log is not None:
+                    log.write(json.dumps({"image": self._record_image(record), "image_key": self.split_key(record),
+                                          "query": record.get("query", '')}, ensure_ascii=False) + '\n')
+                if self.mode == 'drop':
+                    continue
+            kept.append(record)
+        return kept
+
+    def save(self):
+        self.hasher.save()
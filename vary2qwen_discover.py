@@ -0,0 +1,250 @@
+import fnmatch
+import os
+import queue
+import re
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from vary2qwen_archive import ARCHIVE_MANIFEST_SUFFIX
+
+# 标注文件发现：用 os.scandir 遍历标注目录，边遍历边产出，不先构建完整的文件列表。
+#   - 目录项的类型来自 scandir 本身（Linux 上为 d_type），判断文件/目录不需要逐个 stat；
+#     需要大小和mtime时（增量模式）用 LabelEntry.stat()，每个文件只 stat 一次；
+#   - recursive 为真时递归遍历子目录，各子树的目录由线程池并行列出，网络文件系统上列目录的延迟可以重叠；
+#   - include/exclude 为 glob 规则，见 LabelWalker；归档的打包清单 *.archives.json 不是标注文件，总是跳过。
+class LabelEntry(namedtuple('LabelEntry', ['name', 'path', 'entry'])):
+    """发现的标注文件：name 为相对标注目录的路径（以 / 分隔），entry 为 os.DirEntry。"""
+    __slots__ = ()
+
+    def stat(self):
+        # DirEntry 缓存 stat 结果，重复调用不再访问文件系统
+        return self.entry.stat()
+
+
+DEFAULT_INCLUDE = ('*.json',)
+
+
+def _compile(patterns):
+    return re.compile('|'.join(fnmatch.translate(p) for p in patterns)).match if patterns else None
+
+
+def _suffix(pattern):
+    # '*.json' 这类规则等价于后缀判断，返回后缀，否则返回 None
+    if pattern.startswith('*') and not any(c in pattern[1:] for c in '*?[/'):
+        return pattern[1:]
+    return None
+
+
+def compile_globs(patterns):
+    """
+    将 glob 规则编译为匹配函数 match(相对路径)。不含 / 的规则匹配文件名，含 / 的规则匹配相对路径，
+    此时 * 与 ? 也匹配 /，如 'train/*' 匹配 train 下任意深度的文件。
+    """
+    if not patterns:
+        return None
+    if isinstance(patterns, str):
+        patterns = [patterns]
+    suffixes = tuple(_suffix(p) for p in patterns if _suffix(p) is not None)
+    match_name = _compile([p for p in patterns if '/' not in p and _suffix(p) is None])
+    match_path = _compile([p.strip('/') for p in patterns if '/' in p])
+    if match_name is None and match_path is None:
+        return lambda name: name.endswith(suffixes)
+
+    def match(name):
+        return bool(name.endswith(suffixes)
+                    or (match_name is not None and match_name(name.rpartition('/')[2]))
+                    or (match_path is not None and match_path(name)))
+    return match
+
+
+class LabelWalker:
+    """
+    标注文件遍历器。
+
+    Args:
+        include: 文件需匹配的 glob 规则（一个或多个），默认 '*.json'。
+        exclude: 排除的 glob 规则，匹配的文件被跳过，匹配的目录不再进入。
+        recursive (bool): 是否递归遍历子目录，默认只遍历标注目录本身。
+        threads (int): 递归遍历时并行列目录的线程数。
+        sort (bool): 为真时按名称深度优先产出，重复运行顺序一致，每个目录列完后才产出其中的文件；
+            为假时按发现顺序产出，目录边列边产出，各子树并行，顺序不固定。
+    """
+
+    def __init__(self, include=None, exclude=None, recursive=False, threads=8, sort=True):
+        self.include = compile_globs(include or DEFAULT_INCLUDE)
+        self.exclude = compile_globs(exclude)
+        self.recursive = recursive
+        self.threads = max(1, threads or 1)
+        self.sort = sort
+
+    def match_file(self, name):
+        """相对路径为 name 的文件是否为标注文件。"""
+        return (self.exclude is None or not self.exclude(name)) and self.include(name)
+
+    def match_dir(self, name):
+        """是否进入相对路径为 name 的子目录。"""
+        return self.recursive and (self.exclude is None or not self.exclude(name))
+
+    def _classify(self, entry, prefix):
+        # 返回 ('file' | 'dir' | None, 相对路径)
+        # 类型判断使用 scandir 返回的 d_type，先做字符串匹配，跳过的目录项不再判断类型
+        name = prefix + entry.name
+        if self.exclude is not None and self.exclude(name):
+            return None, name
+        try:
+            if self.recursive and entry.is_dir(follow_symlinks=False):
+                return 'dir', name
+            if self.include(name) and not name.endswith(ARCHIVE_MANIFEST_SUFFIX) and entry.is_file():
+                return 'file', name
+        except OSError:
+            pass
+        return None, name
+
+    def _scan(self, directory, prefix):
+        # 列出一个目录，返回 (文件列表, 子目录列表)
+        files, subdirs = [], []
+        try:
+            with os.scandir(directory) as it:
+                entries = list(it)
+        except OSError as e:
+            if not prefix:
+                raise
+            print(f"无法列出目录 {directory}: {e}")
+            return files, subdirs
+        for entry in entries:
+            kind, name = self._classify(entry, prefix)
+            if kind == 'file':
+                files.append(LabelEntry(name, entry.path, entry))
+            elif kind == 'dir':
+                subdirs.append((entry.path, name + '/'))
+        if self.sort:
+            files.sort(key=lambda e: e.name)
+            subdirs.sort()
+        return files, subdirs
+
+    def walk(self, label_dir):
+        """产出 label_dir 下的标注文件 LabelEntry。"""
+        if self.sort:
+            return self._walk_sorted(label_dir)
+        return self._walk_found(label_dir)
+
+    def count(self, label_dir):
+        """label_dir 下的标注文件数，按发现顺序并行遍历，不排序、不 stat。"""
+        return sum(1 for _ in self._walk_found(label_dir))
+
+    def _walk_sorted(self, label_dir):
+        files, subdirs = self._scan(label_dir, '')
+        yield from files
+        if not subdirs:
+            return
+        # 深度优先，栈顶即接下来要产出的目录；栈顶的若干目录提前交给线程池列出
+        prefetch = self.threads * 4
+        with ThreadPoolExecutor(max_workers=self.threads) as executor:
+            stack = [[directory, prefix, None] for directory, prefix in reversed(subdirs)]
+            while stack:
+                for item in stack[-prefetch:]:
+                    if item[2] is None:
+                        item[2] = executor.submit(self._scan, item[0], item[1])
+                files, subdirs = stack.pop()[2].result()
+                stack.extend([directory, prefix, None] for directory, prefix in reversed(subdirs))
+                yield from files
+
+    def _walk_found(self, label_dir, batch=1024):
+        if not self.recursive:
+            # 单层目录：直接消费 scandir 迭代器，第一个文件无需等待整个目录列完
+            with os.scandir(label_dir) as it:
+                for entry in it:
+                    if self._classify(entry, '')[0] == 'file':
+                        yield LabelEntry(entry.name, entry.path, entry)
+            return
+
+        files, subdirs = self._scan(label_dir, '')
+        yield from files
+        if not subdirs:
+            return
+        # 各目录由线程池边列边把文件分批放入队列，子目录作为新任务提交；
+        # pending 为未完成的目录数（含 label_dir 本身），提交前加一、目录结束时减一，归零时放入 ('end', None)
+        results = queue.Queue(maxsize=self.threads * 4)
+        stopped = threading.Event()
+        lock = threading.Lock()
+        pending = [1]
+
+        def put(item):
+            while not stopped.is_set():
+                try:
+                    results.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def finish():
+            with lock:
+                pending[0] -= 1
+                finished = pending[0] == 0
+            if finished:
+                put(('end', None))
+
+        def submit(directory, prefix):
+            with lock:
+                pending[0] += 1
+            executor.submit(scan, directory, prefix)
+
+        def scan(directory, prefix):
+            found = []
+            if stopped.is_set():
+                return
+            try:
+                with os.scandir(directory) as it:
+                    for entry in it:
+                        kind, name = self._classify(entry, prefix)
+                        if kind == 'file':
+                            found.append(LabelEntry(name, entry.path, entry))
+                            if len(found) >= batch:
+                                if not put(('files', found)):
+                                    return
+                                found = []
+                        elif kind == 'dir' and not stopped.is_set():
+                            submit(entry.path, name + '/')
+            except OSError as e:
+                print(f"无法列出目录 {directory}: {e}")
+            finally:
+                # 出错时也要报告目录结束，否则遍历无法结束
+                if not found or put(('files', found)):
+                    finish()
+
+        executor = ThreadPoolExecutor(max_workers=self.threads)
+        try:
+            for directory, prefix in subdirs:
+                submit(directory, prefix)
+            finish()
+            while True:
+                kind, value = results.get()
+                if kind == 'end':
+                    break
+                yield from value
+        finally:
+            stopped.set()
+            executor.shutdown(wait=True, cancel_futures=True)
+
+
+def walk_label_files(label_dir, include=None, exclude=None, recursive=False, threads=8, sort=True):
+    """产出 label_dir 下的标注文件 LabelEntry，参数见 LabelWalker。"""
+    return LabelWalker(include, exclude, recursive, threads, sort).walk(label_dir)
+
+
+def timed(iterable, metrics, stage='list'):
+    """逐个产出 iterable 的元素，等待下一个元素的耗时累加到 metrics 的 stage 阶段。"""
+    iterator = iter(iterable)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            if metrics is not None:
+                metrics.tick(stage, start)
+        yield item
@@ -0,0 +1,484 @@
+import argparse
+import json
+import mmap
+import os
+import random
+import re
+import struct
+import sys
+from array import array
+
+# 偏移索引文件格式：
+#   8字节魔数 + 8字节已索引的jsonl字节数（小端uint64），之后每条记录一个小端uint64起始偏移。
+INDEX_MAGIC = b'V2QIDX\x00\x01'
+INDEX_HEADER = struct.Struct('<8sQ')
+
+# 类别倒排索引文件格式：
+#   8字节魔数 + 已索引的jsonl字节数 + 已索引的记录数 + 类别表长度（均为小端无符号整数），
+#   之后为类别表（utf-8 json，{类别: [起始位置, 记录数, 框数]}），补齐到4字节对齐，
+#   最后是全部类别依次拼接的记录下标数组与等长的每条记录框数数组（小端uint32）。
+CAPTION_INDEX_MAGIC = b'V2QCLS\x00\x01'
+CAPTION_INDEX_HEADER = struct.Struct('<8sQQI')
+# 与 vary2qwen_tets.GROUNDING_TAG_RE 相同的 ref/box 标签
+REF_BOX_RE = re.compile(r'<(ref|box)>(.*?)</\1>')
+
+
+def index_path_for(jsonl_path):
+    return jsonl_path + '.idx'
+
+
+def _scan_offsets(f, start):
+    """
+    从 start 开始扫描完整的行（以换行结尾），返回 (各非空行的起始偏移, 扫描结束的位置)。
+    未以换行结尾的最后一行可能仍在写入，不计入。
+    """
+    offsets = array('Q')
+    pos = start
+    f.seek(start)
+    for line in f:
+        if not line.endswith(b'\n'):
+            break
+        if line.strip():
+            offsets.append(pos)
+        pos += len(line)
+    return offsets, pos
+
+
+def _to_little_endian(offsets):
+    if sys.byteorder != 'little':
+        offsets = array('Q', offsets)
+        offsets.byteswap()
+    return offsets
+
+
+def _read_header(index_path):
+    with open(index_path, 'rb') as f:
+        header = f.read(INDEX_HEADER.size)
+    if len(header) < INDEX_HEADER.size:
+        return None
+    magic, indexed_size = INDEX_HEADER.unpack(header)
+    return indexed_size if magic == INDEX_MAGIC else None
+
+
+def build_index(jsonl_path, index_path=None):
+    """
+    一次扫描建立 jsonl 文件的行偏移索引，返回记录数。
+    """
+    index_path = index_path or index_path_for(jsonl_path)
+    with open(jsonl_path, 'rb') as f:
+        offsets, indexed_size = _scan_offsets(f, 0)
+    tmp_path = index_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(INDEX_HEADER.pack(INDEX_MAGIC, indexed_size))
+        _to_little_endian(offsets).tofile(f)
+    os.replace(tmp_path, index_path)
+    return len(offsets)
+
+
+def update_index(jsonl_path, index_path=None):
+    """
+    使索引与 jsonl 文件同步：文件只是追加了内容时只扫描新增部分，否则重建。返回记录数。
+    被重写（而非追加）过的文件应直接调用 build_index。
+    """
+    index_path = index_path or index_path_for(jsonl_path)
+    indexed_size = _read_header(index_path) if os.path.exists(index_path) else None
+    size = os.path.getsize(jsonl_path)
+    if indexed_size is None or indexed_size > size:
+        return build_index(jsonl_path, index_path)
+
+    with open(jsonl_path, 'rb') as f:
+        if indexed_size > 0:
+            # 已索引部分必须恰好在行尾结束，否则说明文件被改写过
+            f.seek(indexed_size - 1)
+            if f.read(1) != b'\n':
+                return build_index(jsonl_path, index_path)
+        offsets, new_size = _scan_offsets(f, indexed_size)
+
+    with open(index_path, 'r+b') as f:
+        f.seek(0, os.SEEK_END)
+        _to_little_endian(offsets).tofile(f)
+        f.seek(0)
+        f.write(INDEX_HEADER.pack(INDEX_MAGIC, new_size))
+        count = (f.seek(0, os.SEEK_END) - INDEX_HEADER.size) // 8
+    return count
+
+
+class IndexedJsonl:
+    """
+    基于偏移索引和内存映射的 jsonl 随机访问读取器，get(i) 为 O(1)。
+
+    支持 len()、整数和切片下标、均匀随机采样，可直接作为下游数据加载器的数据源。
+    对象可被pickle（只保存路径），在子进程中首次访问时重新打开映射。
+
+    Args:
+        jsonl_path (str): jsonl 文件路径。
+        build (bool): 索引不存在或落后于文件时是否自动建立/更新。
+    """
+
+    def __init__(self, jsonl_path, build=True):
+        self.jsonl_path = jsonl_path
+        self.index_path = index_path_for(jsonl_path)
+        if build:
+            update_index(jsonl_path, self.index_path)
+        self._data = None
+        self._index_map = None
+        self._offsets = None
+        self._end = 0
+        self._open()
+
+    def _open(self):
+        self._end = _read_header(self.index_path)
+        if self._end is None:
+            raise ValueError(f"无效的索引文件: {self.index_path}")
+        with open(self.index_path, 'rb') as f:
+            self._index_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if sys.byteorder == 'little':
+            # 直接在映射上按uint64解释，不复制
+            self._offsets = memoryview(self._index_map)[INDEX_HEADER.size:].cast('Q')
+        else:
+            self._offsets = array('Q', self._index_map[INDEX_HEADER.size:])
+            self._offsets.byteswap()
+        if self._end > 0:
+            with open(self.jsonl_path, 'rb') as f:
+                self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __getstate__(self):
+        return {'jsonl_path': self.jsonl_path, 'index_path': self.index_path}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._data = None
+        self._index_map = None
+        self._offsets = None
+        self._end = 0
+        self._open()
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def offset(self, i):
+        """第 i 条记录在 jsonl 文件中的起始字节偏移。"""
+        return self._offsets[i]
+
+    def get_raw(self, i):
+        """返回第 i 条记录的原始字节（不含换行）。"""
+        n = len(self._offsets)
+        if i < 0:
+            i += n
+        if not 0 <= i < n:
+            raise IndexError(f"记录下标越界: {i}")
+        start = self._offsets[i]
+        end = self._offsets[i + 1] if i + 1 < n else self._end
+        return self._data[start:end].rstrip(b'\r\n')
+
+    def get(self, i):
+        return json.loads(self.get_raw(i))
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self.get(j) for j in range(*i.indices(len(self)))]
+        return self.get(i)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.get(i)
+
+    def sample_indices(self, k, seed=None):
+        """不放回地均匀采样 k 个下标（k 超过记录数时返回全部），按采样顺序返回。"""
+        n = len(self)
+        return random.Random(seed).sample(range(n), min(k, n))
+
+    def sample(self, k, seed=None):
+        return [self.get(i) for i in self.sample_indices(k, seed)]
+
+    def close(self):
+        if isinstance(self._offsets, memoryview):
+            self._offsets.release()
+        self._offsets = array('Q')
+        if self._index_map is not None:
+            self._index_map.close()
+            self._index_map = None
+        if self._data is not None:
+            self._data.close()
+            self._data = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def caption_index_path_for(jsonl_path):
+    return jsonl_path + '.cls'
+
+
+def _count_boxes(bbox):
+    # [x1, y1, x2, y2] 计为一个框，[[...], [...]] 按个数计
+    if not bbox:
+        return 0
+    return len(bbox) if isinstance(bbox[0], list) else 1
+
+
+def record_captions(record):
+    """
+    返回一条输出记录中的 {类别: 框数}。
+
+    grounding 记录取 objects[].caption 与对应的框数；region/vqa 记录取 query 和 response 中的 <ref> 标签，
+    框数为紧随其后的 <box> 中的框数（没有时为0）。
+    """
+    captions = {}
+    for obj in record.get("objects") or ():
+        caption = obj.get('caption')
+        if caption:
+            captions[caption] = captions.get(caption, 0) + _count_boxes(obj.get('bbox'))
+    for field in ("query", "response"):
+        text = record.get(field)
+        if not text or '<ref>' not in text:
+            continue
+        last_ref = None
+        for tag, value in REF_BOX_RE.findall(text):
+            if tag == 'ref':
+                last_ref = value
+                captions.setdefault(value, 0)
+            elif last_ref is not None:
+                try:
+                    captions[last_ref] += _count_boxes(json.loads(value))
+                except ValueError:
+                    pass
+                last_ref = None
+    return captions
+
+
+def _scan_captions(f, start, first_record, postings):
+    """
+    与 _scan_offsets 相同的规则逐行扫描，把每条记录的类别追加到 postings（{类别: (记录下标数组, 框数数组)}）。
+    返回 (扫描结束的位置, 记录总数)。
+    """
+    pos = start
+    record = first_record
+    f.seek(start)
+    for line in f:
+        if not line.endswith(b'\n'):
+            break
+        pos += len(line)
+        if not line.strip():
+            continue
+        # 没有类别的记录（如普通问答）无需解析
+        if b'"objects"' in line or b'<ref>' in line:
+            for caption, boxes in record_captions(json.loads(line)).items():
+                if caption not in postings:
+                    postings[caption] = (array('I'), array('I'))
+                records, box_counts = postings[caption]
+                records.append(record)
+                box_counts.append(boxes)
+        record += 1
+    return pos, record
+
+
+def _write_caption_index(index_path, indexed_size, record_count, postings):
+    table = {}
+    position = 0
+    for caption in sorted(postings):
+        records, box_counts = postings[caption]
+        table[caption] = [position, len(records), sum(box_counts)]
+        position += len(records)
+    table_bytes = json.dumps(table, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    table_bytes += b' ' * (-(CAPTION_INDEX_HEADER.size + len(table_bytes)) % 4)
+
+    tmp_path = index_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(CAPTION_INDEX_HEADER.pack(CAPTION_INDEX_MAGIC, indexed_size, record_count, len(table_bytes)))
+        f.write(table_bytes)
+        for column in (0, 1):
+            for caption in sorted(postings):
+                _to_little_endian(postings[caption][column]).tofile(f)
+    os.replace(tmp_path, index_path)
+
+
+def build_caption_index(jsonl_path, index_path=None):
+    """
+    一次扫描建立 jsonl 文件的类别倒排索引，返回类别数。
+    记录下标与 IndexedJsonl 的下标一致。
+    """
+    index_path = index_path or caption_index_path_for(jsonl_path)
+    postings = {}
+    with open(jsonl_path, 'rb') as f:
+        indexed_size, record_count = _scan_captions(f, 0, 0, postings)
+    _write_caption_index(index_path, indexed_size, record_count, postings)
+    return len(postings)
+
+
+def update_caption_index(jsonl_path, index_path=None):
+    """
+    使类别索引与 jsonl 文件同步：文件只是追加了内容时只扫描新增部分并与已有索引合并，否则重建。返回类别数。
+    """
+    index_path = index_path or caption_index_path_for(jsonl_path)
+    index = CaptionIndex.open(index_path) if os.path.exists(index_path) else None
+    size = os.path.getsize(jsonl_path)
+    if index is None or index.indexed_size > size:
+        return build_caption_index(jsonl_path, index_path)
+
+    with index, open(jsonl_path, 'rb') as f:
+        if index.indexed_size > 0:
+            f.seek(index.indexed_size - 1)
+            if f.read(1) != b'\n':
+                return build_caption_index(jsonl_path, index_path)
+        if index.indexed_size == size:
+            return len(index)
+        postings = {caption: (index.records(caption), index.boxes(caption))
+                    for caption in index.table}
+        indexed_size, record_count = _scan_captions(f, index.indexed_size, index.record_count, postings)
+    _write_caption_index(index_path, indexed_size, record_count, postings)
+    return len(postings)
+
+
+class CaptionIndex:
+    """
+    类别倒排索引的只读视图：类别 -> 包含该类别的记录下标及每条记录中的框数。
+
+    类别表在打开时载入，记录下标与框数数组直接映射文件，查询不需要扫描 jsonl。
+    记录下标可直接交给 IndexedJsonl 或 vary2qwen_view.load_and_visualize_jsonl 查看，
+    字节偏移可通过 IndexedJsonl.offset 得到。
+
+    Args:
+        jsonl_path (str): jsonl 文件路径。
+        build (bool): 索引不存在或落后于文件时是否自动建立/更新。
+    """
+
+    def __init__(self, jsonl_path, build=True):
+        self.jsonl_path = jsonl_path
+        self.index_path = caption_index_path_for(jsonl_path)
+        if build:
+            update_caption_index(jsonl_path, self.index_path)
+        self._open(self.index_path)
+
+    @classmethod
+    def open(cls, index_path):
+        """直接打开索引文件，格式无效时返回 None。"""
+        index = cls.__new__(cls)
+        index.jsonl_path = None
+        index.index_path = index_path
+        try:
+            index._open(index_path)
+        except ValueError:
+            return None
+        return index
+
+    def _open(self, index_path):
+        with open(index_path, 'rb') as f:
+            header = f.read(CAPTION_INDEX_HEADER.size)
+            if len(header) < CAPTION_INDEX_HEADER.size:
+                raise ValueError(f"无效的类别索引文件: {index_path}")
+            magic, self.indexed_size, self.record_count, table_size = CAPTION_INDEX_HEADER.unpack(header)
+            if magic != CAPTION_INDEX_MAGIC:
+                raise ValueError(f"无效的类别索引文件: {index_path}")
+            self.table = json.loads(f.read(table_size))
+            postings_start = CAPTION_INDEX_HEADER.size + table_size
+            self._map = None
+            if f.seek(0, os.SEEK_END) > postings_start:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map is None:
+            self._postings = array('I')
+        elif sys.byteorder == 'little':
+            self._postings = memoryview(self._map)[postings_start:].cast('I')
+        else:
+            self._postings = array('I', self._map[postings_start:])
+            self._postings.byteswap()
+        self._total = sum(count for _, count, _ in self.table.values())
+
+    def __len__(self):
+        return len(self.table)
+
+    def __contains__(self, caption):
+        return caption in self.table
+
+    def classes(self):
+        """{类别: (记录数, 框数)}"""
+        return {caption: (count, boxes) for caption, (_, count, boxes) in self.table.items()}
+
+    def box_counts(self):
+        """按框数从多到少排列的 {类别: 框数}。"""
+        return dict(sorted(((caption, boxes) for caption, (_, _, boxes) in self.table.items()),
+                           key=lambda item: -item[1]))
+
+    def find(self, pattern):
+        """返回名称匹配正则 pattern 的类别列表。"""
+        regex = re.compile(pattern)
+        return [caption for caption in self.table if regex.search(caption)]
+
+    def records(self, caption):
+        """包含该类别的记录下标（升序），类别不存在时为空。"""
+        if caption not in self.table:
+            return array('I')
+        start, count, _ = self.table[caption]
+        return self._slice(start, start + count)
+
+    def boxes(self, caption):
+        """与 records 一一对应的每条记录中该类别的框数。"""
+        if caption not in self.table:
+            return array('I')
+        start, count, _ = self.table[caption]
+        return self._slice(self._total + start, self._total + start + count)
+
+    def _slice(self, start, stop):
+        # 复制出独立的数组，关闭索引后仍可使用
+        if isinstance(self._postings, memoryview):
+            part = array('I')
+            part.frombytes(self._postings[start:stop].cast('B'))
+            return part
+        return self._postings[start:stop]
+
+    def query(self, *captions, match='any'):
+        """
+        返回包含给定类别的记录下标（升序）。match 为 'any' 时包含任一类别即可，为 'all' 时需包含全部类别。
+        """
+        sets = [set(self.records(caption)) for caption in captions]
+        if not sets:
+            return []
+        result = set.intersection(*sets) if match == 'all' else set.union(*sets)
+        return sorted(result)
+
+    def close(self):
+        if isinstance(self._postings, memoryview):
+            self._postings.release()
+        self._postings = array('I')
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='为输出的 jsonl 文件建立索引并按类别查询')
+    parser.add_argument('jsonl', nargs='+', help='jsonl 文件路径，索引不存在或已过期时自动建立')
+    parser.add_argument('--caption', action='append', help='列出包含该类别的记录下标，可给多个')
+    parser.add_argument('--all', action='store_true', help='与多个 --caption 一起使用，要求同时包含全部类别')
+    parser.add_argument('--find', help='列出名称匹配该正则的类别')
+    parser.add_argument('--top', type=int, default=20, help='未指定查询时按框数列出前多少个类别')
+    args = parser.parse_args(argv)
+
+    for jsonl_path in args.jsonl:
+        update_index(jsonl_path)
+        with CaptionIndex(jsonl_path) as index:
+            if args.caption:
+                indices = index.query(*args.caption, match='all' if args.all else 'any')
+                print(f"{jsonl_path}: {len(indices)} 条记录")
+                print(json.dumps(indices))
+            elif args.find:
+                classes = index.classes()
+                for caption in index.find(args.find):
+                    count, boxes = classes[caption]
+                    print(f"{jsonl_path}\t{caption}\t{count} 条记录\t{boxes} 个框")
+            else:
+                for caption, boxes in list(index.box_counts().items())[:args.top]:
+                    print(f"{jsonl_path}\t{caption}\t{index.table[caption][1]} 条记录\t{boxes} 个框")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,185 @@
+import json
+import os
+
+
+class ConversionManifest:
+    """
+    增量转换的清单，记录每个标注文件的大小、mtime、内容哈希及其输出记录在
+    train/val 文件中的字节位置。
+
+    清单以追加写的 jsonl 日志保存，每行是以下之一：
+        {"file": 名称, "size": ..., "mtime_ns": ..., "sha1": ..., "spans": [[split, offset, length], ...]}
+        {"remove": 名称}
+        {"commit": {split: 输出文件大小, ...}}
+    只有位于某个 commit 行之前的操作才生效。中断的运行留下的未提交操作会在加载时被丢弃，
+    输出文件也会被截断回最后一次提交时的大小，因此可以从最后一个检查点继续。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.files = {}
+        self.outputs = {}
+        self.compaction_needed = False
+        self._pending = []
+        self._committed_bytes = 0
+
+    @classmethod
+    def load(cls, path):
+        manifest = cls(path)
+        if not os.path.exists(path):
+            return manifest
+
+        pending = []
+        offset = 0
+        with open(path, 'rb') as f:
+            for line in f:
+                offset += len(line)
+                try:
+                    op = json.loads(line)
+                except ValueError:
+                    # 中断时写了一半的行，之后的内容都不可信
+                    break
+                if 'commit' in op:
+                    for item in pending:
+                        manifest._apply(item)
+                    pending = []
+                    manifest.outputs = op['commit']
+                    manifest._committed_bytes = offset
+                else:
+                    pending.append(op)
+
+        # 中断前已提交的更新可能留下失效记录：有效记录总长度小于输出文件大小时需要压缩
+        live = {}
+        for entry in manifest.files.values():
+            for split, _, length in entry['spans']:
+                live[split] = live.get(split, 0) + length
+        manifest.compaction_needed = any(live.get(split, 0) != size for split, size in manifest.outputs.items())
+        return manifest
+
+    def _apply(self, op):
+        if 'remove' in op:
+            self.files.pop(op['remove'], None)
+        else:
+            self.files[op['file']] = op
+
+    def _log(self, op):
+        self._apply(op)
+        self._pending.append(op)
+
+    def unchanged(self, name, stat):
+        """大小与mtime都未变化时认为文件未修改，无需读取内容。"""
+        entry = self.files.get(name)
+        return (entry is not None and entry['size'] == stat.st_size
+                and entry['mtime_ns'] == stat.st_mtime_ns)
+
+    def same_content(self, name, sha1):
+        entry = self.files.get(name)
+        return entry is not None and entry['sha1'] == sha1
+
+    def update(self, name, stat, sha1, spans=None):
+        """
+        记录文件的最新状态。spans 为 None 表示内容未变（仅 mtime 变化），沿用原有输出位置。
+        """
+        entry = self.files.get(name)
+        if spans is None:
+            spans = entry['spans'] if entry else []
+        elif entry and entry['spans']:
+            # 旧的输出记录已失效，需要在结束时压缩输出文件
+            self.compaction_needed = True
+        self._log({'file': name, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+                   'sha1': sha1, 'spans': spans})
+
+    def remove(self, name):
+        entry = self.files.get(name)
+        if entry is None:
+            return
+        if entry['spans']:
+            self.compaction_needed = True
+        self._log({'remove': name})
+
+    def recover(self, output_paths):
+        """
+        将输出文件截断到最后一次提交时的大小，丢弃中断运行写入的未提交记录。
+        若输出文件比清单记录的还短（被外部修改或删除），则清空清单与输出，重新全量转换。
+        """
+        consistent = True
+        for split, path in output_paths.items():
+            committed = self.outputs.get(split, 0)
+            size = os.path.getsize(path) if os.path.exists(path) else 0
+            if size < committed:
+                consistent = False
+                break
+        if not consistent:
+            print(f"清单 {self.path} 与输出文件不一致，将重新全量转换")
+            self.files = {}
+            self.outputs = {}
+            self.compaction_needed = False
+            self._committed_bytes = 0
+
+        for split, path in output_paths.items():
+            committed = self.outputs.get(split, 0)
+            if os.path.exists(path) and os.path.getsize(path) != committed:
+                print(f"丢弃 {path} 中未提交的内容，截断至 {committed} 字节")
+                with open(path, 'r+b') as f:
+                    f.truncate(committed)
+
+        # 丢弃清单中未提交的尾部
+        if os.path.exists(self.path) and os.path.getsize(self.path) != self._committed_bytes:
+            with open(self.path, 'r+b') as f:
+                f.truncate(self._committed_bytes)
+
+    def checkpoint(self, sizes):
+        """
+        提交检查点。调用前输出文件必须已刷新到磁盘，sizes 为各输出文件当前大小。
+        """
+        self.outputs = dict(sizes)
+        lines = [json.dumps(op, ensure_ascii=False) + '\n' for op in self._pending]
+        lines.append(json.dumps({'commit': self.outputs}) + '\n')
+        with open(self.path, 'ab') as f:
+            f.write(''.join(lines).encode('utf-8'))
+            f.flush()
+            os.fsync(f.fileno())
+            self._committed_bytes = f.tell()
+        self._pending = []
+
+    def compact(self, output_paths):
+        """
+        重写输出文件，只保留清单中仍然有效的记录，并将清单日志压缩为快照。
+        """
+        spans_by_split = {split: [] for split in output_paths}
+        for entry in self.files.values():
+            for span in entry['spans']:
+                spans_by_split.setdefault(span[0], []).append(span)
+
+        sizes = {}
+        for split, path in output_paths.items():
+            spans = sorted(spans_by_split.get(split, []), key=lambda span: span[1])
+            tmp_path = path + '.tmp'
+            offset = 0
+            if os.path.exists(path):
+                with open(path, 'rb') as src, open(tmp_path, 'wb') as dst:
+                    for span in spans:
+                        src.seek(span[1])
+                        dst.write(src.read(span[2]))
+                        # 就地更新为新文件中的位置
+                        span[1] = offset
+                        offset += span[2]
+                os.replace(tmp_path, path)
+            sizes[split] = offset
+
+        self.outputs = sizes
+        self.snapshot()
+        self.compaction_needed = False
+
+    def snapshot(self):
+        """将当前状态写成只包含有效条目的新日志，替换原有日志。"""
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            for entry in self.files.values():
+                f.write((json.dumps(entry, ensure_ascii=False) + '\n').encode('utf-8'))
+            f.write((json.dumps({'commit': self.outputs}) + '\n').encode('utf-8'))
+            f.flush()
+            os.fsync(f.fileno())
+            self._committed_bytes = f.tell()
+        os.replace(tmp_path, self.path)
+        self._pending = []
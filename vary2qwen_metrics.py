@@ -0,0 +1,144 @@
+import json
+import time
+from contextvars import ContextVar
+
+# 当前正在转换的文件所使用的指标对象，供深层函数（标签解析、边界框还原）计时
+_active_metrics = ContextVar('vary2qwen_active_metrics', default=None)
+
+# 转换流程的各个阶段（按先后顺序），汇总时依此排序
+STAGES = ('list', 'read', 'decode', 'probe', 'validate', 'parse', 'restore', 'convert', 'preflight', 'dedup', 'serialize', 'write')
+
+
+def active_metrics():
+    return _active_metrics.get()
+
+
+class use_metrics:
+    """在 with 块内将 metrics 设为当前指标对象。"""
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+        self._token = None
+
+    def __enter__(self):
+        self._token = _active_metrics.set(self.metrics)
+        return self.metrics
+
+    def __exit__(self, *exc):
+        _active_metrics.reset(self._token)
+
+
+class ConversionMetrics:
+    """
+    转换过程的计数器与阶段计时器。
+
+    计时通过 tick/add_time 累加，开销仅为一次 perf_counter 与一次字典更新。
+    计数器键名使用前缀分组：
+        files                 处理的标注文件数
+        records.<任务类型>     输出记录数，任务类型见 vary2qwen_tets.record_task_type
+        rejected.<原因>        被丢弃的文件数，原因如 answer_none、ref_mismatch、decode_error
+        rejected.image_<状态>  图像预检未通过而去掉的记录数，状态见 vary2qwen_preflight
+        dedup.duplicates      去重时发现的重复记录数
+    注意 convert 阶段的耗时包含其中的 parse 与 restore。
+    """
+
+    def __init__(self):
+        self.timings = {}
+        self.counters = {}
+
+    def add_time(self, stage, seconds):
+        self.timings[stage] = self.timings.get(stage, 0.0) + seconds
+
+    def tick(self, stage, start):
+        """将 start 至今的耗时累加到 stage，返回当前时间作为下一阶段的起点。"""
+        now = time.perf_counter()
+        self.timings[stage] = self.timings.get(stage, 0.0) + (now - start)
+        return now
+
+    def count(self, key, n=1):
+        self.counters[key] = self.counters.get(key, 0) + n
+
+    def merge(self, other):
+        for stage, seconds in other.timings.items():
+            self.add_time(stage, seconds)
+        for key, n in other.counters.items():
+            self.count(key, n)
+        return self
+
+    def group(self, prefix):
+        prefix = prefix + '.'
+        return {key[len(prefix):]: n for key, n in self.counters.items() if key.startswith(prefix)}
+
+    def summary(self, name=None, wall_seconds=None):
+        """
+        返回可直接保存为 json 的汇总。
+        """
+        records = self.group('records')
+        files = self.counters.get('files', 0)
+        order = {stage: i for i, stage in enumerate(STAGES)}
+        stages = {stage: round(self.timings[stage], 4)
+                  for stage in sorted(self.timings, key=lambda s: order.get(s, len(order)))}
+        summary = {
+            'dataset': name,
+            'files': files,
+            'records': sum(records.values()),
+            'records_by_task': records,
+            'rejected': self.group('rejected'),
+            'stages': stages,
+        }
+        other = {key: n for key, n in self.counters.items()
+                 if key != 'files' and not key.startswith(('records.', 'rejected.'))}
+        if other:
+            summary['counters'] = other
+        if wall_seconds is not None:
+            summary['wall_seconds'] = round(wall_seconds, 4)
+            summary['files_per_sec'] = round(files / wall_seconds, 1) if wall_seconds > 0 else None
+            summary['records_per_sec'] = round(summary['records'] / wall_seconds, 1) if wall_seconds > 0 else None
+        return summary
+
+    def save(self, path, name=None, wall_seconds=None):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.summary(name, wall_seconds), f, ensure_ascii=False, indent=2)
+
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    return f'{hours:d}:{minutes:02d}:{seconds:02d}' if hours else f'{minutes:02d}:{seconds:02d}'
+
+
+class ProgressReporter:
+    """
+    周期性打印进度、速率与预计剩余时间。interval 为打印间隔（秒），为 None 时不打印。
+    """
+
+    def __init__(self, name, total=None, interval=10.0):
+        self.name = name
+        self.total = total
+        self.interval = interval
+        self.done = 0
+        self.records = 0
+        self.start = time.perf_counter()
+        self._last_report = self.start
+
+    def update(self, files=1, records=0):
+        self.done += files
+        self.records += records
+        if self.interval is None:
+            return
+        now = time.perf_counter()
+        if now - self._last_report >= self.interval:
+            self._last_report = now
+            self.report(now)
+
+    def report(self, now=None):
+        elapsed = (now or time.perf_counter()) - self.start
+        rate = self.done / elapsed if elapsed > 0 else 0.0
+        message = f"[{self.name}] {self.done}"
+        if self.total:
+            message += f"/{self.total} ({self.done / self.total:.1%})"
+        message += f" 个文件, {self.records} 条记录, {rate:.1f} 文件/秒, 已用 {format_duration(elapsed)}"
+        if self.total and rate > 0:
+            message += f", 预计剩余 {format_duration((self.total - self.done) / rate)}"
+        print(message)
@@ -0,0 +1,216 @@
+import argparse
+import json
+import os
+import struct
+
+from vary2qwen_cache import StatCache
+from vary2qwen_probe import image_format, read_image_size
+
+# 检查结果：'ok' 通过（无法识别的格式只做 decode 级别检查）；'missing' 文件不存在；'unreadable' 无法读取；
+# 'bad_header' 可识别格式的文件头损坏；'truncated' 文件不完整（JPEG缺少结束标记、PNG缺少IEND块）；'decode_error' 完整解码失败
+PREFLIGHT_LEVELS = ('header', 'decode')
+
+
+# PNG 的 IEND 块内容固定：长度0、类型、CRC
+_PNG_IEND = b'\x00\x00\x00\x00IEND\xaeB`\x82'
+
+
+def _rfind(f, needle, start, end, chunk=64 * 1024):
+    # 从 end 向前分块查找 [start, end) 中是否出现 needle，块之间重叠 len(needle)-1 字节
+    overlap = len(needle) - 1
+    while end > start:
+        begin = max(start, end - chunk)
+        f.seek(begin)
+        if needle in f.read(end - begin + overlap):
+            return True
+        end = begin
+    return False
+
+
+def _jpeg_scan_start(f):
+    # 按段长度跳过文件头中的各个段，返回第一个 SOS 段之后图像数据的起始位置；文件在此之前结束时返回 None
+    f.seek(2)
+    while True:
+        byte = f.read(1)
+        while byte and byte != b'\xff':
+            byte = f.read(1)
+        while byte == b'\xff':
+            byte = f.read(1)
+        if not byte:
+            return None
+        marker = byte[0]
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+            continue
+        length = f.read(2)
+        if len(length) < 2:
+            return None
+        f.seek(struct.unpack('>H', length)[0] - 2, os.SEEK_CUR)
+        if marker == 0xDA:
+            return f.tell()
+
+
+def _truncated(f, fmt):
+    """
+    判断文件是否写完整。从末尾向前查找结束标记，完整的文件通常只需读最后一块；
+    EXIF、MPF 等附加在结束标记之后的数据不影响判断。
+    """
+    size = f.seek(0, os.SEEK_END)
+    if fmt == 'jpeg':
+        # 熵编码数据中的 0xFF 总是跟着 0x00 或 RST 标记，SOS 之后出现的 FFD9 只能是结束标记，
+        # 或结束标记之后附加的数据；文件头中缩略图的结束标记在 SOS 之前，不会被误认
+        start = _jpeg_scan_start(f)
+        return start is None or not _rfind(f, b'\xff\xd9', start, size)
+    if fmt == 'png':
+        return not _rfind(f, _PNG_IEND, 8, size)
+    return False
+
+
+def check_image(image_path, decode=False, stat=None):
+    """
+    检查单个图像，返回 (状态, os.stat 结果)，文件不存在时 stat 为 None。
+    默认只读取文件头和末尾；decode 为真时再用OpenCV完整解码一次。stat 为已取得的 os.stat 结果时不再重复 stat。
+    """
+    if stat is None:
+        try:
+            stat = os.stat(image_path)
+        except OSError:
+            return 'missing', None
+    try:
+        with open(image_path, 'rb') as f:
+            fmt = image_format(f.read(32))
+            # 无法识别的格式不做文件头检查，交给 decode 级别判断
+            if fmt is not None:
+                read_image_size(image_path)
+                if _truncated(f, fmt):
+                    return 'truncated', stat
+    except OSError:
+        return 'unreadable', stat
+    except (ValueError, struct.error):
+        return 'bad_header', stat
+    if decode:
+        import cv2
+        if cv2.imread(image_path, cv2.IMREAD_UNCHANGED) is None:
+            return 'decode_error', stat
+    return 'ok', stat
+
+
+class ImagePreflight:
+    """
+    带持久化缓存的并行图像预检。缓存按路径与mtime失效，重复运行时只检查新增或修改过的图像。
+
+    检查在线程池中进行：文件系统调用会释放GIL，适合 /data2、/data3 这类NFS挂载的目录，
+    线程数可以远多于CPU核数。
+
+    Args:
+        cache_path (str): 检查结果缓存文件路径。
+        level (str): 'header' 检查存在性、文件头与完整性；'decode' 另外完整解码一次。
+        threads (int): 线程数。
+    """
+
+    def __init__(self, cache_path=None, level='header', threads=32):
+        if level not in PREFLIGHT_LEVELS:
+            raise ValueError(f"不支持的检查级别: {level}")
+        self.cache = StatCache(cache_path)
+        self.level = level
+        self.threads = threads
+
+    def _cached(self, image_path, stat=None):
+        # 缓存为 [状态, 级别]；失败的结果对任何级别都有效，通过的结果需达到当前级别
+        entry = self.cache.get(image_path, stat)
+        if entry is None:
+            return None
+        status, level = entry
+        if status != 'ok' or PREFLIGHT_LEVELS.index(level) >= PREFLIGHT_LEVELS.index(self.level):
+            return status
+        return None
+
+    def _check(self, image_path):
+        # 在工作线程中执行：stat 一次，据此校验缓存，缓存无效时再完整检查。
+        # 返回 (状态, 需写入缓存的 stat)，命中缓存或文件不存在时 stat 为 None
+        try:
+            stat = os.stat(image_path)
+        except OSError:
+            return 'missing', None
+        status = self._cached(image_path, stat)
+        if status is not None:
+            return status, None
+        return check_image(image_path, decode=self.level == 'decode', stat=stat)
+
+    def check(self, image_path):
+        return self.check_many([image_path])[image_path]
+
+    def check_many(self, image_paths):
+        """
+        检查一批图像，返回 {路径: 状态}。缓存校验（每张图像一次 stat）与检查都在线程池中并行进行，
+        已缓存且未修改的图像不再读取。
+        """
+        statuses = {}
+        pending = list(set(image_paths))
+        if not pending:
+            return statuses
+
+        if self.threads <= 1 or len(pending) == 1:
+            results = list(map(self._check, pending))
+        else:
+            # 只在确实需要并行检查时导入
+            from concurrent.futures import ThreadPoolExecutor
+            with ThreadPoolExecutor(max_workers=min(self.threads, len(pending))) as executor:
+                results = list(executor.map(self._check, pending))
+        for image_path, (status, stat) in zip(pending, results):
+            statuses[image_path] = status
+            # 缓存只在主线程中更新，工作线程只读取
+            if stat is not None:
+                self.cache.put(image_path, [status, self.level], stat)
+        return statuses
+
+    def save(self):
+        self.cache.save()
+
+
+def check_jsonl(jsonl_path, preflight, batch_size=4096):
+    """
+    检查输出的 jsonl 文件中引用的全部图像，返回 [(行号, 图像路径, 状态)]，只列出未通过的。
+    """
+    failed = []
+    batch = []
+
+    def flush():
+        statuses = preflight.check_many([image_path for _, image_path in batch])
+        for line_number, image_path in batch:
+            if statuses[image_path] != 'ok':
+                failed.append((line_number, image_path, statuses[image_path]))
+        batch.clear()
+
+    with open(jsonl_path, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            for image_path in record.get("images") or [record.get("image", '')]:
+                batch.append((line_number, image_path))
+            if len(batch) >= batch_size:
+                flush()
+    if batch:
+        flush()
+    return failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='检查输出 jsonl 中引用的图像是否存在、完整、可解码')
+    parser.add_argument('jsonl', nargs='+', help='jsonl 文件路径')
+    parser.add_argument('--decode', action='store_true', help='完整解码每张图像（较慢）')
+    parser.add_argument('--threads', type=int, default=32, help='检查线程数')
+    parser.add_argument('--cache', default=None, help='检查结果缓存文件路径')
+    args = parser.parse_args(argv)
+
+    preflight = ImagePreflight(args.cache, 'decode' if args.decode else 'header', args.threads)
+    for jsonl_path in args.jsonl:
+        failed = check_jsonl(jsonl_path, preflight)
+        for line_number, image_path, status in failed:
+            print(f"{jsonl_path}:{line_number + 1}\t{status}\t{image_path}")
+        print(f"{jsonl_path}: {len(failed)} 条记录的图像未通过检查")
+    preflight.save()
+
+
+if __name__ == '__main__':
+    main()
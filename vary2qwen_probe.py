@@ -0,0 +1,149 @@
+import os
+import struct
+
+from vary2qwen_cache import StatCache
+
+# EXIF方向为5~8时图像需要旋转90度，cv2.imread 读到的宽高与文件头相反
+_TRANSPOSED_ORIENTATIONS = (5, 6, 7, 8)
+
+
+def image_format(head):
+    """按文件头的魔数识别图像格式，返回 'png'、'jpeg'、'gif'、'bmp'、'webp'，无法识别时返回 None。"""
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'png'
+    if head[:2] == b'\xff\xd8':
+        return 'jpeg'
+    if head[:6] in (b'GIF87a', b'GIF89a'):
+        return 'gif'
+    if head[:2] == b'BM':
+        return 'bmp'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'webp'
+    return None
+
+
+def read_image_size(image_path, exif=True):
+    """
+    只读取文件头获取图像尺寸，不解码像素。支持 JPEG、PNG、GIF、BMP、WEBP。
+
+    Args:
+        image_path (str): 图像路径。
+        exif (bool): 是否按JPEG的EXIF方向交换宽高，与 cv2.imread 的结果保持一致。
+    Returns:
+        tuple: (height, width)
+    """
+    with open(image_path, 'rb') as f:
+        head = f.read(32)
+        fmt = image_format(head)
+        if fmt == 'png':
+            width, height = struct.unpack('>II', head[16:24])
+            return height, width
+        if fmt == 'jpeg':
+            return _jpeg_size(f, exif)
+        if fmt == 'gif':
+            width, height = struct.unpack('<HH', head[6:10])
+            return height, width
+        if fmt == 'bmp':
+            width, height = struct.unpack('<ii', head[18:26])
+            return abs(height), width
+        if fmt == 'webp':
+            return _webp_size(head)
+    raise ValueError(f"无法识别的图像格式: {image_path}")
+
+
+def _jpeg_size(f, exif):
+    f.seek(2)
+    orientation = 1
+    while True:
+        byte = f.read(1)
+        while byte and byte != b'\xff':
+            byte = f.read(1)
+        while byte == b'\xff':
+            byte = f.read(1)
+        if not byte:
+            raise ValueError("JPEG文件头不完整")
+
+        marker = byte[0]
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+            # 无长度字段的标记
+            continue
+        length = struct.unpack('>H', f.read(2))[0]
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            # SOFn: 精度(1字节) 高(2字节) 宽(2字节)
+            height, width = struct.unpack('>xHH', f.read(5))
+            if orientation in _TRANSPOSED_ORIENTATIONS:
+                height, width = width, height
+            return height, width
+        if marker == 0xDA:
+            raise ValueError("JPEG在SOF之前出现了图像数据")
+        if marker == 0xE1 and exif:
+            orientation = _exif_orientation(f.read(length - 2)) or orientation
+        else:
+            f.seek(length - 2, os.SEEK_CUR)
+
+
+def _exif_orientation(segment):
+    # 只解析IFD0中的Orientation(0x0112)标签
+    if not segment.startswith(b'Exif\x00\x00'):
+        return None
+    tiff = segment[6:]
+    if tiff[:2] == b'II':
+        endian = '<'
+    elif tiff[:2] == b'MM':
+        endian = '>'
+    else:
+        return None
+    try:
+        ifd = struct.unpack(endian + 'I', tiff[4:8])[0]
+        count = struct.unpack(endian + 'H', tiff[ifd:ifd + 2])[0]
+        for i in range(count):
+            entry = ifd + 2 + 12 * i
+            tag = struct.unpack(endian + 'H', tiff[entry:entry + 2])[0]
+            if tag == 0x0112:
+                return struct.unpack(endian + 'H', tiff[entry + 8:entry + 10])[0]
+    except struct.error:
+        return None
+    return None
+
+
+def _webp_size(head):
+    chunk = head[12:16]
+    if chunk == b'VP8X':
+        width = 1 + int.from_bytes(head[24:27], 'little')
+        height = 1 + int.from_bytes(head[27:30], 'little')
+    elif chunk == b'VP8L':
+        bits = int.from_bytes(head[21:25], 'little')
+        width = (bits & 0x3FFF) + 1
+        height = ((bits >> 14) & 0x3FFF) + 1
+    elif chunk == b'VP8 ':
+        width = int.from_bytes(head[26:28], 'little') & 0x3FFF
+        height = int.from_bytes(head[28:30], 'little') & 0x3FFF
+    else:
+        raise ValueError("无法识别的WEBP格式")
+    return height, width
+
+
+class ImageSizeProbe:
+    """
+    带持久化缓存的图像尺寸探测器，缓存按路径与mtime失效。
+    同一批图像目录被多个数据集复用时（如 alg_base、Tower_dataset），只需探测一次。
+    """
+
+    def __init__(self, cache_path=None, exif=True):
+        self.cache = StatCache(cache_path)
+        self.exif = exif
+
+    def size(self, image_path):
+        """
+        Returns:
+            list: [height, width]
+        """
+        stat = os.stat(image_path)
+        height_width = self.cache.get(image_path, stat)
+        if height_width is None:
+            height_width = list(read_image_size(image_path, self.exif))
+            self.cache.put(image_path, height_width, stat)
+        return height_width
+
+    def save(self):
+        self.cache.save()
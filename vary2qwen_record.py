@@ -0,0 +1,165 @@
+import json
+import sys
+from array import array
+from json.encoder import encode_basestring
+
+from vary2qwen_shard import packable
+
+# 紧凑的内存记录模型：缓冲模式需要在内存中持有整个数据集的记录（打乱、划分后再写出），
+# 每条记录都是嵌套的 dict/list，每个目标重复携带 "bbox_type": "real" 与 "image": 0，
+# 每个问答重复携带图像路径，百万级记录时占用数 GB。这里改用 __slots__ 类保存：
+#   - 图像路径、类别、bbox_type 与 grounding 的 query/response 经 sys.intern 驻留，相同字符串只保存一份；
+#   - 一条 grounding 记录的全部框存为一个 int32 数组，目标只记录框的起止；
+#   - 不符合输出格式的记录整条保存为 json 文本。
+# 与 dict 之间的转换是无损的：to_dict() 还原原记录，to_json() 直接拼出与 dump_record 逐字节相同的一行，
+# 无需先还原为 dict 再序列化。
+QA_KEYS = ["query", "response", "image"]
+_intern = sys.intern
+
+
+class CompactRecord:
+    __slots__ = ()
+    task_type = None
+
+    def to_dict(self):
+        raise NotImplementedError
+
+    def to_json(self):
+        """与 vary2qwen_tets.dump_record(self.to_dict()) 相同的一行 json（含换行）。"""
+        raise NotImplementedError
+
+
+class GroundingObject:
+    __slots__ = ('caption', 'bbox_type', 'image', 'box_start', 'box_count', 'single')
+
+    def __init__(self, caption, bbox_type, image, box_start, box_count, single):
+        self.caption = caption
+        self.bbox_type = bbox_type
+        self.image = image
+        self.box_start = box_start
+        self.box_count = box_count
+        self.single = single
+
+
+class GroundingRecord(CompactRecord):
+    __slots__ = ('query', 'response', 'images', 'objects', 'boxes')
+    task_type = 'grounding'
+
+    def __init__(self, record):
+        self.query = _intern(record["query"])
+        self.response = _intern(record["response"])
+        self.images = tuple(_intern(path) for path in record["images"])
+        self.boxes = array('i')
+        objects = []
+        for obj in record["objects"]:
+            bbox = obj['bbox']
+            single = bool(bbox) and not isinstance(bbox[0], list)
+            start = len(self.boxes) // 4
+            if single:
+                self.boxes.extend(bbox)
+            else:
+                for box in bbox:
+                    self.boxes.extend(box)
+            objects.append(GroundingObject(_intern(obj['caption']), _intern(obj['bbox_type']), obj['image'],
+                                           start, len(self.boxes) // 4 - start, single))
+        self.objects = tuple(objects)
+
+    @property
+    def image(self):
+        return self.images[0] if self.images else ''
+
+    def object_boxes(self, obj):
+        boxes = self.boxes
+        return [boxes[j:j + 4].tolist() for j in range(obj.box_start * 4, (obj.box_start + obj.box_count) * 4, 4)]
+
+    def to_dict(self):
+        objects = []
+        for obj in self.objects:
+            bbox = self.object_boxes(obj)
+            objects.append({"caption": obj.caption, "bbox": bbox[0] if obj.single else bbox,
+                            "bbox_type": obj.bbox_type, "image": obj.image})
+        return {"query": self.query, "response": self.response, "images": list(self.images), "objects": objects}
+
+    def to_json(self):
+        boxes = self.boxes
+        objects = []
+        for obj in self.objects:
+            box_text = ['[' + ','.join(map(str, boxes[j:j + 4])) + ']'
+                        for j in range(obj.box_start * 4, (obj.box_start + obj.box_count) * 4, 4)]
+            bbox = box_text[0] if obj.single else '[' + ','.join(box_text) + ']'
+            objects.append(f'{{"caption":{encode_basestring(obj.caption)},"bbox":{bbox},'
+                           f'"bbox_type":{encode_basestring(obj.bbox_type)},"image":{obj.image}}}')
+        return (f'{{"query":{encode_basestring(self.query)},"response":{encode_basestring(self.response)},'
+                f'"images":[{",".join(map(encode_basestring, self.images))}],"objects":[{",".join(objects)}]}}\n')
+
+
+class QARecord(CompactRecord):
+    __slots__ = ('query', 'response', 'image')
+
+    def __init__(self, record):
+        self.query = record["query"]
+        self.response = record["response"]
+        self.image = _intern(record["image"])
+
+    @property
+    def task_type(self):
+        return 'region' if '<box>' in self.query else 'vqa'
+
+    def to_dict(self):
+        return {"query": self.query, "response": self.response, "image": self.image}
+
+    def to_json(self):
+        return (f'{{"query":{encode_basestring(self.query)},"response":{encode_basestring(self.response)},'
+                f'"image":{encode_basestring(self.image)}}}\n')
+
+
+class JsonRecord(CompactRecord):
+    """不符合 grounding/问答输出格式的记录，整条保存为 json 文本。"""
+    __slots__ = ('text',)
+
+    def __init__(self, record):
+        self.text = json.dumps(record, ensure_ascii=False, separators=(',', ':'))
+
+    @property
+    def task_type(self):
+        from vary2qwen_tets import record_task_type
+        return record_task_type(self.to_dict())
+
+    @property
+    def image(self):
+        from vary2qwen_tets import record_image
+        return record_image(self.to_dict())
+
+    def to_dict(self):
+        return json.loads(self.text)
+
+    def to_json(self):
+        return self.text + '\n'
+
+
+def _qa_record(record):
+    return (list(record) == QA_KEYS and type(record["query"]) is str and type(record["response"]) is str
+            and type(record["image"]) is str)
+
+
+def compact_record(record):
+    """
+    将转换输出的记录（dict）转为紧凑记录，已是紧凑记录时原样返回。
+    grounding 记录转为 GroundingRecord，问答/区域描述记录转为 QARecord，其余转为 JsonRecord。
+    """
+    if isinstance(record, CompactRecord):
+        return record
+    if _qa_record(record):
+        return QARecord(record)
+    if packable(record):
+        return GroundingRecord(record)
+    return JsonRecord(record)
+
+
+def compact_records(records):
+    return [compact_record(record) for record in records]
+
+
+def expand_record(record):
+    """紧凑记录还原为 dict，dict 原样返回。"""
+    return record.to_dict() if isinstance(record, CompactRecord) else record
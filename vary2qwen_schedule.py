@@ -0,0 +1,271 @@
+import json
+import multiprocessing
+import os
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.connection import wait
+
+from vary2qwen_archive import count_archive_members, list_label_archives
+from vary2qwen_discover import LabelWalker
+
+
+def volume_of(path):
+    """返回路径所在的挂载点，如 /data2；路径不存在时按其最近的已存在上级目录判断。"""
+    path = os.path.abspath(path)
+    while not os.path.exists(path):
+        path = os.path.dirname(path)
+    while not os.path.ismount(path):
+        path = os.path.dirname(path)
+    return path
+
+
+def count_label_files(label_dir, include=None, exclude=None, recursive=False, walk_threads=8):
+    """
+    标注文件数，作为数据集工作量的估计；用与转换相同的 LabelWalker 规则遍历，只列目录，不 stat 每个文件。
+    没有标注文件、只有归档分片的目录按归档计数（与转换时相同），读取打包清单，
+    文件数未知时按归档大小估计（约每个标注文件 2KB）。
+    """
+    try:
+        if os.path.isfile(label_dir):
+            archives = list_label_archives(label_dir)
+        else:
+            files = LabelWalker(include, exclude, recursive, walk_threads).count(label_dir)
+            if files:
+                return files
+            archives = list_label_archives(label_dir)
+        if not archives:
+            return 0
+        count = count_archive_members(archives)
+        return count if count is not None else sum(os.path.getsize(path) for path in archives) // 2048
+    except OSError:
+        return 0
+
+
+def count_dataset_files(dataset, options=None):
+    """数据集的标注文件数，按公共选项与该数据集自己的 include/exclude/recursive/walk_threads 遍历。"""
+    options = dict(options or {}, **dataset.get('options', {}))
+    return count_label_files(dataset['annotations'], options.get('include'), options.get('exclude'),
+                             options.get('recursive') or False, options.get('walk_threads') or 8)
+
+
+class Job:
+    """调度中的一个数据集。files 为标注文件数，由 count_jobs 统计。"""
+
+    def __init__(self, name, dataset, options):
+        self.name = name
+        self.dataset = dataset
+        self.options = dict(options, **dataset.get('options', {}))
+        self.files = 0
+        self.volumes = sorted({volume_of(dataset['annotations']), volume_of(dataset['images'])})
+        self.workers = 0
+        self.process = None
+        self.conn = None
+        self.start = None
+        self.end = None
+        self.summary = None
+        self.error = None
+
+    def report(self, origin):
+        report = {'dataset': self.name, 'files': self.files, 'volumes': self.volumes, 'workers': self.workers,
+                  'queued_seconds': round(self.start - origin, 4),
+                  'seconds': round(self.end - self.start, 4), 'finished_at': round(self.end - origin, 4)}
+        if self.error is not None:
+            report['error'] = self.error
+        return report
+
+
+def count_jobs(jobs, threads=16):
+    """在线程池中并行统计各数据集的标注文件数，不同挂载点上列目录的延迟可以重叠。"""
+    if not jobs:
+        return
+    with ThreadPoolExecutor(max_workers=min(threads, len(jobs))) as executor:
+        counts = executor.map(lambda job: count_dataset_files(job.dataset, job.options), jobs)
+        for job, files in zip(jobs, counts):
+            job.files = files
+
+
+def _run_job(conn, name, dataset, output_dir, split_ratio, options):
+    # 在独立进程中转换一个数据集，将运行汇总或异常信息发回调度进程
+    from vary2qwen_tets import process_label_dir
+    try:
+        summary = process_label_dir(name, dataset['annotations'], dataset['images'], output_dir,
+                                    split_ratio, **options)
+        conn.send(('ok', summary))
+    except BaseException:
+        conn.send(('error', traceback.format_exc()))
+    finally:
+        conn.close()
+
+
+class DatasetScheduler:
+    """
+    在全局进程预算内并发转换多个数据集。
+
+    每个数据集在独立的进程中运行 process_label_dir，数据集之间互不影响。调度规则：
+      - 按标注文件数从大到小启动，最大的数据集最先开始，总耗时趋近于它单独运行的耗时；
+      - 所有数据集占用的转换进程数之和不超过 workers；数据集启动时按其文件数占尚未启动的
+        数据集总文件数的比例分得空闲进程（至少 1 个），数据集结束后进程归还给后续数据集；
+      - 同一挂载点（如 NFS 挂载的 /data2、/data3）上同时运行的数据集数不超过 per_volume，
+        volume_limits 可为个别挂载点单独指定；排在前面的数据集因挂载点已满无法启动时，
+        先启动其他挂载点上的数据集。
+    数据集的 'options' 中给出 workers 时使用该值（不超过空闲进程数）。
+
+    Args:
+        workers (int): 全局进程预算，默认为CPU核数。
+        per_volume (int): 每个挂载点上同时运行的数据集数上限。
+        volume_limits (dict): {挂载点: 上限}，覆盖 per_volume。
+    """
+
+    def __init__(self, workers=None, per_volume=2, volume_limits=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.per_volume = per_volume
+        self.volume_limits = volume_limits or {}
+        # 上限小于 1 时相应的数据集永远无法启动
+        if self.workers < 1:
+            raise ValueError(f"进程预算必须至少为 1: {self.workers}")
+        if per_volume < 1:
+            raise ValueError(f"每个挂载点的并发数必须至少为 1: {per_volume}")
+        for volume, limit in self.volume_limits.items():
+            if limit < 1:
+                raise ValueError(f"挂载点 {volume} 的并发数必须至少为 1: {limit}")
+
+    def _volume_limit(self, volume):
+        return self.volume_limits.get(volume, self.per_volume)
+
+    def _next_job(self, pending, running, free):
+        # 返回可以启动的第一个数据集（pending 已按文件数从大到小排序）
+        if free <= 0:
+            return None
+        busy = {}
+        for job in running:
+            for volume in job.volumes:
+                busy[volume] = busy.get(volume, 0) + 1
+        for job in pending:
+            if all(busy.get(volume, 0) < self._volume_limit(volume) for volume in job.volumes):
+                return job
+        return None
+
+    def _grant(self, job, pending, free):
+        requested = job.options.get('workers')
+        if requested:
+            return max(1, min(requested, free))
+        remaining = sum(other.files for other in pending) or 1
+        return max(1, min(free, round(free * job.files / remaining)))
+
+    def run(self, datasets, output_dir, split_ratio=0.8, **options):
+        """
+        转换 datasets（格式同 vary2qwen_tets.process_datasets），返回调度报告，见 critical_path_report。
+        跨数据集去重依赖数据集的处理顺序，不能与并发调度同时使用。
+        """
+        if options.get('dedup') or any(d.get('options', {}).get('dedup') for d in datasets.values()):
+            raise ValueError("跨数据集去重不能与并发调度同时使用，请使用 process_datasets 依次转换")
+        jobs = [Job(name, dataset, options) for name, dataset in datasets.items()]
+        count_jobs(jobs)
+        pending = sorted(jobs, key=lambda job: job.files, reverse=True)
+        running, finished = [], []
+        free = self.workers
+        origin = time.perf_counter()
+        context = multiprocessing.get_context()
+
+        while pending or running:
+            job = self._next_job(pending, running, free)
+            while job is not None:
+                job.workers = self._grant(job, pending, free)
+                pending.remove(job)
+                free -= job.workers
+                job.conn, child_conn = context.Pipe(duplex=False)
+                # 转换进程需要再创建进程池，因此不能是守护进程
+                job.process = context.Process(target=_run_job, name=f'vary2qwen-{job.name}',
+                                              args=(child_conn, job.name, job.dataset, output_dir, split_ratio,
+                                                    dict(job.options, workers=job.workers)))
+                job.start = time.perf_counter()
+                job.process.start()
+                child_conn.close()
+                running.append(job)
+                print(f"开始转换 {job.name}（{job.files} 个标注文件，{job.workers} 个进程，挂载点 "
+                      f"{', '.join(job.volumes)}）")
+                job = self._next_job(pending, running, free)
+
+            if not running:
+                # 没有运行中的数据集时不会再有进程或挂载点被释放，等待下去不会结束
+                raise RuntimeError(f"无法启动数据集: {', '.join(job.name for job in pending)}")
+            # 等待管道而不是进程：汇总较大时子进程会阻塞在 send 上，直到这里读取
+            ready = wait([job.conn for job in running])
+            for job in [job for job in running if job.conn in ready]:
+                self._collect(job)
+                running.remove(job)
+                finished.append(job)
+                free += job.workers
+
+        return critical_path_report(finished, time.perf_counter() - origin, origin)
+
+    @staticmethod
+    def _collect(job):
+        try:
+            status, payload = job.conn.recv()
+        except EOFError:
+            status, payload = 'error', None
+        job.process.join()
+        job.conn.close()
+        job.end = time.perf_counter()
+        if status == 'ok':
+            job.summary = payload
+            print(f"{job.name} 完成，用时 {job.end - job.start:.1f}s")
+        else:
+            job.error = payload or f"转换进程异常退出，退出码 {job.process.exitcode}"
+            print(f"{job.name} 失败: {job.error}")
+
+
+def critical_path_report(jobs, wall_seconds, origin):
+    """
+    调度报告：
+        wall_seconds        全部数据集完成的总耗时
+        serial_seconds      各数据集耗时之和，近似于依次转换的耗时
+        critical_path       最后完成的数据集；若其开始前有排队，queued_seconds 即可优化的空间
+        longest             单个数据集耗时最长者，总耗时的下限
+        datasets            每个数据集的进程数、挂载点、排队与运行时间
+        summaries           每个数据集的运行汇总，格式见 ConversionMetrics.summary
+    """
+    reports = sorted((job.report(origin) for job in jobs), key=lambda r: r['finished_at'])
+    critical = reports[-1] if reports else None
+    longest = max(reports, key=lambda r: r['seconds']) if reports else None
+    return {
+        'wall_seconds': round(wall_seconds, 4),
+        'serial_seconds': round(sum(r['seconds'] for r in reports), 4),
+        'critical_path': critical,
+        'longest': longest,
+        'datasets': reports,
+        'summaries': {job.name: job.summary for job in jobs if job.summary is not None},
+        'failed': [job.name for job in jobs if job.error is not None],
+    }
+
+
+def print_schedule_report(report):
+    for r in report['datasets']:
+        print(f"{r['dataset']:<24} {r['files']:>9} 个文件  {r['workers']:>3} 个进程  排队 {r['queued_seconds']:.1f}s  "
+              f"运行 {r['seconds']:.1f}s  完成于 {r['finished_at']:.1f}s  {'失败' if 'error' in r else ''}")
+    critical = report['critical_path']
+    if critical is not None:
+        print(f"总耗时 {report['wall_seconds']:.1f}s（依次转换约 {report['serial_seconds']:.1f}s），"
+              f"关键路径: {critical['dataset']}（排队 {critical['queued_seconds']:.1f}s + 运行 {critical['seconds']:.1f}s），"
+              f"最长数据集: {report['longest']['dataset']} {report['longest']['seconds']:.1f}s")
+
+
+def schedule_datasets(datasets, output_dir, split_ratio=0.8, workers=None, per_volume=2, volume_limits=None,
+                      report_path=None, **options):
+    """
+    并发转换多个数据集，见 DatasetScheduler。其余参数见 vary2qwen_tets.process_label_dir。
+    给定 report_path 时将调度报告保存为 json。
+
+    Returns:
+        dict: 调度报告，见 critical_path_report。
+    """
+    scheduler = DatasetScheduler(workers, per_volume, volume_limits)
+    report = scheduler.run(datasets, output_dir, split_ratio, **options)
+    print_schedule_report(report)
+    if report_path:
+        with open(report_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"调度报告已保存到 {report_path}")
+    return report
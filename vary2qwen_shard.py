@@ -0,0 +1,589 @@
+import bisect
+import glob
+import json
+import mmap
+import os
+import random
+import shutil
+import struct
+import sys
+import tempfile
+from array import array
+
+# 二进制分片格式（所有整数均为小端int32）：
+#   头部：8字节魔数 + 记录数、图像引用数、目标数、框数、字符串数、字符串数据字节数
+#   记录表：每条记录 7 个整数 (类型, query, response, 图像起始, 图像数, 目标起始, 目标数)
+#   图像引用：每个图像一个字符串编号
+#   目标表：每个目标 6 个整数 (caption, bbox_type, image, 框起始, 框数, 是否为单个框)
+#   框表：每个框 4 个整数 x1, y1, x2, y2
+#   字符串偏移：字符串数 + 1 个整数，之后为全部字符串的 utf-8 数据
+# query、response、图像路径、类别等字符串在分片内去重，只保存一次。
+# 不符合 grounding 格式的记录（如 vqa、region）整条以 json 文本存入字符串表，读取时同样原样还原。
+SHARD_MAGIC = b'V2QSHD\x00\x01'
+SHARD_HEADER = struct.Struct('<8s6i')
+SHARD_EXT = '.v2qs'
+
+RECORD_FIELDS = 7
+OBJECT_FIELDS = 6
+KIND_GROUNDING = 0
+KIND_JSON = 1
+
+GROUNDING_KEYS = ["query", "response", "images", "objects"]
+OBJECT_KEYS = ["caption", "bbox", "bbox_type", "image"]
+INT32_MIN, INT32_MAX = -2 ** 31, 2 ** 31 - 1
+
+
+def _is_int32(value):
+    return type(value) is int and INT32_MIN <= value <= INT32_MAX
+
+
+def _is_box(value):
+    return isinstance(value, list) and len(value) == 4 and all(_is_int32(v) for v in value)
+
+
+def _packable_object(obj):
+    if not isinstance(obj, dict) or list(obj) != OBJECT_KEYS:
+        return False
+    if not isinstance(obj['caption'], str) or not isinstance(obj['bbox_type'], str) or not _is_int32(obj['image']):
+        return False
+    bbox = obj['bbox']
+    return _is_box(bbox) or (isinstance(bbox, list) and all(_is_box(box) for box in bbox))
+
+
+def packable(record):
+    """记录是否符合 grounding 输出格式，可拆成字符串表与整数数组保存。"""
+    return (list(record) == GROUNDING_KEYS
+            and isinstance(record["query"], str) and isinstance(record["response"], str)
+            and isinstance(record["images"], list) and all(isinstance(p, str) for p in record["images"])
+            and isinstance(record["objects"], list) and all(_packable_object(obj) for obj in record["objects"]))
+
+
+def shard_path(output_dir, name, shard_id):
+    return os.path.join(output_dir, f'{name}-{shard_id:05d}{SHARD_EXT}')
+
+
+def list_shards(output_dir, name):
+    return sorted(glob.glob(os.path.join(glob.escape(output_dir), f'{glob.escape(name)}-[0-9]*{SHARD_EXT}')))
+
+
+def _le(values):
+    if sys.byteorder != 'little':
+        values = array('i', values)
+        values.byteswap()
+    return values
+
+
+class ShardBuilder:
+    """在内存中累积一个分片的数据。"""
+
+    def __init__(self):
+        self.records = array('i')
+        self.image_refs = array('i')
+        self.objects = array('i')
+        self.boxes = array('i')
+        self._string_ids = {}
+        self._strings = []
+
+    def __len__(self):
+        return len(self.records) // RECORD_FIELDS
+
+    def intern(self, text):
+        string_id = self._string_ids.get(text)
+        if string_id is None:
+            string_id = self._string_ids[text] = len(self._strings)
+            self._strings.append(text.encode('utf-8'))
+        return string_id
+
+    def add(self, record):
+        if not packable(record):
+            text = json.dumps(record, ensure_ascii=False, separators=(',', ':'))
+            self.records.extend((KIND_JSON, self.intern(text), 0, 0, 0, 0, 0))
+            return
+
+        image_start = len(self.image_refs)
+        for image_path in record["images"]:
+            self.image_refs.append(self.intern(image_path))
+        object_start = len(self.objects) // OBJECT_FIELDS
+        for obj in record["objects"]:
+            bbox = obj['bbox']
+            single = _is_box(bbox)
+            box_start = len(self.boxes) // 4
+            if single:
+                self.boxes.extend(bbox)
+            else:
+                for box in bbox:
+                    self.boxes.extend(box)
+            self.objects.extend((self.intern(obj['caption']), self.intern(obj['bbox_type']), obj['image'],
+                                 box_start, len(self.boxes) // 4 - box_start, int(single)))
+        self.records.extend((KIND_GROUNDING, self.intern(record["query"]), self.intern(record["response"]),
+                             image_start, len(record["images"]),
+                             object_start, len(record["objects"])))
+
+    def write(self, path):
+        string_offsets = array('i', [0])
+        for data in self._strings:
+            string_offsets.append(string_offsets[-1] + len(data))
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(SHARD_HEADER.pack(SHARD_MAGIC, len(self), len(self.image_refs), len(self.objects) // OBJECT_FIELDS,
+                                      len(self.boxes) // 4, len(self._strings), string_offsets[-1]))
+            for values in (self.records, self.image_refs, self.objects, self.boxes, string_offsets):
+                _le(values).tofile(f)
+            f.write(b''.join(self._strings))
+        os.replace(tmp_path, path)
+
+
+class GroundingShardWriter:
+    """
+    将记录写成一组固定记录数的二进制分片 {name}-00000.v2qs, {name}-00001.v2qs, ...
+
+    Args:
+        output_dir (str): 输出目录。
+        name (str): 分片文件名前缀。
+        records_per_shard (int): 每个分片的记录数，最后一个分片可能更少。
+    """
+
+    def __init__(self, output_dir, name, records_per_shard=8192):
+        self.output_dir = output_dir
+        self.name = name
+        self.records_per_shard = records_per_shard
+        self.paths = []
+        self.count = 0
+        self._builder = ShardBuilder()
+
+    def write(self, record):
+        self._builder.add(record)
+        self.count += 1
+        if len(self._builder) >= self.records_per_shard:
+            self.flush()
+
+    def flush(self):
+        if len(self._builder) == 0:
+            return
+        path = shard_path(self.output_dir, self.name, len(self.paths))
+        self._builder.write(path)
+        self.paths.append(path)
+        self._builder = ShardBuilder()
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class GroundingShard:
+    """
+    单个分片的只读视图。各个表直接映射文件，get(i) 按需还原出与写入时完全相同的字典。
+
+    boxes(i) 返回第 i 条记录全部框的 (N, 4) int32 memoryview（没有框时为空的一维视图），不复制数据，
+    可用 numpy.asarray 直接转为数组。持有这些视图时不能 close。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._map = None
+        self._open()
+
+    def _open(self):
+        with open(self.path, 'rb') as f:
+            header = f.read(SHARD_HEADER.size)
+            if len(header) < SHARD_HEADER.size or header[:8] != SHARD_MAGIC:
+                raise ValueError(f"无效的分片文件: {self.path}")
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (_, self.num_records, num_image_refs, num_objects,
+         num_boxes, num_strings, _) = SHARD_HEADER.unpack(header)
+
+        sizes = (self.num_records * RECORD_FIELDS, num_image_refs, num_objects * OBJECT_FIELDS,
+                 num_boxes * 4, num_strings + 1)
+        ints_end = SHARD_HEADER.size + 4 * sum(sizes)
+        if sys.byteorder == 'little':
+            ints = memoryview(self._map)[SHARD_HEADER.size:ints_end].cast('i')
+        else:
+            ints = array('i', self._map[SHARD_HEADER.size:ints_end])
+            ints.byteswap()
+        self._ints = ints
+        tables = []
+        start = 0
+        for size in sizes:
+            tables.append(ints[start:start + size])
+            start += size
+        self._records, self._image_refs, self._objects, self._boxes, self._string_offsets = tables
+        self._blob = memoryview(self._map)[ints_end:]
+        self._string_cache = {}
+
+    def __getstate__(self):
+        return {'path': self.path}
+
+    def __setstate__(self, state):
+        self.path = state['path']
+        self._open()
+
+    def __len__(self):
+        return self.num_records
+
+    def string(self, string_id):
+        text = self._string_cache.get(string_id)
+        if text is None:
+            start, end = self._string_offsets[string_id], self._string_offsets[string_id + 1]
+            text = self._string_cache[string_id] = str(self._blob[start:end], 'utf-8')
+        return text
+
+    def _row(self, i):
+        if i < 0:
+            i += self.num_records
+        if not 0 <= i < self.num_records:
+            raise IndexError(f"记录下标越界: {i}")
+        return self._records[i * RECORD_FIELDS:(i + 1) * RECORD_FIELDS]
+
+    def _box_view(self, start, count):
+        if isinstance(self._boxes, memoryview):
+            if count == 0:
+                return self._boxes[0:0]
+            return self._boxes[start * 4:(start + count) * 4].cast('B').cast('i', [count, 4])
+        return [list(self._boxes[j:j + 4]) for j in range(start * 4, (start + count) * 4, 4)]
+
+    def get(self, i):
+        kind, query, response, image_start, image_count, object_start, object_count = self._row(i)
+        if kind == KIND_JSON:
+            return json.loads(self.string(query))
+
+        objects = []
+        for j in range(object_start, object_start + object_count):
+            caption, bbox_type, image, box_start, box_count, single = \
+                self._objects[j * OBJECT_FIELDS:(j + 1) * OBJECT_FIELDS]
+            if box_count == 0:
+                bbox = []
+            else:
+                bbox = self._box_view(box_start, box_count)
+                bbox = bbox.tolist() if isinstance(bbox, memoryview) else bbox
+                if single:
+                    bbox = bbox[0]
+            objects.append({"caption": self.string(caption), "bbox": bbox,
+                            "bbox_type": self.string(bbox_type), "image": image})
+        return {"query": self.string(query),
+                "response": self.string(response),
+                "images": [self.string(self._image_refs[j]) for j in range(image_start, image_start + image_count)],
+                "objects": objects}
+
+    def boxes(self, i):
+        kind, _, _, _, _, object_start, object_count = self._row(i)
+        if kind == KIND_JSON or object_count == 0:
+            return self._box_view(0, 0)
+        box_start = self._objects[object_start * OBJECT_FIELDS + 3]
+        last = (object_start + object_count - 1) * OBJECT_FIELDS
+        box_end = self._objects[last + 3] + self._objects[last + 4]
+        return self._box_view(box_start, box_end - box_start)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self.get(j) for j in range(*i.indices(len(self)))]
+        return self.get(i)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.get(i)
+
+    def close(self):
+        if self._map is None:
+            return
+        if isinstance(self._ints, memoryview):
+            for view in (self._records, self._image_refs, self._objects, self._boxes, self._string_offsets):
+                view.release()
+            self._ints.release()
+        self._blob.release()
+        self._map.close()
+        self._map = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ShardedGroundingDataset:
+    """
+    将一组分片拼接成一个可随机访问的数据集，可直接作为下游数据加载器的数据源，可被pickle。
+
+    Args:
+        paths (list): 分片路径，通常来自 list_shards(output_dir, name)。
+    """
+
+    def __init__(self, paths):
+        self.paths = list(paths)
+        self.shards = [GroundingShard(path) for path in self.paths]
+        self._ends = []
+        total = 0
+        for shard in self.shards:
+            total += len(shard)
+            self._ends.append(total)
+
+    @classmethod
+    def from_dir(cls, output_dir, name):
+        return cls(list_shards(output_dir, name))
+
+    def __getstate__(self):
+        return {'paths': self.paths}
+
+    def __setstate__(self, state):
+        self.__init__(state['paths'])
+
+    def __len__(self):
+        return self._ends[-1] if self._ends else 0
+
+    def locate(self, i):
+        """返回 (分片, 分片内下标)。"""
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(f"记录下标越界: {i}")
+        shard_id = bisect.bisect_right(self._ends, i)
+        return self.shards[shard_id], i - (self._ends[shard_id - 1] if shard_id else 0)
+
+    def get(self, i):
+        shard, j = self.locate(i)
+        return shard.get(j)
+
+    def boxes(self, i):
+        shard, j = self.locate(i)
+        return shard.boxes(j)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self.get(j) for j in range(*i.indices(len(self)))]
+        return self.get(i)
+
+    def __iter__(self):
+        for shard in self.shards:
+            yield from shard
+
+    def close(self):
+        for shard in self.shards:
+            shard.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def save_data_as_shards(data, output_dir, name, records_per_shard=8192):
+    """
+    将记录写成二进制分片，覆盖同名的旧分片，返回分片路径列表。
+    """
+    for old_path in list_shards(output_dir, name):
+        os.remove(old_path)
+    with GroundingShardWriter(output_dir, name, records_per_shard) as writer:
+        for record in data:
+            writer.write(record)
+    return writer.paths
+
+
+def iter_jsonl(jsonl_path):
+    with open(jsonl_path, 'rb') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def convert_jsonl_to_shards(jsonl_path, output_dir=None, records_per_shard=8192):
+    """
+    将一个输出的 jsonl 文件转换为同名前缀的二进制分片（默认放在同一目录），返回分片路径列表。
+    """
+    output_dir = output_dir or os.path.dirname(jsonl_path)
+    name = os.path.splitext(os.path.basename(jsonl_path))[0]
+    return save_data_as_shards(iter_jsonl(jsonl_path), output_dir, name, records_per_shard)
+
+
+# jsonl 分片：每个分片是普通的 jsonl 文件 {name}-00000.jsonl ...，另有分片清单 {name}.shards.json
+# 记录每个分片的记录数、字节数与各任务类型的记录数，各个数据并行进程可据此直接读取自己的分片。
+JSONL_SHARD_EXT = '.jsonl'
+
+
+def jsonl_shard_path(output_dir, name, shard_id):
+    return os.path.join(output_dir, f'{name}-{shard_id:05d}{JSONL_SHARD_EXT}')
+
+
+def shard_manifest_path(output_dir, name):
+    return os.path.join(output_dir, f'{name}.shards.json')
+
+
+def list_jsonl_shards(output_dir, name):
+    return sorted(glob.glob(os.path.join(glob.escape(output_dir), f'{glob.escape(name)}-[0-9]*{JSONL_SHARD_EXT}')))
+
+
+def _default_task_of(record):
+    from vary2qwen_tets import record_task_type
+    return record_task_type(record)
+
+
+class JsonlShardWriter:
+    """
+    将记录写成按记录数或字节数切分的 jsonl 分片，关闭时写出分片清单。
+    打开时会删除同名的旧分片，分片集合始终与清单一致。
+
+    Args:
+        output_dir (str): 输出目录。
+        name (str): 分片文件名前缀。
+        records_per_shard (int): 每个分片最多的记录数。
+        bytes_per_shard (int): 每个分片最多的字节数（单条记录超过该值时独占一个分片）。
+        task_of: 返回记录任务类型的函数，默认为 vary2qwen_tets.record_task_type。
+    """
+
+    def __init__(self, output_dir, name, records_per_shard=None, bytes_per_shard=None, task_of=None):
+        if not records_per_shard and not bytes_per_shard:
+            raise ValueError("records_per_shard 与 bytes_per_shard 至少需要指定一个")
+        self.output_dir = output_dir
+        self.name = name
+        self.records_per_shard = records_per_shard
+        self.bytes_per_shard = bytes_per_shard
+        self.task_of = task_of or _default_task_of
+        self.shards = []
+        self.paths = []
+        self._file = None
+        for old_path in list_jsonl_shards(output_dir, name):
+            os.remove(old_path)
+
+    @property
+    def count(self):
+        return sum(shard['records'] for shard in self.shards)
+
+    def _roll(self, line_size):
+        shard = self.shards[-1] if self._file is not None else None
+        if shard is not None:
+            full = ((self.records_per_shard and shard['records'] >= self.records_per_shard)
+                    or (self.bytes_per_shard and shard['records'] and shard['bytes'] + line_size > self.bytes_per_shard))
+            if not full:
+                return shard
+            self._file.close()
+        path = jsonl_shard_path(self.output_dir, self.name, len(self.shards))
+        self._file = open(path, 'wb')
+        self.paths.append(path)
+        shard = {'path': os.path.basename(path), 'records': 0, 'bytes': 0, 'records_by_task': {}}
+        self.shards.append(shard)
+        return shard
+
+    def write_line(self, line, task):
+        """写入一行已序列化的记录（以换行结尾的字节串）。"""
+        shard = self._roll(len(line))
+        self._file.write(line)
+        shard['records'] += 1
+        shard['bytes'] += len(line)
+        shard['records_by_task'][task] = shard['records_by_task'].get(task, 0) + 1
+
+    def write(self, record):
+        line = json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n'
+        self.write_line(line.encode('utf-8'), self.task_of(record))
+
+    def manifest(self):
+        records_by_task = {}
+        for shard in self.shards:
+            for task, n in shard['records_by_task'].items():
+                records_by_task[task] = records_by_task.get(task, 0) + n
+        return {'name': self.name,
+                'records': self.count,
+                'bytes': sum(shard['bytes'] for shard in self.shards),
+                'records_by_task': records_by_task,
+                'records_per_shard': self.records_per_shard,
+                'bytes_per_shard': self.bytes_per_shard,
+                'shards': self.shards}
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        path = shard_manifest_path(self.output_dir, self.name)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.manifest(), f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def load_shard_manifest(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def shards_for_rank(manifest_path, rank, world_size):
+    """
+    将清单中的分片按记录数均衡地分配给 world_size 个进程，返回第 rank 个进程的分片路径（保持原顺序）。
+    分配只依赖清单内容，各进程独立计算的结果一致。
+    """
+    manifest = load_shard_manifest(manifest_path)
+    shard_dir = os.path.dirname(manifest_path)
+    loads = [0] * world_size
+    owners = {}
+    # 大分片先分配，每次交给当前记录数最少的进程
+    order = sorted(range(len(manifest['shards'])), key=lambda i: (-manifest['shards'][i]['records'], i))
+    for i in order:
+        owner = min(range(world_size), key=lambda r: (loads[r], r))
+        owners[i] = owner
+        loads[owner] += manifest['shards'][i]['records']
+    return [os.path.join(shard_dir, shard['path'])
+            for i, shard in enumerate(manifest['shards']) if owners[i] == rank]
+
+
+def iter_shard_records(paths):
+    for path in paths:
+        yield from iter_jsonl(path)
+
+
+def shuffle_jsonl_shards(output_dir, name, seed=0, bucket_bytes=256 * 1024 * 1024, tmp_dir=None):
+    """
+    跨分片全局打乱，内存占用不超过约 bucket_bytes。
+
+    第一遍把每行随机分配到若干临时桶文件，第二遍逐个桶在内存中打乱后依次写出，
+    得到的是全部记录的均匀随机排列。新分片沿用清单中的切分参数，全部写完后才替换旧分片。
+    """
+    manifest = load_shard_manifest(shard_manifest_path(output_dir, name))
+    paths = [os.path.join(output_dir, shard['path']) for shard in manifest['shards']]
+    num_buckets = max(1, -(-manifest['bytes'] // bucket_bytes))
+    rng = random.Random(seed)
+
+    work_dir = tempfile.mkdtemp(prefix=f'{name}.shuffle.', dir=tmp_dir or output_dir)
+    try:
+        bucket_paths = [os.path.join(work_dir, f'bucket-{i:05d}') for i in range(num_buckets)]
+        buckets = [open(path, 'wb') for path in bucket_paths]
+        try:
+            for path in paths:
+                with open(path, 'rb') as f:
+                    for line in f:
+                        if line.strip():
+                            buckets[rng.randrange(num_buckets)].write(line if line.endswith(b'\n') else line + b'\n')
+        finally:
+            for bucket in buckets:
+                bucket.close()
+
+        new_dir = os.path.join(work_dir, 'shards')
+        os.makedirs(new_dir)
+        with JsonlShardWriter(new_dir, name, manifest['records_per_shard'], manifest['bytes_per_shard']) as writer:
+            for bucket_path in bucket_paths:
+                with open(bucket_path, 'rb') as f:
+                    lines = f.readlines()
+                os.remove(bucket_path)
+                rng.shuffle(lines)
+                for line in lines:
+                    writer.write_line(line, writer.task_of(json.loads(line)))
+
+        # 新分片覆盖同名旧分片，再删除多出来的旧分片
+        new_paths = []
+        for path in writer.paths:
+            new_paths.append(os.path.join(output_dir, os.path.basename(path)))
+            os.replace(path, new_paths[-1])
+        os.replace(shard_manifest_path(new_dir, name), shard_manifest_path(output_dir, name))
+        for path in set(paths) - set(new_paths):
+            os.remove(path)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return new_paths
@@ -0,0 +1,518 @@
+import argparse
+import html
+import json
+import math
+import os
+from collections import Counter
+from multiprocessing import Pool
+
+import numpy as np
+
+from vary2qwen_index import record_captions
+from vary2qwen_tets import record_image, record_task_type
+
+# 各分布的直方图分箱。分箱固定，多个进程的结果直接相加即可合并；超出范围的值计入首/末箱
+LENGTH_EDGES = np.array([0] + [2 ** i for i in range(13)], dtype=np.float64)
+DISTRIBUTIONS = {
+    'boxes_per_image': np.arange(0, 65, dtype=np.float64),
+    'box_area': np.logspace(0, 8, 25),
+    'box_rel_area': np.logspace(-6, 0, 25),
+    'box_aspect': np.logspace(-2, 2, 25),
+    'query_length': LENGTH_EDGES,
+    'response_length': LENGTH_EDGES,
+}
+# 每类异常最多保留的样例数
+MAX_EXAMPLES = 20
+# 每批向量化处理的框数
+BOX_BATCH = 65536
+
+
+class QuantileSketch:
+    """
+    内存有界、可合并的分位数草图（对数分桶，相对误差 relative_accuracy）。
+
+    非负值 x 落入编号为 ceil(log_gamma(x)) 的桶，0 单独计数；桶数超过 max_bins 时合并最小的桶，
+    只牺牲低分位的精度。两个草图的桶计数相加即为合并结果，与数据的切分方式无关。
+    """
+
+    def __init__(self, relative_accuracy=0.01, max_bins=2048):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.max_bins = max_bins
+        self.bins = {}
+        self.zeros = 0
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, values):
+        values = np.asarray(values, dtype=np.float64).ravel()
+        if not values.size:
+            return
+        self.count += values.size
+        self.total += float(values.sum())
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+        positive = values[values > 0]
+        self.zeros += values.size - positive.size
+        keys, counts = np.unique(np.ceil(np.log(positive) / self._log_gamma).astype(np.int64), return_counts=True)
+        bins = self.bins
+        for key, count in zip(keys.tolist(), counts.tolist()):
+            bins[key] = bins.get(key, 0) + count
+        self._collapse()
+
+    def merge(self, other):
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.zeros += other.zeros
+        for key, count in other.bins.items():
+            self.bins[key] = self.bins.get(key, 0) + count
+        self._collapse()
+
+    def _collapse(self):
+        if len(self.bins) <= self.max_bins:
+            return
+        keys = sorted(self.bins)
+        excess = keys[:len(keys) - self.max_bins + 1]
+        self.bins[excess[-1]] = sum(self.bins.pop(key) for key in excess[:-1]) + self.bins[excess[-1]]
+
+    def quantile(self, q):
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        if rank < self.zeros:
+            return 0.0
+        seen = self.zeros
+        for key in sorted(self.bins):
+            seen += self.bins[key]
+            if seen > rank:
+                value = 2 * self.gamma ** key / (self.gamma + 1)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def summary(self):
+        if not self.count:
+            return {'count': 0}
+        return {'count': self.count, 'min': self.min, 'max': self.max, 'mean': self.total / self.count,
+                'p50': self.quantile(0.5), 'p90': self.quantile(0.9), 'p99': self.quantile(0.99)}
+
+
+class Distribution:
+    """固定分箱的直方图加分位数草图。"""
+
+    def __init__(self, edges):
+        self.edges = edges
+        self.counts = np.zeros(len(edges) - 1, dtype=np.int64)
+        self.sketch = QuantileSketch()
+
+    def add(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        if not values.size:
+            return
+        self.counts += np.histogram(np.clip(values, self.edges[0], self.edges[-1]), self.edges)[0]
+        self.sketch.add(values)
+
+    def merge(self, other):
+        self.counts += other.counts
+        self.sketch.merge(other.sketch)
+
+    def report(self):
+        return dict(self.sketch.summary(), histogram={'edges': self.edges.tolist(), 'counts': self.counts.tolist()})
+
+
+def _as_boxes(bbox):
+    # 单个框 [x1, y1, x2, y2] 或框列表
+    if bbox and not isinstance(bbox[0], list):
+        return [bbox]
+    return bbox
+
+
+class DatasetStats:
+    """
+    一个数据集（或其中一段）的统计，多个进程各自统计后用 merge 合并。
+
+    异常标记（outliers）：
+        zero_area        面积为0的框（x2 <= x1 或 y2 <= y1）
+        out_of_image     还原并截断负坐标后仍超出图像宽高的框
+        negative_coord   含负坐标的框
+        bad_box          不是4个数的框
+        empty_objects    没有任何目标的 grounding 记录
+        empty_response   回答为空的问答记录
+        missing_size     图像宽高未知，无法判断是否越界（输出文件需 probe_sizes）
+    """
+
+    def __init__(self):
+        self.records = 0
+        self.tasks = Counter()
+        self.classes = Counter()
+        self.rejected = Counter()
+        self.outliers = Counter()
+        self.examples = {}
+        self.distributions = {name: Distribution(edges) for name, edges in DISTRIBUTIONS.items()}
+        # 按批累积，flush 时一次向量化计算
+        self._query_lengths = []
+        self._response_lengths = []
+        self._boxes_per_image = []
+        self._boxes = []
+        self._sizes = []
+        self._sources = []
+
+    def _example(self, kind, source, **detail):
+        examples = self.examples.setdefault(kind, [])
+        if len(examples) < MAX_EXAMPLES:
+            examples.append(dict(source, **detail))
+
+    def _flag(self, kind, source, **detail):
+        self.outliers[kind] += 1
+        self._example(kind, source, **detail)
+
+    def add(self, record, source, image_size=None):
+        """
+        统计一条输出记录。source 为样例中记录位置的字典（如 {"file", "offset"}），
+        image_size 为 (height, width)，未知时为 None。
+        """
+        if len(self._query_lengths) >= BOX_BATCH or len(self._boxes) >= BOX_BATCH:
+            self.flush()
+        self.records += 1
+        task = record_task_type(record)
+        self.tasks[task] += 1
+        self.classes.update(record_captions(record))
+        self._query_lengths.append(len(record.get("query", '')))
+        self._response_lengths.append(len(record.get("response", '')))
+        if task != 'grounding':
+            if not record.get("response", '').strip():
+                self._flag('empty_response', source)
+            return
+
+        boxes = 0
+        for obj in record["objects"]:
+            for box in _as_boxes(obj.get("bbox") or []):
+                if not isinstance(box, list) or len(box) != 4 or not all(isinstance(v, (int, float)) for v in box):
+                    self._flag('bad_box', source, caption=obj.get("caption"), bbox=box)
+                    continue
+                boxes += 1
+                self._boxes.append(box)
+                self._sizes.append(image_size or (0, 0))
+                self._sources.append((source, obj.get("caption")))
+        self._boxes_per_image.append(boxes)
+        if not record["objects"]:
+            self._flag('empty_objects', source)
+        if boxes and image_size is None:
+            self.outliers['missing_size'] += 1
+
+    def flush(self):
+        self.distributions['query_length'].add(self._query_lengths)
+        self.distributions['response_length'].add(self._response_lengths)
+        self.distributions['boxes_per_image'].add(self._boxes_per_image)
+        self._query_lengths, self._response_lengths, self._boxes_per_image = [], [], []
+        if not self._boxes:
+            return
+        boxes = np.asarray(self._boxes, dtype=np.float64)
+        sizes = np.asarray(self._sizes, dtype=np.float64)
+        widths = boxes[:, 2] - boxes[:, 0]
+        heights = boxes[:, 3] - boxes[:, 1]
+        area = np.clip(widths, 0, None) * np.clip(heights, 0, None)
+        known = (sizes[:, 0] > 0) & (sizes[:, 1] > 0)
+        flags = {
+            'zero_area': area <= 0,
+            'negative_coord': (boxes < 0).any(axis=1),
+            'out_of_image': known & ((boxes[:, 2] > sizes[:, 1]) | (boxes[:, 3] > sizes[:, 0])),
+        }
+        for kind, mask in flags.items():
+            flagged = np.flatnonzero(mask)
+            if not flagged.size:
+                continue
+            self.outliers[kind] += int(flagged.size)
+            for i in flagged[:MAX_EXAMPLES].tolist():
+                source, caption = self._sources[i]
+                detail = {'caption': caption, 'bbox': self._boxes[i]}
+                if known[i]:
+                    detail['image_size'] = [int(sizes[i, 0]), int(sizes[i, 1])]
+                self._example(kind, source, **detail)
+
+        valid = area > 0
+        self.distributions['box_area'].add(area[valid])
+        self.distributions['box_aspect'].add(widths[valid] / heights[valid])
+        relative = valid & known
+        self.distributions['box_rel_area'].add(area[relative] / (sizes[relative, 0] * sizes[relative, 1]))
+        self._boxes, self._sizes, self._sources = [], [], []
+
+    def merge(self, other):
+        other.flush()
+        self.flush()
+        self.records += other.records
+        self.tasks.update(other.tasks)
+        self.classes.update(other.classes)
+        self.rejected.update(other.rejected)
+        self.outliers.update(other.outliers)
+        for kind, examples in other.examples.items():
+            mine = self.examples.setdefault(kind, [])
+            mine.extend(examples[:MAX_EXAMPLES - len(mine)])
+        for name, distribution in other.distributions.items():
+            self.distributions[name].merge(distribution)
+
+    def __getstate__(self):
+        self.flush()
+        return self.__dict__
+
+    def report(self, top_classes=None):
+        self.flush()
+        classes = self.classes.most_common(top_classes)
+        report = {
+            'records': self.records,
+            'tasks': dict(self.tasks),
+            'task_mix': {task: round(n / self.records, 4) for task, n in self.tasks.items()} if self.records else {},
+            'classes': dict(classes),
+            'num_classes': len(self.classes),
+            'distributions': {name: d.report() for name, d in self.distributions.items()},
+            'outliers': dict(self.outliers),
+            'examples': self.examples,
+        }
+        if self.rejected:
+            report['rejected'] = dict(self.rejected)
+        return report
+
+
+def jsonl_ranges(jsonl_path, chunk_bytes=64 * 1024 * 1024):
+    """把 jsonl 文件按字节切成若干段，每段由一个进程统计。"""
+    size = os.path.getsize(jsonl_path)
+    return [(jsonl_path, start, min(start + chunk_bytes, size)) for start in range(0, size, chunk_bytes)]
+
+
+def _image_size_fn(size_cache):
+    # 输出记录不含图像宽高，需要时从图像文件头读取（带缓存）
+    if size_cache is False:
+        return None, None
+    from vary2qwen_probe import ImageSizeProbe
+    probe = ImageSizeProbe(size_cache)
+
+    def image_size(image_path):
+        try:
+            return tuple(probe.size(image_path))
+        except (OSError, ValueError):
+            return None
+    return probe, image_size
+
+
+def profile_jsonl_range(jsonl_path, start, end, size_cache=False):
+    """
+    统计 jsonl 文件中起始位置落在 [start, end) 内的各行。
+    size_cache 为 False 时不读取图像宽高，否则为尺寸缓存路径（None 表示不使用缓存）。
+    """
+    stats = DatasetStats()
+    probe, image_size = _image_size_fn(size_cache)
+    with open(jsonl_path, 'rb') as f:
+        if start > 0:
+            # 跳过上一段的最后一行
+            f.seek(start - 1)
+            f.readline()
+        offset = f.tell()
+        while offset < end:
+            line = f.readline()
+            if not line:
+                break
+            if line.strip():
+                record = json.loads(line)
+                size = image_size(record_image(record)) if image_size is not None and "objects" in record else None
+                stats.add(record, {'file': jsonl_path, 'offset': offset}, size)
+            offset += len(line)
+    if probe is not None:
+        probe.save()
+    return stats
+
+
+def profile_label_files(label_paths, img_dir):
+    """
+    统计原始 Vary 标注：按 process_label_dir 的方式在内存中转换，图像宽高取自标注，
+    校验失败的文件计入 rejected。label_paths 为标注文件路径或 (路径, 原始内容)。
+    """
+    from vary2qwen_metrics import ConversionMetrics
+    from vary2qwen_tets import convert_label_data
+
+    stats = DatasetStats()
+    metrics = ConversionMetrics()
+    for label in label_paths:
+        if isinstance(label, tuple):
+            label_path, raw = label
+        else:
+            label_path = label
+            try:
+                with open(label_path, 'rb') as f:
+                    raw = f.read()
+            except OSError:
+                stats.rejected['read_error'] += 1
+                continue
+        try:
+            data = json.loads(raw)
+        except ValueError:
+            stats.rejected['decode_error'] += 1
+            continue
+        try:
+            records = convert_label_data(data, img_dir, label_path, metrics, verbose=False)
+            size = (int(data["height"]), int(data["width"])) if records else None
+        except Exception:
+            stats.rejected['convert_error'] += 1
+            continue
+        for record in records:
+            stats.add(record, {'file': label_path}, size)
+    stats.rejected.update(metrics.group('rejected'))
+    return stats
+
+
+def profile_label_archive(archive_path, img_dir):
+    from vary2qwen_archive import iter_archive_members
+    return profile_label_files(iter_archive_members([archive_path]), img_dir)
+
+
+def _run_task(task):
+    kind, args = task
+    if kind == 'jsonl':
+        return profile_jsonl_range(*args)
+    if kind == 'archive':
+        return profile_label_archive(*args)
+    return profile_label_files(*args)
+
+
+def profile_tasks(tasks, workers=1):
+    """并行执行统计任务并合并结果，结果与任务的划分方式和进程数无关（样例的选取除外）。"""
+    stats = DatasetStats()
+    if workers <= 1:
+        results = map(_run_task, tasks)
+    else:
+        pool = Pool(workers)
+        results = pool.imap_unordered(_run_task, tasks)
+    try:
+        for result in results:
+            stats.merge(result)
+    finally:
+        if workers > 1:
+            pool.close()
+            pool.join()
+    return stats
+
+
+def output_tasks(path, size_cache=False, chunk_bytes=64 * 1024 * 1024):
+    """输出文件（或目录中全部 jsonl 输出，含分片）的统计任务。"""
+    if os.path.isdir(path):
+        paths = sorted(os.path.join(path, f) for f in os.listdir(path)
+                       if f.endswith('.jsonl') and not f.endswith(('.duplicates.jsonl', '.manifest.jsonl')))
+    else:
+        paths = [path]
+    return [('jsonl', (jsonl_path, start, end, size_cache))
+            for jsonl_path in paths for jsonl_path, start, end in jsonl_ranges(jsonl_path, chunk_bytes)]
+
+
+def label_tasks(label_dir, img_dir, files_per_task=1024, include=None, exclude=None, recursive=False,
+                walk_threads=8):
+    """
+    原始标注文件夹或标注归档的统计任务。标注文件的查找方式与转换相同（见 vary2qwen_discover.LabelWalker）：
+    include/exclude 为 glob 规则，recursive 为真时包含子目录；目录中没有标注文件时按归档分片统计。
+    """
+    from vary2qwen_archive import list_label_archives
+    from vary2qwen_discover import LabelWalker
+    label_paths = []
+    if not os.path.isfile(label_dir):
+        label_paths = [entry.path for entry in LabelWalker(include, exclude, recursive, walk_threads).walk(label_dir)]
+    if not label_paths:
+        archives = list_label_archives(label_dir)
+        if archives:
+            return [('archive', (archive, img_dir)) for archive in archives]
+    return [('labels', (label_paths[i:i + files_per_task], img_dir))
+            for i in range(0, len(label_paths), files_per_task)]
+
+
+def _format(value):
+    if value is None:
+        return ''
+    if isinstance(value, float):
+        return f'{value:.4g}'
+    return str(value)
+
+
+def _bars(counts, edges):
+    peak = max(counts) or 1
+    cells = ''.join(f'<div class="bar" style="height:{round(60 * c / peak)}px" '
+                    f'title="[{_format(lo)}, {_format(hi)}): {c}"></div>'
+                    for c, lo, hi in zip(counts, edges, edges[1:]))
+    return f'<div class="hist">{cells}</div>'
+
+
+def render_html(reports):
+    """把 {数据集名: 报告} 渲染为单个 html 页面。"""
+    parts = ['<!DOCTYPE html><html><head><meta charset="utf-8"><title>数据集统计</title><style>'
+             'body{font-family:sans-serif;margin:24px}table{border-collapse:collapse;margin:8px 0}'
+             'td,th{border:1px solid #ccc;padding:2px 8px;text-align:right}th{background:#f4f4f4}'
+             '.hist{display:flex;align-items:flex-end;height:60px;gap:1px}.bar{width:8px;background:#4a7bd0}'
+             '.warn{color:#c00}</style></head><body>']
+    for name, report in reports.items():
+        esc = html.escape
+        parts.append(f'<h2>{esc(name)}</h2><p>{report["records"]} 条记录，{report["num_classes"]} 个类别</p>')
+        parts.append('<table><tr><th>任务</th><th>记录数</th><th>占比</th></tr>' + ''.join(
+            f'<tr><td>{esc(task)}</td><td>{n}</td><td>{report["task_mix"][task]:.1%}</td></tr>'
+            for task, n in report['tasks'].items()) + '</table>')
+        parts.append('<table><tr><th>分布</th><th>数量</th><th>最小</th><th>p50</th><th>p90</th><th>p99</th>'
+                     '<th>最大</th><th>均值</th><th>直方图</th></tr>')
+        for dist_name, dist in report['distributions'].items():
+            parts.append(f'<tr><td>{dist_name}</td><td>{dist["count"]}</td>' + ''.join(
+                f'<td>{_format(dist.get(key))}</td>' for key in ('min', 'p50', 'p90', 'p99', 'max', 'mean'))
+                + f'<td>{_bars(dist["histogram"]["counts"], dist["histogram"]["edges"])}</td></tr>')
+        parts.append('</table>')
+        if report['outliers']:
+            parts.append('<table><tr><th>异常</th><th>数量</th><th>样例</th></tr>' + ''.join(
+                f'<tr><td class="warn">{kind}</td><td>{n}</td><td style="text-align:left">'
+                + '<br>'.join(esc(json.dumps(e, ensure_ascii=False)) for e in report['examples'].get(kind, [])[:5])
+                + '</td></tr>' for kind, n in report['outliers'].items()) + '</table>')
+        peak = max(report['classes'].values(), default=1)
+        parts.append('<table><tr><th>类别</th><th>框数</th><th></th></tr>' + ''.join(
+            f'<tr><td>{esc(c)}</td><td>{n}</td><td style="text-align:left"><div class="bar" '
+            f'style="height:10px;width:{max(1, round(300 * n / peak))}px"></div></td></tr>'
+            for c, n in report['classes'].items()) + '</table>')
+    parts.append('</body></html>')
+    return '\n'.join(parts)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='统计转换输出或原始 Vary 标注：类别、框数、框面积与宽高比、文本长度、任务占比与异常')
+    parser.add_argument('paths', nargs='+', help='输出 jsonl 文件或目录；--raw 时为标注文件夹或标注归档')
+    parser.add_argument('--raw', action='store_true', help='统计原始 Vary 标注')
+    parser.add_argument('--images', default='', help='--raw 时的图像目录（只用于拼接图像路径）')
+    parser.add_argument('--include', nargs='+', help='--raw 时标注文件的 glob 规则，默认 *.json')
+    parser.add_argument('--exclude', nargs='+', help='--raw 时排除的文件/目录 glob 规则')
+    parser.add_argument('--recursive', action='store_true', help='--raw 时递归查找子目录中的标注文件')
+    parser.add_argument('--walk-threads', type=int, default=8, help='递归查找时并行列目录的线程数')
+    parser.add_argument('--probe-sizes', action='store_true', help='统计输出文件时从图像文件头读取宽高以检查越界')
+    parser.add_argument('--size-cache', default=None, help='图像尺寸缓存文件')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='统计进程数')
+    parser.add_argument('--top', type=int, default=None, help='报告中只列出最多的若干个类别')
+    parser.add_argument('--json', default=None, help='json 报告路径')
+    parser.add_argument('--html', default=None, help='html 报告路径')
+    args = parser.parse_args(argv)
+
+    reports = {}
+    size_cache = args.size_cache if args.probe_sizes else False
+    for path in args.paths:
+        if args.raw:
+            tasks = label_tasks(path, args.images, include=args.include, exclude=args.exclude,
+                                recursive=args.recursive, walk_threads=args.walk_threads)
+        else:
+            tasks = output_tasks(path, size_cache)
+        report = profile_tasks(tasks, args.workers).report(args.top)
+        reports[os.path.basename(os.path.normpath(path))] = report
+        print(f"{path}: {report['records']} 条记录, 任务 {report['tasks']}, {report['num_classes']} 个类别, "
+              f"异常 {report['outliers']}")
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(reports, f, ensure_ascii=False, indent=2)
+        print(f"json 报告已保存到 {args.json}")
+    if args.html:
+        with open(args.html, 'w', encoding='utf-8') as f:
+            f.write(render_html(reports))
+        print(f"html 报告已保存到 {args.html}")
+
+
+if __name__ == '__main__':
+    main()
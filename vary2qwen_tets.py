@@ -1,38 +1,136 @@
+import hashlib
 import json
 import os
 import random
 import re
-import cv2
-from collections import defaultdict
+import threading
+import time
+from collections import defaultdict, deque, namedtuple
+from functools import lru_cache, partial
+from itertools import chain, islice
+from multiprocessing import Pool
+
+from vary2qwen_archive import count_archive_members, iter_archive_members, list_label_archives
+from vary2qwen_dedup import Deduplicator, ImageHasher
+from vary2qwen_discover import LabelWalker, timed
+from vary2qwen_index import build_caption_index, build_index, update_caption_index, update_index
+from vary2qwen_manifest import ConversionManifest
+from vary2qwen_metrics import ConversionMetrics, ProgressReporter, active_metrics, use_metrics
+from vary2qwen_preflight import ImagePreflight
+from vary2qwen_probe import ImageSizeProbe
+from vary2qwen_record import CompactRecord, compact_records
+from vary2qwen_shard import (JsonlShardWriter, convert_jsonl_to_shards, list_jsonl_shards, shard_manifest_path,
+                             shuffle_jsonl_shards)
+
+def restore_boxes(boxes, heights, widths, counts=None, BOX_SCALE=999, renormalize=False):
+    """
+    批量还原vary格式的边界框（向量化实现）。
+
+    依次执行：按 max(height, width) 等比例放大、去除letterbox填充、负坐标截断为0，
+    可选再按图像宽高归一化到999。取整方式与逐框的Python实现一致（int() 向零取整）。
+
+    Args:
+        boxes: (N, 4) 的框数组或嵌套列表。
+        heights, widths: 标量、每个框一个值的 (N,) 数组，
+            或在给定 counts 时每张图一个值的 (M,) 数组。
+        counts: 可选，每张图包含的框数 (M,)，用于整批（如一个分片）一次还原。
+        BOX_SCALE (int): vary格式的坐标范围。
+        renormalize (bool): 是否再归一化到999（restore_bbox_in_json 使用）。
+    Returns:
+        np.ndarray: (N, 4) 的 int64 数组。
+    """
+    # numpy 只在需要还原边界框时导入，不含框的问答数据和只用到解析函数的进程不必加载
+    import numpy as np
+    boxes = np.asarray(boxes, dtype=np.float64)
+    if boxes.size == 0:
+        return np.zeros((0, 4), dtype=np.int64)
+    if boxes.ndim != 2 or boxes.shape[1] < 4:
+        raise ValueError(f"边界框形状应为 (N, 4)，实际为 {boxes.shape}")
+    boxes = boxes[:, :4]
+
+    heights = np.asarray(heights, dtype=np.float64)
+    widths = np.asarray(widths, dtype=np.float64)
+    if counts is not None:
+        heights = np.repeat(heights, counts)
+        widths = np.repeat(widths, counts)
+    heights = np.broadcast_to(heights, (len(boxes),))
+    widths = np.broadcast_to(widths, (len(boxes),))
+
+    # 按比例还原到原始大小
+    side = np.maximum(heights, widths)
+    restored = np.trunc(boxes / BOX_SCALE * side[:, None])
+
+    # 去除短边两侧的填充：宽图平移y，高图平移x
+    delta = np.floor_divide(np.abs(widths - heights), 2)
+    restored[:, 1::2] -= np.where(heights < widths, delta, 0)[:, None]
+    restored[:, 0::2] -= np.where(heights > widths, delta, 0)[:, None]
+    np.maximum(restored, 0, out=restored)
+
+    if renormalize:
+        # 归一化到1000
+        dims = np.stack([widths, heights, widths, heights], axis=1)
+        if not dims.all():
+            raise ZeroDivisionError("图像宽高不能为0")
+        restored = np.trunc(restored / dims * 999)
+
+    return restored.astype(np.int64)
+
+# 一个文件中的框数少于该值时逐框用纯Python还原：numpy 每次调用的固定开销高于少量框的计算量
+VECTORIZE_MIN_BOXES = 32
+
+def restore_box(bbox, height, width, BOX_SCALE=999, renormalize=False):
+    """
+    逐框还原vary格式的边界框（纯Python实现），结果与 restore_boxes 一致。
+    只使用前4个坐标，多余的坐标被忽略。
+    """
+    side = max(height, width)
+    # 按比例还原到原始大小
+    bbox = [
+        int(bbox[0]/BOX_SCALE * side),
+        int(bbox[1]/BOX_SCALE * side),
+        int(bbox[2]/BOX_SCALE * side),
+        int(bbox[3]/BOX_SCALE * side),
+    ]
+    if height < width:
+        delta=(width-height)//2
+        bbox[1]-= delta
+        bbox[3]-= delta
+    elif height > width:
+        delta=(height - width)// 2
+        bbox[0]-= delta
+        bbox[2]-= delta
+    bbox = [coord if coord > 0 else 0 for coord in bbox]
+    if renormalize:
+        # 归一化到1000
+        bbox = [int(coord / dim * 999) for coord, dim in zip(bbox, [width, height, width, height])]
+    return bbox
+
+def restore_box_groups(groups, height, width, BOX_SCALE=999, renormalize=False):
+    """
+    还原同一张图上的多组框（如各类别、各轮对话），返回与 groups 一一对应的框列表。
+    框数达到 VECTORIZE_MIN_BOXES 且每个框恰有4个坐标时合并为一次 restore_boxes 调用，
+    否则逐框还原；坐标数不为4的框按逐框实现的方式处理（多余坐标被忽略，不足时报错）。
+    """
+    total = sum(len(group) for group in groups)
+    if total < VECTORIZE_MIN_BOXES or any(len(bbox) != 4 for group in groups for bbox in group):
+        return [[restore_box(bbox, height, width, BOX_SCALE, renormalize) for bbox in group] for group in groups]
+    flat = [bbox for group in groups for bbox in group]
+    restored = restore_boxes(flat, height, width, BOX_SCALE=BOX_SCALE, renormalize=renormalize).tolist()
+    result = []
+    offset = 0
+    for group in groups:
+        result.append(restored[offset:offset + len(group)])
+        offset += len(group)
+    return result
 
 def od_restore_bbox(bboxes, image_h_w, BOX_SCALE = 999):
-    restored_bboxes = {}
+    start = time.perf_counter()
     height, width = image_h_w
-    for classname, boxes in bboxes.items():
-        restored_boxes = []
-        for bbox in boxes:
-            # 按比例还原到原始大小
-            bbox = [
-                int(bbox[0]/BOX_SCALE * max(height, width)),
-                int(bbox[1]/BOX_SCALE * max(height, width)),
-                int(bbox[2]/BOX_SCALE * max(height, width)),
-                int(bbox[3]/BOX_SCALE * max(height, width)),
-            ]
-            if height == width:
-                pass
-            elif height < width:
-                delta=(width-height)//2
-                bbox[1]-= delta
-                bbox[3]-= delta
-            else:
-                delta=(height - width)// 2
-                bbox[0]-= delta
-                bbox[2]-= delta
-            for i in range(len(bbox)):
-                if bbox[i]< 0:
-                    bbox[i]= 0
-            restored_boxes.append(bbox)
-        restored_bboxes[classname] = restored_boxes
+    # 所有类别的框一起还原，框多时只调用一次向量化实现
+    classnames = list(bboxes.keys())
+    restored = restore_box_groups([bboxes[classname] for classname in classnames], height, width, BOX_SCALE)
+    restored_bboxes = dict(zip(classnames, restored))
+    _tick(active_metrics(), 'restore', start)
     return restored_bboxes
 
 def dumy_obj(objects):
@@ -41,46 +139,105 @@ def dumy_obj(objects):
         output_str = output_str + "<ref>"+ k + "</ref>" + "<box>" + json.dumps(v) + '</box>,'
     output_str = output_str[:-1]
     return output_str
-def extract_obj(
-    grounded_caption: str,
-    grounded_pattern: str = r'<.*?>.*?<.*?>',):
-    
-   
-    REF_START_TAG = '<ref>'
-    REF_END_TAG = '</ref>'
-    BOX_START_TAG = '<box>'
-    BOX_END_TAG = '</box>'
-    REL_START_TAG = '<pred>'
-    REL_END_TAG = '</pred>'
-    
+# <ref>/<box>/<pred> 标签，模式只编译一次
+GROUNDING_TAG_RE = re.compile(r'<(ref|box|pred)>(.*?)</\1>')
+
+GroundedTokens = namedtuple('GroundedTokens', ['tokens', 'clean_caption'])
+
+@lru_cache(maxsize=1024)
+def tokenize_grounded_caption(grounded_caption):
+    """
+    单次扫描带标签的描述文本。结果按描述文本缓存，解析耗时由调用方计入 parse，缓存命中时不重复计时。
+
+    Returns:
+        GroundedTokens: tokens 为按出现顺序排列的 (标签名, 标签内容) 元组，
+        标签名为 'ref'、'box' 或 'pred'；clean_caption 为去掉 ref/pred 标签
+        和整个 box 标签后的文本。
+    """
+    tokens = []
+    pieces = []
+    pos = 0
+    for match in GROUNDING_TAG_RE.finditer(grounded_caption):
+        pieces.append(grounded_caption[pos:match.start()])
+        tag, value = match.group(1), match.group(2)
+        if tag != 'box':
+            pieces.append(value)
+        tokens.append((tag, value))
+        pos = match.end()
+    pieces.append(grounded_caption[pos:])
+    return GroundedTokens(tuple(tokens), ''.join(pieces))
+
+def tag_values(grounded_caption, tag):
+    # 按顺序返回某一种标签的全部内容
+    start = time.perf_counter()
+    values = [value for name, value in tokenize_grounded_caption(grounded_caption).tokens if name == tag]
+    _tick(active_metrics(), 'parse', start)
+    return values
+
+def parse_grounded_caption(grounded_caption: str):
+    """
+    解析带标签的描述，一次返回目标、关系和去标签后的文本。
+
+    <box> 归属于其前面最近的 <ref>（目标）或 <pred>（关系），
+    前面没有标签的 <box> 归入 'obj'。
+
+    Returns:
+        tuple: (objects, relations, clean_caption)
+    """
+    start = time.perf_counter()
+    tokens, clean_caption = tokenize_grounded_caption(grounded_caption)
     objects = defaultdict(list)
     relations = defaultdict(list)
-    clean_caption = grounded_caption
-    clean_caption = clean_caption.replace(REF_START_TAG, '').replace(REF_END_TAG, '')
-    clean_caption = clean_caption.replace(REL_START_TAG, '').replace(REL_END_TAG, '')
-    res = re.findall(grounded_pattern, grounded_caption)
-                                                            
     last_tag = None
     last_tag_value = None
-    for item in res:
-        clean_item = re.sub(r'<.*?>', '', item)
+    for tag, value in tokens:
+        if tag == 'box':
+            try:
+                boxes = json.loads(value)
+            except Exception as e:
+                print('Invalid format:', value)
+                raise e
+            if last_tag == 'ref':
+                objects[last_tag_value].extend(boxes)
+            elif last_tag == 'pred':
+                relations[last_tag_value].append(boxes)
+            else:
+                objects['obj'].extend(boxes)
+        else:
+            last_tag = tag
+            last_tag_value = value
+    _tick(active_metrics(), 'parse', start)
+    return objects, relations, clean_caption
 
-        if item.startswith(BOX_START_TAG):
-            clean_caption = clean_caption.replace(item, '')
+def extract_obj(grounded_caption: str, grounded_pattern: str = None):
+    """
+    提取描述中的目标 {类别: [框, ...]}。
+    给定 grounded_pattern（逐个匹配标签的正则，如 r'<.*?>.*?<.*?>'）时按该模式匹配，不使用分词缓存。
+    """
+    if grounded_pattern is None:
+        objects, _, _ = parse_grounded_caption(grounded_caption)
+        return objects
+
+    start = time.perf_counter()
+    objects = defaultdict(list)
+    last_tag = None
+    last_tag_value = None
+    for item in re.findall(grounded_pattern, grounded_caption):
+        clean_item = re.sub(r'<.*?>', '', item)
+        if item.startswith('<box>'):
             try:
-                clean_item = json.loads(clean_item)
+                boxes = json.loads(clean_item)
             except Exception as e:
                 print('Invalid format:', clean_item)
                 raise e
-            if last_tag == REF_START_TAG:
-                objects[last_tag_value].extend(clean_item)
-            elif last_tag == REL_START_TAG:
-                relations[last_tag_value].append(clean_item)
-            else:
-                objects['obj'].extend(clean_item)
+            if last_tag == 'ref':
+                objects[last_tag_value].extend(boxes)
+            elif last_tag != 'pred':
+                objects['obj'].extend(boxes)
         else:
-            last_tag = REF_START_TAG if item.startswith(REF_START_TAG) else REL_START_TAG
-            last_tag_value = clean_item  
+            last_tag = 'ref' if item.startswith('<ref>') else 'pred'
+            last_tag_value = clean_item
+    _tick(active_metrics(), 'parse', start)
     return objects
 
 def varygrounding_2qwen(data, BOX_SCALE=999):
@@ -110,48 +267,24 @@ def restore_bbox_in_json(data, BOX_SCALE=999):
     
     height, width = [data["height"],  data["width"]]
     
-    # 定义恢复边界框的函数
-    def restore_bbox(bboxes, height, width, BOX_SCALE):
-        restored_bboxes = []
-        for bbox in bboxes:
-            # 按比例还原到原始大小
-            bbox = [
-                int(bbox[0]/BOX_SCALE * max(height, width)),
-                int(bbox[1]/BOX_SCALE * max(height, width)),
-                int(bbox[2]/BOX_SCALE * max(height, width)),
-                int(bbox[3]/BOX_SCALE * max(height, width)),
-            ]
-            if height == width:
-                pass
-            elif height < width:
-                delta=(width-height)//2
-                bbox[1]-= delta
-                bbox[3]-= delta
-            else:
-                delta=(height - width)// 2
-                bbox[0]-= delta
-                bbox[2]-= delta
-            for i in range(len(bbox)):
-                if bbox[i]< 0:
-                    bbox[i]= 0
-            # 归一化到1000
-            bbox = [int(coord / dim * 999) for coord, dim in zip(bbox, [width, height, width, height])]
-            
-            restored_bboxes.append(bbox)
-        return restored_bboxes
-
-    # 提取原始标注框
+    # 提取原始标注框：同一文件各轮对话中的框一起还原，框多时只调用一次向量化实现
+    start = time.perf_counter()
+    matched = []
     for conv in data['conversations']:
         if '<box>' in conv['value']:
             # 提取出归一化的边界框
             bbox_match = re.findall(r'<box>\[(.*?)\]</box>', conv['value'])
             if bbox_match:
-                bbox_data = json.loads(f"[{bbox_match[0]}]")  # 转换为列表
-                # 恢复边界框
-                restored_bboxes = restore_bbox(bbox_data, height, width, BOX_SCALE)
-                # 更新数据中的边界框
-                restored_bboxes_str = json.dumps(restored_bboxes)
-                conv['value'] = re.sub(r'<box>.*?</box>', f'<box>{restored_bboxes_str}</box>', conv['value'])
+                matched.append((conv, json.loads(f"[{bbox_match[0]}]")))  # 转换为列表
+    if matched:
+        # 恢复边界框
+        restored = restore_box_groups([bboxes for _, bboxes in matched], height, width, BOX_SCALE,
+                                      renormalize=True)
+        for (conv, _), restored_bboxes in zip(matched, restored):
+            # 更新数据中的边界框
+            restored_bboxes_str = json.dumps(restored_bboxes)
+            conv['value'] = re.sub(r'<box>.*?</box>', f'<box>{restored_bboxes_str}</box>', conv['value'])
+    _tick(active_metrics(), 'restore', start)
 
     return data
 
@@ -176,69 +309,731 @@ def extract_qa_pairs(data):
     
     return qa_pairs
 
-def process_dataset(sourdir, output_dir, split_ratio=0.8):
+def _tick(metrics, stage, start):
+    """
+    将 start 至今的耗时累加到 metrics 的 stage 阶段（metrics 可为 None），返回当前时间作为下一阶段的起点。
+    """
+    if metrics is None:
+        return time.perf_counter()
+    return metrics.tick(stage, start)
+
+def _count(metrics, key, n=1):
+    if metrics is not None:
+        metrics.count(key, n)
+
+def convert_label_data(data, img_dir, label_path='', metrics=None, verbose=True):
+    """
+    对已解析的标注字典执行校验与转换阶段。
+
+    Args:
+        data (dict): json 解析后的标注数据。
+        img_dir (str): 图像所在目录。
+        label_path (str): 标注文件路径，仅用于日志。
+        metrics (ConversionMetrics): 可选，累加各阶段耗时、记录数与丢弃原因。
+        verbose (bool): 是否打印被丢弃的标注文件及原因（见 REJECT_MESSAGES）。
+    Returns:
+        list: 转换后的记录，校验失败时返回空列表。
+    """
+    with use_metrics(metrics):
+        start = time.perf_counter()
+
+        # 确保图像路径是绝对路径
+        image_name = os.path.basename(data["image"])
+        image_path = os.path.join(img_dir, image_name)
+        data["image"] = image_path  # 更新图像路径为绝对路径
+
+        if _size_probe is not None:
+            fill_image_size(data, _size_probe, verify=_probe_sizes == 'verify')
+            start = _tick(metrics, 'probe', start)
+
+        if is_grounding_task(data):
+            reason = grounding_reject_reason(data)
+            start = _tick(metrics, 'validate', start)
+            if reason is not None:
+                _count(metrics, 'rejected.' + reason)
+                if verbose:
+                    print(f"{label_path} {REJECT_MESSAGES[reason]}")
+                return []
+            converted_data = convert_vary_2grounding(data)
+        else:
+            converted_data = extract_qa_pairs(data)
+        _tick(metrics, 'convert', start)
+
+    if metrics is not None:
+        for record in converted_data:
+            metrics.count('records.' + record_task_type(record))
+    return converted_data
+
+def read_label_file(label_path, metrics=None):
+    start = time.perf_counter()
+    with open(label_path, 'rb') as file:
+        raw = file.read()
+    _tick(metrics, 'read', start)
+    return raw
+
+def convert_label_bytes(raw, label_path, img_dir, metrics=None):
+    """
+    解析并转换一个标注文件的原始内容。
+
+    Returns:
+        list: 转换后的记录，出错或校验失败时返回空列表。
+    """
+    try:
+        start = time.perf_counter()
+        data = json.loads(raw)
+        _tick(metrics, 'decode', start)
+    except ValueError as e:
+        _count(metrics, 'rejected.decode_error')
+        print(f"处理文件 {label_path} 时发生错误: {e}")
+        return []
+
+    try:
+        return convert_label_data(data, img_dir, label_path, metrics)
+    except Exception as e:
+        _count(metrics, 'rejected.convert_error')
+        print(f"处理文件 {label_path} 时发生错误: {e}")
+        return []
+
+def convert_label_file(label_path, img_dir, metrics=None):
+    """
+    读取并转换单个标注文件，每个文件只读取和解析一次。
+    串行与并行模式共用此函数，保证两种模式输出的记录完全一致。
+
+    Args:
+        label_path (str): 标注文件路径。
+        img_dir (str): 图像所在目录。
+        metrics (ConversionMetrics): 可选，累加各阶段耗时与计数。
+    Returns:
+        list: 转换后的记录，出错或校验失败时返回空列表。
+    """
+    _count(metrics, 'files')
+    try:
+        raw = read_label_file(label_path, metrics)
+    except Exception as e:
+        _count(metrics, 'rejected.read_error')
+        print(f"处理文件 {label_path} 时发生错误: {e}")
+        return []
+    return convert_label_bytes(raw, label_path, img_dir, metrics)
+
+# 当前进程使用的图像尺寸探测器与图像哈希器，由 _init_worker 设置
+_size_probe = None
+_probe_sizes = None
+_image_hasher = None
+
+def _init_worker(probe_sizes=None, size_cache=None, hash_images=False, hash_cache=None):
+    """
+    转换进程的初始化函数（串行模式下在主进程中调用）。
+
+    Args:
+        probe_sizes (str): None 不探测；'missing' 仅在宽高缺失或不合法时从图像文件头读取；
+            'verify' 总是读取并以文件头为准。
+        size_cache (str): 图像尺寸缓存文件路径。
+        hash_images (bool): 是否在转换进程中预先计算输出记录的图像内容哈希（去重用），
+            把读取图像的开销分摊到各进程。
+        hash_cache (str): 图像哈希缓存文件路径，各进程只映射该文件，不载入全部条目。
+    """
+    global _size_probe, _probe_sizes, _image_hasher
+    _probe_sizes = probe_sizes
+    _size_probe = ImageSizeProbe(size_cache) if probe_sizes else None
+    _image_hasher = ImageHasher(hash_cache) if hash_images else None
+
+def _valid_dim(value):
+    try:
+        return int(value) > 0
+    except (TypeError, ValueError):
+        return False
+
+def fill_image_size(data, probe, verify=False):
+    """
+    用图像文件头中的尺寸补全标注中缺失或不合法的 height/width；verify 为真时总是以文件头为准。
+    """
+    if not verify and _valid_dim(data.get("height")) and _valid_dim(data.get("width")):
+        return data
+    height, width = probe.size(data["image"])
+    if verify and _valid_dim(data.get("height")) and _valid_dim(data.get("width")) \
+            and [int(data["height"]), int(data["width"])] != [height, width]:
+        print(f"{data['image']} 标注尺寸 {data['height']}x{data['width']} 与图像 {height}x{width} 不一致，已修正")
+    data["height"] = height
+    data["width"] = width
+    return data
+
+# 单个文件的转换结果：metrics 为本文件的指标，sha1 仅在需要时计算（读取失败时为None），
+# sizes 与 hashes 为新探测到的图像尺寸、新计算的图像哈希的缓存条目
+FileResult = namedtuple('FileResult', ['records', 'metrics', 'sha1', 'sizes', 'hashes'])
+
+def _convert_label_worker(label_path, img_dir, with_sha1=False):
+    # 在转换进程中执行，连同本文件的指标等信息一起返回给主进程
+    metrics = ConversionMetrics()
+    metrics.count('files')
+    try:
+        raw = read_label_file(label_path, metrics)
+    except Exception as e:
+        metrics.count('rejected.read_error')
+        print(f"处理文件 {label_path} 时发生错误: {e}")
+        return FileResult([], metrics, None, {}, {})
+    return _convert_raw_worker(raw, label_path, img_dir, with_sha1, metrics)
+
+def _convert_member_worker(member, img_dir, with_sha1=False):
+    # 归档输入：主进程已顺序读出成员内容，转换进程只负责解析与转换
+    label_path, raw = member
+    metrics = ConversionMetrics()
+    metrics.count('files')
+    return _convert_raw_worker(raw, label_path, img_dir, with_sha1, metrics)
+
+def _convert_raw_worker(raw, label_path, img_dir, with_sha1, metrics):
+    sha1 = hashlib.sha1(raw).hexdigest() if with_sha1 else None
+    records = convert_label_bytes(raw, label_path, img_dir, metrics)
+    sizes = _size_probe.cache.drain() if _size_probe is not None else {}
+    hashes = {}
+    if _image_hasher is not None:
+        start = time.perf_counter()
+        for record in records:
+            image_path = record_image(record)
+            if image_path:
+                _image_hasher.hash(image_path)
+        hashes = _image_hasher.cache.drain()
+        metrics.tick('dedup', start)
+    return FileResult(records, metrics, sha1, sizes, hashes)
+
+def imap_ordered(func, items, workers=1, chunksize=64, initializer=None, initargs=()):
+    """
+    按输入顺序产出 func(item)。workers > 1 时使用进程池分块并行（func 需可pickle）。
+    items 为列表时整体交给 imap；为生成器（如归档成员）时最多只预取 workers * 4 块，
+    imap 会立即取完整个输入，对生成器而言相当于把全部内容读入内存。
+    """
+    if workers <= 1:
+        if initializer is not None:
+            initializer(*initargs)
+        for item in items:
+            yield func(item)
+        return
+
+    with Pool(processes=workers, initializer=initializer, initargs=initargs) as pool:
+        if isinstance(items, (list, tuple)):
+            yield from pool.imap(func, items, chunksize=chunksize)
+            return
+        items = iter(items)
+        pending = deque()
+
+        def submit():
+            chunk = list(islice(items, chunksize))
+            if chunk:
+                pending.append(pool.map_async(func, chunk, chunksize=len(chunk)))
+
+        for _ in range(workers * 4):
+            submit()
+        while pending:
+            results = pending.popleft().get()
+            submit()
+            yield from results
+
+def iter_file_results(label_paths, img_dir, workers=1, chunksize=64, with_sha1=False,
+                      probe_sizes=None, size_probe=None, image_hasher=None, from_archive=False):
+    """
+    按输入顺序产出每个标注文件的 FileResult。
+    size_probe 为主进程中的 ImageSizeProbe，各进程新探测到的尺寸会合并进去，由调用方保存；
+    image_hasher 为主进程中的 ImageHasher，给定时各进程预先计算图像哈希并合并进去。
+    from_archive 为真时 label_paths 为 vary2qwen_archive.iter_archive_members 产出的 (路径, 原始内容)。
+    """
+    worker_func = _convert_member_worker if from_archive else _convert_label_worker
+    worker = partial(worker_func, img_dir=img_dir, with_sha1=with_sha1)
+    size_cache = size_probe.cache.path if size_probe is not None else None
+    hash_cache = image_hasher.cache.path if image_hasher is not None else None
+    try:
+        for result in imap_ordered(worker, label_paths, workers, chunksize, _init_worker,
+                                   (probe_sizes, size_cache, image_hasher is not None, hash_cache)):
+            if size_probe is not None and result.sizes:
+                size_probe.cache.merge(result.sizes)
+            if image_hasher is not None and result.hashes:
+                image_hasher.cache.merge(result.hashes)
+            yield result
+    finally:
+        if workers <= 1:
+            _init_worker()
+
+def preflight_filter(results, preflight, chunk_files=256):
+    """
+    按块检查 FileResult 中各记录引用的图像，去掉未通过检查的记录，顺序不变。
+    被去掉的记录从该文件的 records.<任务类型> 中扣除，计入 rejected.image_<状态>；检查耗时计入 preflight。
+    """
+    chunk = []
+    for result in results:
+        chunk.append(result)
+        if len(chunk) >= chunk_files:
+            yield from _preflight_chunk(chunk, preflight)
+            chunk = []
+    if chunk:
+        yield from _preflight_chunk(chunk, preflight)
+
+def _preflight_chunk(chunk, preflight):
+    start = time.perf_counter()
+    statuses = preflight.check_many({record_image(record) for result in chunk for record in result.records})
+    chunk[0].metrics.tick('preflight', start)
+    for result in chunk:
+        kept = []
+        for record in result.records:
+            status = statuses[record_image(record)]
+            if status == 'ok':
+                kept.append(record)
+            else:
+                result.metrics.count('records.' + record_task_type(record), -1)
+                result.metrics.count('rejected.image_' + status)
+        yield result._replace(records=kept)
+
+def iter_converted(label_paths, img_dir, workers=1, chunksize=64, metrics=None,
+                   probe_sizes=None, size_probe=None, progress=None, image_hasher=None, preflight=None,
+                   from_archive=False):
+    """
+    按顺序逐个产出每个标注文件的转换结果。
+    workers > 1 时使用进程池分块并行转换，imap 保证结果顺序与输入一致。
+    传入 metrics 时，各阶段耗时（所有进程之和）与计数会累加到其中；传入 progress 时更新进度。
+    传入 preflight（vary2qwen_preflight.ImagePreflight）时去掉图像未通过预检的记录，见 preflight_filter。
+    from_archive 见 iter_file_results。
+    """
+    results = iter_file_results(label_paths, img_dir, workers, chunksize, probe_sizes=probe_sizes,
+                                size_probe=size_probe, image_hasher=image_hasher, from_archive=from_archive)
+    if preflight is not None:
+        results = preflight_filter(results, preflight)
+    for result in results:
+        if metrics is not None:
+            metrics.merge(result.metrics)
+        if progress is not None:
+            progress.update(1, len(result.records))
+        yield result.records
+
+def process_dataset(sourdir, output_dir, split_ratio=0.8, **options):
+    """
+    转换sourdir下每个子文件夹中的标注文件（图像与标注在同一文件夹），并按比例保存为训练集和验证集。
+    其余参数见 process_datasets 与 process_label_dir。
+
+    Returns:
+        dict: 每个子文件夹的运行汇总，格式见 ConversionMetrics.summary。
+    """
     # 获取sourdir下的所有子文件夹
     subdirs = [d for d in os.listdir(sourdir) if os.path.isdir(os.path.join(sourdir, d))]
+    datasets = {subdir: {'images': os.path.join(sourdir, subdir), 'annotations': os.path.join(sourdir, subdir)}
+                for subdir in subdirs}
+    return process_datasets(datasets, output_dir, split_ratio, **options)
 
-    for subdir in subdirs:
-        subdir_path = os.path.join(sourdir, subdir)
-        label_dir = subdir_path
-        img_dir = subdir_path
+def process_datasets(datasets, output_dir, split_ratio=0.8, dedup=None, hash_cache=None, **options):
+    """
+    依次转换多个数据集。datasets 与 test.py 中 img_dir_labels 的格式相同：
+        {名称: {'images': 图像目录, 'annotations': 标注目录}, ...}
+    每个数据集还可以给出 'options' 字典，覆盖本次调用的公共参数。
+    给定 dedup 时所有数据集共用一个去重器，跨数据集去重。其余参数见 process_label_dir。
 
-        train_data = []
-        val_data = []
-        all_data = []
+    Returns:
+        dict: 每个数据集的运行汇总，格式见 ConversionMetrics.summary。
+    """
+    summaries = {}
+    if isinstance(dedup, str):
+        dedup = Deduplicator(dedup, hash_cache)
+    for name, dataset in datasets.items():
+        dataset_options = dict(options, **dataset.get('options', {}))
+        summaries[name] = process_label_dir(name, dataset['annotations'], dataset['images'], output_dir,
+                                            split_ratio, dedup=dedup, **dataset_options)
+    if dedup is not None:
+        dedup.save()
+    return summaries
 
-        # 获取所有标注文件
-        label_files = [f for f in os.listdir(label_dir) if f.endswith('.json')]
+def list_label_inputs(label_dir, metrics=None, walker=None):
+    """
+    列出标注输入，返回 (标注文件, 归档路径列表)。
+    标注文件为 walker（vary2qwen_discover.LabelWalker，默认只列出 label_dir 下的 *.json）产出 LabelEntry 的迭代器，
+    边遍历边产出，不等待目录列完，遍历耗时计入 metrics 的 list。
+    label_dir 本身是归档、或目录中没有标注文件只有归档分片（见 vary2qwen_archive）时按归档读取；
+    目录中同时有 json 与归档分片时按 json 读取，归档分片由同样的 json 打包而来，结果相同。
+    """
+    start = time.perf_counter()
+    if os.path.isfile(label_dir):
+        archives = list_label_archives(label_dir)
+        _tick(metrics, 'list', start)
+        return iter(()), archives
+    # 只取出第一个标注文件即可判断输入类型，目录没有标注文件时才列出归档分片
+    entries = (walker or LabelWalker()).walk(label_dir)
+    first = next(entries, None)
+    if first is None:
+        archives = list_label_archives(label_dir)
+        _tick(metrics, 'list', start)
+        return iter(()), archives
+    _tick(metrics, 'list', start)
+    return timed(chain([first], entries), metrics), []
 
-        random.shuffle(label_files)  # 打乱文件顺序
 
-        # 处理训练集文件
-        for label_file in label_files:
-            label_path = os.path.join(label_dir, label_file)
+def label_progress(name, label_dir, archives, walker, interval):
+    """
+    转换进度。归档输入的总数来自打包清单；标注目录边遍历边转换，打印进度时由后台线程另行遍历计数，
+    计数完成后才显示总数与预计剩余时间。
+    """
+    if archives:
+        return ProgressReporter(name, count_archive_members(archives), interval)
+    progress = ProgressReporter(name, None, interval)
+    if interval is not None:
+        def count():
             try:
-                with open(label_path, 'r', encoding='utf-8') as file:
-                    data = json.load(file)
+                progress.total = walker.count(label_dir)
+            except OSError:
+                pass
+        threading.Thread(target=count, daemon=True).start()
+    return progress
 
-                    # 确保图像路径是绝对路径
-                    image_name = os.path.basename(data["image"])
-                    image_path = os.path.join(img_dir, image_name)
-                    data["image"] = image_path  # 更新图像路径为绝对路径
+def process_label_dir(name, label_dir, img_dir, output_dir, split_ratio=0.8, workers=1, chunksize=64,
+                      streaming=False, split_by='image', incremental=False, checkpoint_every=1000,
+                      probe_sizes=None, size_cache=None, save_metrics=False, progress_interval=None, index=False,
+                      shard_records=None, records_per_shard=None, bytes_per_shard=None, shuffle_seed=None,
+                      dedup=None, hash_cache=None, preflight=None, preflight_cache=None, preflight_threads=32,
+                      include=None, exclude=None, recursive=False, walk_threads=8):
+    """
+    转换一个标注文件夹，输出 {name}_train.jsonl 与 {name}_val.jsonl。
 
-                    if is_grounding_task(data):
-                        if valid_grounding(label_path):
-                            converted_data = convert_vary_2grounding(data)
-                    else:
-                        converted_data = extract_qa_pairs(data)
+    Args:
+        name (str): 数据集名称，用作输出文件名前缀。
+        label_dir (str): 标注文件所在目录；也可以是标注归档（tar/zip）或包含归档分片的目录，
+            此时按顺序流式读取归档成员，见 vary2qwen_archive。归档输入不支持增量模式。
+        img_dir (str): 图像所在目录。
+        workers (int): 并行转换的进程数，1 表示串行。
+        chunksize (int): 每次分发给子进程的文件数。
+        streaming (bool): 流式模式。每条记录产生后立即按哈希写入训练集或验证集，
+            内存占用与数据量无关，且不再打乱文件列表，重复运行结果一致。
+        split_by (str): 流式模式下的划分依据，'image' 或 'record'，见 split_key_fn。
+        incremental (bool): 增量模式（隐含流式），见 process_label_dir_incremental。
+        checkpoint_every (int): 增量模式下每处理多少个文件提交一次检查点。
+        probe_sizes (str): 是否从图像文件头读取宽高，None、'missing' 或 'verify'，见 _init_worker。
+        size_cache (str): 图像尺寸缓存文件路径，多个数据集可共用同一个缓存。
+        save_metrics (bool): 是否将运行汇总保存为 {output_dir}/{name}.metrics.json。
+        progress_interval (float): 每隔多少秒打印一次进度、速率与预计剩余时间，None 不打印。
+        index (bool): 是否为输出文件建立/更新偏移索引 {输出文件}.idx 与类别索引 {输出文件}.cls，
+            供 vary2qwen_index.IndexedJsonl 随机访问和 vary2qwen_index.CaptionIndex 按类别查询。
+        shard_records (int): 给定时在 jsonl 之外再把本次写出的 jsonl 输出文件转换为每片 shard_records 条记录的
+            二进制分片 {输出文件名}-00000.v2qs ...，用 vary2qwen_shard.ShardedGroundingDataset 读取。
+            不能与 records_per_shard/bytes_per_shard 同时使用。
+        records_per_shard, bytes_per_shard (int): 给定任一项时不再输出单个 jsonl 文件，而是把每个集合写成
+            不超过该记录数/字节数的分片 {name}_{split}-00000.jsonl ...，并生成分片清单 {name}_{split}.shards.json，
+            见 vary2qwen_shard.JsonlShardWriter 与 shards_for_rank。不支持增量模式。
+        shuffle_seed (int): 分片输出时，给定则在写完后以该种子跨分片全局打乱，见 vary2qwen_shard.shuffle_jsonl_shards。
+        dedup: 去重方式 'drop'、'flag'，或多个数据集共用的 vary2qwen_dedup.Deduplicator。
+            去重隐含流式模式，并改以图像内容哈希划分训练集/验证集，同一张图不会同时出现在两个集合；
+            重复记录写入 {output_dir}/{name}.duplicates.jsonl。不支持增量模式。
+        hash_cache (str): dedup 为字符串时使用的图像哈希缓存文件路径。
+        preflight (str): 写出前预检记录引用的图像并去掉未通过的记录，None 不检查；
+            'header' 检查存在性、文件头与完整性，'decode' 另外完整解码，见 vary2qwen_preflight。不支持增量模式。
+        preflight_cache (str): 预检结果缓存文件路径，按路径与mtime失效，重复运行几乎不再读取图像。
+        preflight_threads (int): 预检线程数。
+        include, exclude: 标注文件的 glob 规则，默认只包括 *.json，见 vary2qwen_discover.LabelWalker。
+        recursive (bool): 是否递归查找子目录中的标注文件。标注文件边查找边转换，无需等待目录列完；
+            递归时各子目录由 walk_threads 个线程并行列出。
+    Returns:
+        dict: 运行汇总，包括各阶段耗时、各任务类型的记录数与各原因的丢弃数，
+            格式见 ConversionMetrics.summary。
+    """
+    wall_start = time.perf_counter()
+    metrics = ConversionMetrics()
+    size_probe = ImageSizeProbe(size_cache) if probe_sizes else None
+    convert_options = {'probe_sizes': probe_sizes, 'size_probe': size_probe}
 
-                    all_data.extend(converted_data)
-            except Exception as e:
-                print(f"处理文件 {label_path} 时发生错误: {e}")
+    shard_limits = {'records_per_shard': records_per_shard, 'bytes_per_shard': bytes_per_shard}
+    sharded = bool(records_per_shard or bytes_per_shard)
+    if sharded and incremental:
+        raise ValueError("增量模式不支持分片输出")
+    if sharded and shard_records:
+        raise ValueError("二进制分片（shard_records）只能由单个 jsonl 输出文件转换，不能与 jsonl 分片输出同时使用")
+    if dedup is not None and incremental:
+        raise ValueError("增量模式不支持去重")
+    if preflight and incremental:
+        raise ValueError("增量模式不支持图像预检")
+    if incremental and os.path.isfile(label_dir):
+        raise ValueError("增量模式不支持归档输入")
+    image_preflight = ImagePreflight(preflight_cache, preflight, preflight_threads) if preflight else None
+    own_dedup = isinstance(dedup, str)
+    if own_dedup:
+        dedup = Deduplicator(dedup, hash_cache)
+    split_key = split_key_fn(split_by)
+    if dedup is not None:
+        streaming = True
+        split_key = dedup.split_key
+        convert_options['image_hasher'] = dedup.hasher
+    if image_preflight is not None:
+        convert_options['preflight'] = image_preflight
+    # 流式与增量模式按名称顺序遍历，重复运行结果一致；缓冲模式转换后打乱，按发现顺序遍历即可
+    walker = LabelWalker(include, exclude, recursive, walk_threads, sort=streaming or incremental)
+    run = ConversionRun(name, label_dir, img_dir, output_dir, split_ratio, workers, chunksize, metrics, walker,
+                        split_key, progress_interval, convert_options, shard_limits)
+
+    if incremental:
+        result = process_label_dir_incremental(name, label_dir, img_dir, output_dir, split_ratio, workers, chunksize,
+                                               split_by, checkpoint_every, metrics,
+                                               progress_interval=progress_interval, walker=walker,
+                                               **convert_options)
+        # 增量模式的输出文件始终是完整的数据集
+        written = {split: path for split, path in SplitWriter.output_paths(output_dir, name).items()
+                   if os.path.exists(path)}
+        if index:
+            # 压缩会原地改写输出文件，此时需重建索引
+            index_output_files(output_dir, name, rebuild=result['compacted'])
+    elif streaming:
+        written = convert_streaming(run, dedup)
+    else:
+        written = convert_buffered(run)
+
+    if sharded and shuffle_seed is not None:
+        start = time.perf_counter()
+        for split in SPLIT_NAMES:
+            shuffle_jsonl_shards(output_dir, f'{name}_{split}', seed=shuffle_seed)
+        _tick(metrics, 'write', start)
+    if index and not incremental:
+        # 流式模式覆盖重写了输出文件，索引需重建
+        index_output_files(output_dir, name, rebuild=streaming)
+
+    if shard_records:
+        # 只转换本次运行写出的 jsonl，不转换之前运行遗留的文件
+        start = time.perf_counter()
+        for path in written.values():
+            convert_jsonl_to_shards(path, output_dir, shard_records)
+        _tick(metrics, 'write', start)
+
+    if size_probe is not None:
+        size_probe.save()
+    if image_preflight is not None:
+        image_preflight.save()
+    if own_dedup:
+        dedup.save()
+
+    summary = metrics.summary(name, time.perf_counter() - wall_start)
+    if save_metrics:
+        with open(os.path.join(output_dir, f'{name}.metrics.json'), 'w', encoding='utf-8') as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+    print(f"{name}: {summary['files']} 个文件, {summary['records']} 条记录, 丢弃 {summary['rejected']}, "
+          "各阶段耗时: " + ", ".join(f"{k}={v:.2f}s" for k, v in summary['stages'].items()))
+    return summary
+
+class ConversionRun:
+    """
+    process_label_dir 一次运行中流式与缓冲模式共用的选项：输入输出位置、并行参数、遍历器、运行指标、
+    划分键、分片限制，以及传给 iter_converted 的转换选项（尺寸探测、图像哈希、预检）。
+    """
+
+    def __init__(self, name, label_dir, img_dir, output_dir, split_ratio=0.8, workers=1, chunksize=64,
+                 metrics=None, walker=None, split_key=None, progress_interval=None, convert_options=None,
+                 shard_limits=None):
+        self.name = name
+        self.label_dir = label_dir
+        self.img_dir = img_dir
+        self.output_dir = output_dir
+        self.split_ratio = split_ratio
+        self.workers = workers
+        self.chunksize = chunksize
+        self.metrics = metrics
+        self.walker = walker or LabelWalker()
+        self.split_key = split_key or record_image
+        self.progress_interval = progress_interval
+        self.convert_options = convert_options or {}
+        self.shard_limits = shard_limits or {}
+
+    @property
+    def sharded(self):
+        return any(self.shard_limits.values())
+
+    def converted(self):
+        """列出标注输入（标注文件或归档），边遍历边转换，按输入顺序产出每个文件的记录并更新进度。"""
+        label_entries, archives = list_label_inputs(self.label_dir, self.metrics, self.walker)
+        if archives:
+            label_paths = iter_archive_members(archives, self.metrics)
+        else:
+            label_paths = (entry.path for entry in label_entries)
+        progress = label_progress(self.name, self.label_dir, archives, self.walker, self.progress_interval)
+        return iter_converted(label_paths, self.img_dir, self.workers, self.chunksize, self.metrics,
+                              progress=progress, from_archive=bool(archives), **self.convert_options)
 
-        # 划分训练集和验证集
-        train_size = int(len(all_data) * split_ratio)  # 计算训练集大小
-        train_data = all_data[:train_size]
-        val_data = all_data[train_size:]
+def convert_streaming(run, dedup=None):
+    """
+    流式模式：每条记录产生后立即按哈希写入训练集或验证集，无需打乱和缓存全部记录。
+    给定 dedup（vary2qwen_dedup.Deduplicator）时先去重，重复记录写入 {name}.duplicates.jsonl。
+    返回本次写出的单个 jsonl 输出文件 {集合: 路径}，分片输出时为空。
+    """
+    metrics = run.metrics
+    if run.sharded:
+        writer = ShardedSplitWriter(run.output_dir, run.name, run.split_ratio, run.split_key, metrics,
+                                    **run.shard_limits)
+    else:
+        writer = SplitWriter(run.output_dir, run.name, run.split_ratio, run.split_key, metrics)
+    duplicate_log = None
+    if dedup is not None:
+        duplicate_log = open(os.path.join(run.output_dir, f'{run.name}.duplicates.jsonl'), 'w', encoding='utf-8')
+        duplicates = dedup.duplicates
+    try:
+        with writer:
+            for converted_data in run.converted():
+                if dedup is not None:
+                    start = time.perf_counter()
+                    converted_data = dedup.filter(converted_data, duplicate_log)
+                    _tick(metrics, 'dedup', start)
+                for record in converted_data:
+                    writer.write(record)
+    finally:
+        if duplicate_log is not None:
+            duplicate_log.close()
+    if dedup is not None:
+        metrics.count('dedup.duplicates', dedup.duplicates - duplicates)
+    for split, path in writer.paths.items():
+        print(f"已保存{SPLIT_NAMES[split]}数据到 {path}（{writer.counts[split]} 条）")
+    return {} if run.sharded else dict(writer.paths)
+
+def convert_buffered(run):
+    """
+    缓冲模式：按读取/发现顺序转换，转换后按文件打乱，与先打乱文件列表等价，且无需等待目录列完；
+    再按 split_ratio 划分训练集与验证集写出。返回本次写出的单个 jsonl 输出文件 {集合: 路径}，分片输出时为空。
+    """
+    # 全部记录需留在内存中直到写出，转为紧凑记录保存，见 vary2qwen_record
+    converted_files = [compact_records(converted_data) for converted_data in run.converted()]
+    random.shuffle(converted_files)
+    all_data = []
+    for converted_data in converted_files:
+        all_data.extend(converted_data)
+    start = time.perf_counter()
+
+    # 划分训练集和验证集
+    train_size = int(len(all_data) * run.split_ratio)  # 计算训练集大小
+    train_data = all_data[:train_size]
+    val_data = all_data[train_size:]
 
-        # 保存训练集数据
-        train_output_path = os.path.join(output_dir, f'{subdir}_train.jsonl')
+    # 保存训练集数据（此模式下序列化耗时计入 write）
+    written = {}
+    if run.sharded:
+        for split, data in (('train', train_data), ('val', val_data)):
+            manifest_path = save_data_as_jsonl_shards(data, run.output_dir, f'{run.name}_{split}', **run.shard_limits)
+            print(f"已保存{SPLIT_NAMES[split]}数据到 {manifest_path}（{len(data)} 条）")
+    else:
+        train_output_path = os.path.join(run.output_dir, f'{run.name}_train.jsonl')
         if train_data:
             save_data_as_jsonl(train_data, train_output_path)
+            written['train'] = train_output_path
             print(f"已保存训练集数据到 {train_output_path}")
 
         # 保存验证集数据
-        val_output_path = os.path.join(output_dir, f'{subdir}_val.jsonl')
+        val_output_path = os.path.join(run.output_dir, f'{run.name}_val.jsonl')
         if val_data:
             save_data_as_jsonl(val_data, val_output_path)
+            written['val'] = val_output_path
             print(f"已保存验证集数据到 {val_output_path}")
+    _tick(run.metrics, 'write', start)
+    return written
+
+def index_output_files(output_dir, name, rebuild=False):
+    """
+    为数据集的输出文件建立偏移索引和类别索引。输出文件只被追加过时只扫描新增部分，rebuild 为 True 时完整重建。
+    """
+    for split, path in SplitWriter.output_paths(output_dir, name).items():
+        if os.path.exists(path):
+            if rebuild:
+                build_index(path)
+                build_caption_index(path)
+            else:
+                update_index(path)
+                update_caption_index(path)
+        # jsonl 分片每次都整体重写，总是重建
+        for shard_path in list_jsonl_shards(output_dir, f'{name}_{split}'):
+            build_index(shard_path)
+            build_caption_index(shard_path)
+
+def process_label_dir_incremental(name, label_dir, img_dir, output_dir, split_ratio=0.8, workers=1, chunksize=64,
+                                  split_by='image', checkpoint_every=1000, metrics=None,
+                                  probe_sizes=None, size_probe=None, progress_interval=None, walker=None):
+    """
+    增量转换：依据清单 {name}.manifest.jsonl 只转换新增或内容变化的标注文件。
+
+    - 大小和mtime未变的文件直接跳过，不读取内容；
+    - mtime变化但内容哈希相同的文件只更新清单；
+    - 内容变化或已删除的文件，其旧记录在结束时从输出文件中压缩掉；
+    - 每处理 checkpoint_every 个文件提交一次检查点，中断后重新运行会从最后一个检查点继续。
+    walker 为 vary2qwen_discover.LabelWalker，清单中的文件名为相对标注目录的路径。
+
+    Returns:
+        dict: 本次运行转换、跳过和删除的文件数以及是否压缩了输出文件，同时以 incremental.* 计入 metrics。
+    """
+    manifest_path = os.path.join(output_dir, f'{name}.manifest.jsonl')
+    manifest = ConversionManifest.load(manifest_path)
+    output_paths = SplitWriter.output_paths(output_dir, name)
+    manifest.recover(output_paths)
+
+    # 找出需要转换的文件
+    start = time.perf_counter()
+    stats = {}
+    pending = []
+    label_paths = []
+    present = set()
+    for entry in (walker or LabelWalker()).walk(label_dir):
+        present.add(entry.name)
+        stat = entry.stat()
+        if not manifest.unchanged(entry.name, stat):
+            stats[entry.name] = stat
+            pending.append(entry.name)
+            label_paths.append(entry.path)
+    if not present and list_label_archives(label_dir):
+        raise ValueError("增量模式不支持归档输入")
+    removed = [f for f in manifest.files if f not in present]
+    for label_file in removed:
+        manifest.remove(label_file)
+    _tick(metrics, 'list', start)
+
+    summary = {'converted': 0, 'touched': 0, 'skipped': len(present) - len(pending), 'removed': len(removed)}
+    progress = ProgressReporter(name, len(label_paths), progress_interval)
+    with SplitWriter(output_dir, name, split_ratio, split_key_fn(split_by), metrics, append=True) as writer:
+        results = iter_file_results(label_paths, img_dir, workers, chunksize, with_sha1=True,
+                                    probe_sizes=probe_sizes, size_probe=size_probe)
+        for count, (label_file, result) in enumerate(zip(pending, results), 1):
+            if metrics is not None:
+                metrics.merge(result.metrics)
+            progress.update(1, len(result.records))
+            start = time.perf_counter()
+            outcome = apply_file_result(manifest, writer, label_file, stats[label_file], result)
+            if outcome is not None:
+                summary[outcome] += 1
+            if count % checkpoint_every == 0:
+                manifest.checkpoint(writer.sync())
+                _tick(metrics, 'write', start)
+        start = time.perf_counter()
+        manifest.checkpoint(writer.sync())
+
+    summary['compacted'] = int(manifest.compaction_needed)
+    if manifest.compaction_needed:
+        manifest.compact(output_paths)
+    elif summary['converted'] or summary['touched']:
+        manifest.snapshot()
+    _tick(metrics, 'write', start)
+    if metrics is not None:
+        for key, n in summary.items():
+            metrics.count('incremental.' + key, n)
+
+    print(f"{name} 增量转换: 新转换 {summary['converted']} 个文件，仅更新时间 {summary['touched']} 个，"
+          f"跳过 {summary['skipped']} 个，删除 {summary['removed']} 个")
+    return summary
+
+
+def apply_file_result(manifest, writer, label_file, stat, result):
+    """
+    将一个标注文件的转换结果追加到输出并记入清单（检查点由调用方提交）。
+
+    Returns:
+        str: 'converted'（写出了新记录）、'touched'（内容未变，仅更新清单）或 None（读取失败，留待下次重试）。
+    """
+    if result.sha1 is None:
+        return None
+    if manifest.same_content(label_file, result.sha1):
+        manifest.update(label_file, stat, result.sha1)
+        return 'touched'
+    spans = [list(writer.write_span(record)) for record in result.records]
+    manifest.update(label_file, stat, result.sha1, spans)
+    return 'converted'
 
 
 def is_grounding_task(data):
     conversations = data['conversations']
     for convo in conversations:
         if convo["from"] == "gpt":
-            if re.search(r"<ref>.*</ref>", convo["value"]) and re.search(r"<box>.*</box>", convo["value"]):
+            start = time.perf_counter()
+            tags = {tag for tag, _ in tokenize_grounded_caption(convo["value"]).tokens}
+            _tick(active_metrics(), 'parse', start)
+            if 'ref' in tags and 'box' in tags:
                 return True
     return False
 
@@ -269,10 +1064,12 @@ def convert_vary_2grounding(data):
 
             # 提取ref和box内容
             value = conversation["value"]
-            if "<ref>" in value:
-                ref_object = value.split("<ref>")[1].split("</ref>")[0]
-            if "<box>" in value:
-                bbox_info = value.split("<box>")[1].split("</box>")[0]
+            refs = tag_values(value, 'ref')
+            boxes = tag_values(value, 'box')
+            if refs:
+                ref_object = refs[0]
+            if boxes:
+                bbox_info = boxes[0]
 
             if ref_object and bbox_info:
                 # 处理多个bbox的情况
@@ -314,43 +1111,263 @@ def process_bbox_info(bbox_info):
     return bbox_list[0]
 
 
-def save_data_as_jsonl(data, output_file):
+def save_data_as_jsonl(data, output_file, index=False):
     with open(output_file, 'a', encoding='utf-8') as f:
         for item in data:
-            json.dump(item, f, ensure_ascii=False, separators=(',', ':'))
-            f.write('\n')
+            f.write(dump_record(item))
+    if index:
+        # 追加写入，索引只需扫描新增部分
+        update_index(output_file)
+        update_caption_index(output_file)
 
-def valid_grounding(json_path):
+def save_data_as_jsonl_shards(data, output_dir, name, records_per_shard=None, bytes_per_shard=None):
+    """
+    将记录写成 jsonl 分片 {name}-00000.jsonl ...（覆盖同名旧分片），返回分片清单路径。
+    """
+    with JsonlShardWriter(output_dir, name, records_per_shard, bytes_per_shard, record_task_type) as writer:
+        for item in data:
+            writer.write_line(dump_record(item).encode('utf-8'), record_task_type(item))
+    return shard_manifest_path(output_dir, name)
+
+def record_task_type(record):
+    """
+    返回输出记录的任务类型：'grounding'、'region'（问题中带 <box> 的区域描述）或 'vqa'。
+    """
+    if isinstance(record, CompactRecord):
+        return record.task_type
+    if "objects" in record:
+        return 'grounding'
+    if '<box>' in record.get("query", ''):
+        return 'region'
+    return 'vqa'
+
+def dump_record(item):
+    # 与 save_data_as_jsonl 一致的单行序列化格式，紧凑记录直接拼接，结果相同
+    if isinstance(item, CompactRecord):
+        return item.to_json()
+    return json.dumps(item, ensure_ascii=False, separators=(',', ':')) + '\n'
+
+SPLIT_NAMES = {'train': '训练集', 'val': '验证集'}
+
+def record_image(record):
+    # grounding记录使用 images 列表，问答记录使用 image 字段
+    if isinstance(record, CompactRecord):
+        return record.image
+    if "images" in record:
+        return record["images"][0] if record["images"] else ''
+    return record.get("image", '')
+
+def split_key_fn(split_by='image'):
+    """
+    返回计算划分键的函数。
+    'image'：按图像路径划分，同一张图的所有问答落在同一集合，避免图像跨集合泄漏；
+    'record'：按整条记录的内容划分。
+    """
+    if split_by == 'image':
+        return record_image
+    if split_by == 'record':
+        return lambda record: dump_record(record)
+    raise ValueError(f"不支持的划分方式: {split_by}")
+
+def hash_split(key, split_ratio):
+    """
+    根据键的哈希值确定性地划分训练集/验证集，与运行顺序、进程数无关。
+    """
+    digest = hashlib.md5(key.encode('utf-8')).digest()
+    position = int.from_bytes(digest[:8], 'big') / 2 ** 64
+    return 'train' if position < split_ratio else 'val'
+
+class HashSplitWriter:
+    """
+    按哈希流式划分训练集/验证集的写出器基类：每条记录按 split_key 的哈希立即写出，无需打乱和缓存全部记录。
+    子类实现 _write_line（写入一行已序列化的记录）、_open_files 与 close。
+    """
+
+    def __init__(self, output_dir, name, split_ratio=0.8, split_key=record_image, metrics=None):
+        self.output_dir = output_dir
+        self.name = name
+        self.split_ratio = split_ratio
+        self.split_key = split_key
+        self.metrics = metrics
+        self.paths = {}
+        self.counts = {'train': 0, 'val': 0}
+
+    def split_of(self, record):
+        return hash_split(self.split_key(record), self.split_ratio)
+
+    def write(self, record):
+        """写入一条记录，返回所属集合。"""
+        start = time.perf_counter()
+        split = self.split_of(record)
+        line = dump_record(record).encode('utf-8')
+        start = _tick(self.metrics, 'serialize', start)
+        self._write_line(split, line, record)
+        _tick(self.metrics, 'write', start)
+        self.counts[split] += 1
+        return split
+
+    def _write_line(self, split, line, record):
+        raise NotImplementedError
+
+    def _open_files(self):
+        raise NotImplementedError
+
+    def sync(self):
+        """将已写入的数据落盘。"""
+        for f in self._open_files():
+            f.flush()
+            os.fsync(f.fileno())
+
+    def close(self):
+        raise NotImplementedError
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class SplitWriter(HashSplitWriter):
+    """
+    流式写出训练集/验证集 {name}_{split}.jsonl，文件在第一条记录写入时才打开。
+    统一以 '\n' 换行写出字节，便于记录每条记录在文件中的字节位置（write_span）。
+    append 为假时覆盖同名的旧输出，重复运行结果一致（本次没有记录的集合在关闭时清空）；
+    增量与监视模式依赖清单恢复已有输出，使用 append=True 追加。
+    """
+
+    def __init__(self, output_dir, name, split_ratio=0.8, split_key=record_image, metrics=None, append=False):
+        super().__init__(output_dir, name, split_ratio, split_key, metrics)
+        self.sizes = {}
+        self.append = append
+        self._files = {}
+        self._span = None
+
+    @staticmethod
+    def output_paths(output_dir, name):
+        return {split: os.path.join(output_dir, f'{name}_{split}.jsonl') for split in SPLIT_NAMES}
+
+    def _file(self, split):
+        f = self._files.get(split)
+        if f is None:
+            path = os.path.join(self.output_dir, f'{self.name}_{split}.jsonl')
+            f = self._files[split] = open(path, 'ab' if self.append or split in self.paths else 'wb')
+            self.paths[split] = path
+            self.sizes[split] = f.tell()
+        return f
+
+    def _write_line(self, split, line, record):
+        self._file(split).write(line)
+        offset = self.sizes[split]
+        self.sizes[split] = offset + len(line)
+        self._span = (split, offset, len(line))
+
+    def write_span(self, record):
+        """
+        写入一条记录，返回 (split, 字节偏移, 字节长度)。
+        """
+        self.write(record)
+        return self._span
+
+    def _open_files(self):
+        return self._files.values()
+
+    def sync(self):
+        """
+        将已写入的数据落盘，返回各输出文件当前大小（未打开的文件按磁盘上的大小计）。
+        """
+        super().sync()
+        sizes = {}
+        for split, path in self.output_paths(self.output_dir, self.name).items():
+            if split in self.sizes:
+                sizes[split] = self.sizes[split]
+            else:
+                sizes[split] = os.path.getsize(path) if os.path.exists(path) else 0
+        return sizes
+
+    def close(self):
+        for f in self._files.values():
+            f.close()
+        self._files = {}
+        if not self.append:
+            for split, path in self.output_paths(self.output_dir, self.name).items():
+                if split not in self.paths and os.path.exists(path):
+                    open(path, 'wb').close()
+
+
+class ShardedSplitWriter(HashSplitWriter):
+    """
+    与 SplitWriter 相同的按哈希流式划分，但每个集合写成限定记录数/字节数的 jsonl 分片
+    {name}_{split}-00000.jsonl ...，关闭时写出分片清单 {name}_{split}.shards.json。
+    paths 为各集合的分片清单路径。分片输出不记录每条记录的字节位置，不用于增量模式。
+    """
+
+    def __init__(self, output_dir, name, split_ratio=0.8, split_key=record_image, metrics=None,
+                 records_per_shard=None, bytes_per_shard=None):
+        super().__init__(output_dir, name, split_ratio, split_key, metrics)
+        self.writers = {split: JsonlShardWriter(output_dir, f'{name}_{split}', records_per_shard, bytes_per_shard,
+                                                record_task_type)
+                        for split in SPLIT_NAMES}
+        self.paths = {split: shard_manifest_path(output_dir, f'{name}_{split}') for split in SPLIT_NAMES}
+
+    def _write_line(self, split, line, record):
+        self.writers[split].write_line(line, record_task_type(record))
+
+    def _open_files(self):
+        return [writer._file for writer in self.writers.values() if writer._file is not None]
+
+    def close(self):
+        for writer in self.writers.values():
+            writer.close()
+
+# grounding标注的丢弃原因及对应的日志
+REJECT_MESSAGES = {
+    'answer_none': '回答错误',
+    'ref_mismatch': '输入目标与输出目标不匹配',
+}
+
+def grounding_reject_reason(json_data):
+    """
+    校验grounding标注，可用时返回 None，否则返回丢弃原因（见 REJECT_MESSAGES）。
+    """
+    question = json_data['conversations'][0]['value']
+    answer = json_data['conversations'][1]['value']
+
+    # 检查错误的回答：包含 'None' 或 '不存在此类别'
+    if 'None' in answer or '不存在此类别' in answer:
+        return 'answer_none'
+
+    # 回答中的目标必须出现在问题中
+    for ref in tag_values(answer, 'ref'):
+        if ref not in question:
+            return 'ref_mismatch'
+    return None
+
+def valid_grounding(json_data, json_path=''):
+    """
+    校验grounding标注是否可用。
+
+    Args:
+        json_data (dict | str): 已解析的标注数据；传入路径时会先读取文件（兼容旧用法）。
+        json_path (str): 标注文件路径，仅用于日志。
+    """
     try:
-        with open(json_path, 'r', encoding='utf-8') as json_file:
-            json_data = json.load(json_file)
-        
-        question = json_data['conversations'][0]['value']
-        answer = json_data['conversations'][1]['value']
+        if isinstance(json_data, str):
+            json_path = json_path or json_data
+            with open(json_data, 'r', encoding='utf-8') as json_file:
+                json_data = json.load(json_file)
 
-        # 检查错误的回答：包含 'None' 或 '不存在此类别'
-        if 'None' in answer or '不存在此类别' in answer:
-            print(f"{json_path} 回答错误")
+        reason = grounding_reject_reason(json_data)
+        if reason is not None:
+            print(f"{json_path} {REJECT_MESSAGES[reason]}")
             return False
-        
-        # 正则表达式(回答标签)
-        pattern = r'<ref>(.*?)<\/ref>'
-        matches = re.findall(pattern, answer)
-        for i in matches:
-            if i not in question:
-                print(f"{json_path} 输入目标与输出目标不匹配")
-                return False
-        
         return True
     
     except Exception as e:
         print(f"处理文件 {json_path} 时发生错误: {e}")
         return False
 
-# 测试数据
-sourdir = 'D:\code\data_extract\save\save/'
-output_dir = 'D:\code\data_extract\save/new'  # 设定输出路径
-split_ratio = 0.8  # 80% 训练集，20% 验证集
-
-# 执行数据处理
-process_dataset(sourdir, output_dir, split_ratio)
+if __name__ == '__main__':
+    # 命令行入口见 vary2qwen_cli，例如：python -m vary2qwen_cli convert datasets.json
+    from vary2qwen_cli import main
+    main()
@@ -1,13 +1,34 @@
+import hashlib
 import json
 import cv2
+import numpy as np
 import os
+import random
 import re
-import matplotlib.pyplot as plt
-from matplotlib import rcParams
+import struct
+from collections import OrderedDict
+from multiprocessing import Pool
 
-# 设置中文字体
-rcParams['font.sans-serif'] = ['SimHei']  # SimHei 是一种常用的中文字体
-rcParams['axes.unicode_minus'] = False    # 防止负号显示为方块
+from vary2qwen_cache import BlobCache
+from vary2qwen_index import CaptionIndex, IndexedJsonl
+from vary2qwen_probe import read_image_size
+
+_plt = None
+
+def _pyplot():
+    """
+    首次交互式显示时才导入 Matplotlib 并设置中文字体，批量渲染与其他只导入本模块的进程不必加载。
+    """
+    global _plt
+    if _plt is None:
+        import matplotlib.pyplot as plt
+        from matplotlib import rcParams
+
+        # 设置中文字体
+        rcParams['font.sans-serif'] = ['SimHei']  # SimHei 是一种常用的中文字体
+        rcParams['axes.unicode_minus'] = False    # 防止负号显示为方块
+        _plt = plt
+    return _plt
 
 def visualize_grounding(data):
     """
@@ -17,6 +38,7 @@ def visualize_grounding(data):
     image = cv2.imread(image_path)  # 读取图像
 
     # 创建Matplotlib的窗口
+    plt = _pyplot()
     fig, ax = plt.subplots(figsize=(10, 7))
 
     # 读取图像并转换为RGB格式
@@ -78,6 +100,7 @@ def visualize_region(data):
     description = data["response"]
     
     # 创建一个图像窗口
+    plt = _pyplot()
     fig, ax = plt.subplots(1, 2, figsize=(12, 6))
     
     # 在左边显示图像
@@ -96,20 +119,38 @@ def visualize_region(data):
     plt.tight_layout()
     plt.show()
 
-def load_and_visualize_jsonl(jsonl_path):
+def visualize_record(data, jsonl_path=''):
+    if "objects" in data:  # 这是grounding任务
+        visualize_grounding(data)
+    elif "image" in data:  # 这是region任务
+        visualize_region(data)
+    else:
+        print(f"无法识别的任务类型，跳过文件 {jsonl_path}")
+
+def load_and_visualize_jsonl(jsonl_path, indices=None, sample=None, seed=None, caption=None):
     """
     加载标注文件并根据任务类型进行可视化
+
+    indices 为要查看的记录下标列表，sample 为随机抽查的记录数，caption 为只查看包含该类别的记录；
+    都不给时按顺序逐条查看。给定任一参数时通过偏移索引直接定位记录，不必读完整个文件。
     """
-    with open(jsonl_path, 'r', encoding='utf-8') as file:
-        for line in file:
-            data = json.loads(line)  # 逐行加载每个JSON对象
-            if "objects" in data:  # 这是grounding任务
-                visualize_grounding(data)
-            elif "image" in data:  # 这是region任务
-                visualize_region(data)
-                pass
-            else:
-                print(f"无法识别的任务类型，跳过文件 {jsonl_path}")
+    if caption is not None:
+        with CaptionIndex(jsonl_path) as captions:
+            indices = captions.query(caption)
+        if sample is not None and sample < len(indices):
+            indices = sorted(random.Random(seed).sample(indices, sample))
+    if indices is None and sample is None:
+        with open(jsonl_path, 'r', encoding='utf-8') as file:
+            for line in file:
+                data = json.loads(line)  # 逐行加载每个JSON对象
+                visualize_record(data, jsonl_path)
+        return
+
+    with IndexedJsonl(jsonl_path) as records:
+        if indices is None:
+            indices = records.sample_indices(sample, seed)
+        for i in indices:
+            visualize_record(records[i], jsonl_path)
 
 def visualize_all_jsonl_in_folder(folder_path):
     """
@@ -123,6 +164,513 @@ def visualize_all_jsonl_in_folder(folder_path):
         print(f"正在可视化文件: {jsonl_path}")
         load_and_visualize_jsonl(jsonl_path)
 
-# 示例：可视化文件夹中的所有标注文件
-folder_path = 'D:/code/data_extract/save/new/'  # 请替换为你的文件夹路径
-visualize_all_jsonl_in_folder(folder_path)
+# 批量渲染使用的颜色（BGR）
+GROUNDING_COLOR = (0, 0, 255)
+REGION_COLOR = (0, 255, 0)
+
+def query_boxes(query):
+    """
+    提取region问题中所有 <box> 内的框，每个 <box> 可包含一个或多个框。
+    """
+    boxes = []
+    for box_text in re.findall(r'<box>(.*?)</box>', query):
+        try:
+            value = json.loads(box_text)
+        except ValueError:
+            continue
+        if value and isinstance(value[0], list):
+            boxes.extend(value)
+        else:
+            boxes.append(value)
+    return [box for box in boxes if len(box) == 4]
+
+def _fit_image(image, max_size):
+    # 按最长边不超过 max_size 等比例缩小，返回缩放后的图像与缩放比例
+    height, width = image.shape[:2]
+    scale = 1.0
+    if max_size and max(height, width) > max_size:
+        scale = max_size / max(height, width)
+        image = cv2.resize(image, (max(1, int(width * scale)), max(1, int(height * scale))),
+                           interpolation=cv2.INTER_AREA)
+    return image, scale
+
+# JPEG 可在解码时直接缩小到 1/2、1/4、1/8，缩略图不必先解码整张原图
+_REDUCED_FLAGS = ((8, 'IMREAD_REDUCED_COLOR_8'), (4, 'IMREAD_REDUCED_COLOR_4'), (2, 'IMREAD_REDUCED_COLOR_2'))
+
+def _read_fitted(image_path, max_size=None):
+    """
+    读取图像并按最长边不超过 max_size 等比例缩小，返回 (图像, 缩放比例, 原图 (高, 宽))；无法读取时图像为 None。
+    原图尺寸从文件头读取，据此选择最大的解码缩小倍数，使解码结果仍不小于 max_size。
+    """
+    flags = cv2.IMREAD_COLOR
+    original = None
+    if max_size:
+        try:
+            original = read_image_size(image_path)
+        except (OSError, ValueError):
+            original = None
+        if original is not None:
+            for factor, flag in _REDUCED_FLAGS:
+                if max(original) / factor >= max_size:
+                    flags = getattr(cv2, flag)
+                    break
+    image = cv2.imread(image_path, flags)
+    if image is None:
+        return None, None, None
+    if original is None or flags == cv2.IMREAD_COLOR:
+        original = image.shape[:2]
+    image, scale = _fit_image(image, max_size)
+    return image, image.shape[1] / original[1], original
+
+def _put_texts(image, texts, font_path=None, font_size=18):
+    """
+    在图像上写字，texts 为 [(文本, (x, y), BGR颜色)]。
+    较旧版本的OpenCV自带字体不支持中文，给定 font_path（如 SimHei 字体文件）且安装了 Pillow 时改用其绘制文字。
+    """
+    if font_path:
+        try:
+            from PIL import Image, ImageDraw, ImageFont
+        except ImportError:
+            font_path = None
+    if not font_path:
+        for text, (x, y), color in texts:
+            cv2.putText(image, text, (x, max(y, 12)), cv2.FONT_HERSHEY_SIMPLEX, font_size / 36, color, 1, cv2.LINE_AA)
+        return image
+
+    font = ImageFont.truetype(font_path, font_size)
+    canvas = Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+    draw = ImageDraw.Draw(canvas)
+    for text, (x, y), color in texts:
+        draw.text((x, max(y - font_size, 0)), text, font=font, fill=color[::-1])
+    return cv2.cvtColor(np.asarray(canvas), cv2.COLOR_RGB2BGR)
+
+def draw_grounding(data, max_size=None, font_path=None, reader=_read_fitted):
+    """
+    用OpenCV在图像上绘制grounding任务的框和类别，返回BGR图像；图像无法读取时返回 None。
+    reader 为读取并缩小图像的函数，见 _read_fitted 与 RenderCache.read_fitted。
+    """
+    image, scale, _ = reader(data["images"][0], max_size)
+    if image is None:
+        return None
+    thickness = 2
+
+    texts = []
+    for obj in data["objects"]:
+        for bbox in obj['bbox']:
+            x1, y1, x2, y2 = [int(v * scale) for v in bbox]
+            cv2.rectangle(image, (x1, y1), (x2, y2), GROUNDING_COLOR, thickness)
+            texts.append((obj['caption'], (x1, y1 - 4), GROUNDING_COLOR))
+    return _put_texts(image, texts, font_path)
+
+def draw_region(data, max_size=None, font_path=None, line_chars=20, reader=_read_fitted):
+    """
+    用OpenCV绘制region任务的区域框，并在图像下方附上描述文本，返回BGR图像；图像无法读取时返回 None。
+    """
+    image, scale, original = reader(data["image"], max_size)
+    if image is None:
+        return None
+    # 区域框按原图尺寸还原，再按缩放比例画到缩小后的图上
+    boxes = [restore_bbox(np.empty(original + (0,)), box) for box in query_boxes(data["query"])]
+    for box in boxes:
+        x1, y1, x2, y2 = [int(v * scale) for v in box]
+        cv2.rectangle(image, (x1, y1), (x2, y2), REGION_COLOR, 2)
+
+    # 描述文本放在图像下方的白色区域
+    description = data["response"]
+    lines = [description[i:i + line_chars] for i in range(0, len(description), line_chars)] or ['']
+    line_height = 26
+    panel = np.full((line_height * len(lines) + 10, image.shape[1], 3), 255, dtype=np.uint8)
+    texts = [(line, (10, line_height * (i + 1)), (0, 0, 0)) for i, line in enumerate(lines)]
+    panel = _put_texts(panel, texts, font_path)
+    return np.vstack([image, panel])
+
+def render_record(data, max_size=None, font_path=None, cache=None):
+    """
+    绘制一条记录，返回BGR图像；给定 cache（RenderCache）时优先使用磁盘缓存。
+    """
+    if cache is not None:
+        return cache.render(data, max_size, font_path)
+    if "objects" in data:  # 这是grounding任务
+        return draw_grounding(data, max_size, font_path)
+    if "image" in data:  # 这是region任务
+        return draw_region(data, max_size, font_path)
+    return None
+
+# 绘制方式改变时递增，使旧的叠加图缓存失效
+RENDER_VERSION = 1
+_THUMB_HEADER = struct.Struct('<II')
+
+def annotation_key(data):
+    """记录中会被绘制的标注内容的哈希：grounding 为 objects，region 为问题中的框与描述。"""
+    if "objects" in data:
+        content = data["objects"]
+    else:
+        content = [query_boxes(data.get("query", '')), data.get("response", '')]
+    text = json.dumps(content, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).hexdigest()
+
+class RenderCache:
+    """
+    缩略图与叠加图的磁盘缓存，按总字节数做LRU淘汰（见 vary2qwen_cache.BlobCache）。
+
+    - 缩略图：原图缩小到 max_size 后的图像，键为图像标识与 max_size；
+    - 叠加图：绘制好框和文字的结果，键另外包含标注哈希（annotation_key）、字体与 RENDER_VERSION。
+    图像标识默认为路径、mtime 与文件大小；content_hash 为真时改用图像内容哈希（同样带mtime缓存），
+    图像被移动或复制后仍能命中。标注修改后只需在缓存的缩略图上重新绘制，不再解码原图；
+    标注未变的记录直接读取叠加图。不给 max_size（原图大小）时不使用缓存。
+
+    Args:
+        cache_dir (str): 缓存目录。
+        max_bytes (int): 缓存总大小上限。
+        content_hash (bool): 是否以图像内容哈希作为图像标识。
+        quality (int): 缓存图像的JPEG质量。
+    """
+
+    def __init__(self, cache_dir, max_bytes=2 * 1024 * 1024 * 1024, content_hash=False, quality=90):
+        self.blobs = BlobCache(cache_dir, max_bytes)
+        self.quality = quality
+        self.hasher = None
+        if content_hash:
+            from vary2qwen_dedup import ImageHasher
+            self.hasher = ImageHasher(os.path.join(cache_dir, 'image_hashes.bin'))
+        self.hits = self.misses = 0
+
+    def image_key(self, image_path):
+        """图像标识，图像不存在时返回 None。"""
+        try:
+            stat = os.stat(image_path)
+        except OSError:
+            return None
+        if self.hasher is not None:
+            return self.hasher.hash(image_path)
+        return f'{os.path.abspath(image_path)}|{stat.st_mtime_ns}|{stat.st_size}'
+
+    def _encode(self, image):
+        return cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, self.quality])[1].tobytes()
+
+    @staticmethod
+    def _decode(data):
+        return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+    def read_fitted(self, image_path, max_size=None):
+        """与 _read_fitted 相同，缩略图优先从缓存读取。"""
+        image_key = self.image_key(image_path) if max_size else None
+        if image_key is None:
+            return _read_fitted(image_path, max_size)
+        key = f'thumb|{image_key}|{max_size}'
+        data = self.blobs.get(key)
+        if data is not None:
+            height, width = _THUMB_HEADER.unpack_from(data)
+            image = self._decode(data[_THUMB_HEADER.size:])
+            if image is not None:
+                return image, image.shape[1] / width, (height, width)
+        image, scale, original = _read_fitted(image_path, max_size)
+        if image is not None:
+            self.blobs.put(key, _THUMB_HEADER.pack(*original) + self._encode(image))
+        return image, scale, original
+
+    def render(self, data, max_size=None, font_path=None):
+        """与 render_record 相同，标注与图像都未变时直接返回缓存的叠加图。"""
+        image_key = self.image_key(record_image_path(data)) if max_size else None
+        if image_key is None:
+            return render_record(data, max_size, font_path)
+        key = f'overlay|{RENDER_VERSION}|{image_key}|{annotation_key(data)}|{max_size}|{font_path}'
+        cached = self.blobs.get(key)
+        if cached is not None:
+            image = self._decode(cached)
+            if image is not None:
+                self.hits += 1
+                return image
+        self.misses += 1
+        if "objects" in data:
+            image = draw_grounding(data, max_size, font_path, reader=self.read_fitted)
+        elif "image" in data:
+            image = draw_region(data, max_size, font_path, reader=self.read_fitted)
+        else:
+            return None
+        if image is not None:
+            self.blobs.put(key, self._encode(image))
+        return image
+
+    def save(self):
+        if self.hasher is not None:
+            self.hasher.save()
+
+def record_image_path(data):
+    # grounding记录使用 images 列表，问答记录使用 image 字段
+    if "images" in data:
+        return data["images"][0] if data["images"] else ''
+    return data.get("image", '')
+
+# 各渲染进程中按缓存目录共用的 RenderCache
+_render_caches = {}
+
+def _render_cache(cache_dir):
+    if cache_dir is None:
+        return None
+    if cache_dir not in _render_caches:
+        _render_caches[cache_dir] = RenderCache(cache_dir)
+    return _render_caches[cache_dir]
+
+def _render_job(job):
+    # 进程池中执行：渲染一条记录并写出图片，返回 (输出路径, 是否成功)
+    line, output_path, max_size, font_path, cache_dir = job
+    try:
+        image = render_record(json.loads(line), max_size, font_path, _render_cache(cache_dir))
+    except Exception as e:
+        print(f"渲染 {output_path} 时发生错误: {e}")
+        return output_path, False
+    if image is None:
+        return output_path, False
+    return output_path, cv2.imwrite(output_path, image)
+
+def _iter_render_jobs(jsonl_path, output_dir, sample_rate, max_size, font_path, seed, image_ext, cache_dir=None):
+    rng = random.Random(seed)
+    stem = os.path.splitext(os.path.basename(jsonl_path))[0]
+    with open(jsonl_path, 'r', encoding='utf-8') as file:
+        for index, line in enumerate(file):
+            if sample_rate < 1.0 and rng.random() >= sample_rate:
+                continue
+            output_path = os.path.join(output_dir, f'{stem}_{index:07d}{image_ext}')
+            yield line, output_path, max_size, font_path, cache_dir
+
+def render_jsonl_to_images(jsonl_path, output_dir, sample_rate=1.0, max_size=1280, workers=4,
+                           font_path=None, seed=0, image_ext='.jpg', chunksize=16, cache_dir=None):
+    """
+    无界面批量渲染：将标注文件中的记录绘制成图片保存到 output_dir，不弹出窗口。
+
+    Args:
+        sample_rate (float): 采样比例，1.0 表示全部渲染；同一 seed 下采样结果固定。
+        max_size (int): 输出图片最长边的上限，None 表示保持原图大小。
+        workers (int): 渲染进程数。
+        font_path (str): 中文字体文件路径，不提供时类别和描述用OpenCV自带字体绘制（旧版本不支持中文）。
+        image_ext (str): 输出图片格式的扩展名。
+        cache_dir (str): 缩略图与叠加图的磁盘缓存目录，见 RenderCache；重复渲染时只重绘标注有变化的记录。
+    Returns:
+        tuple: (成功数, 失败数)
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    jobs = _iter_render_jobs(jsonl_path, output_dir, sample_rate, max_size, font_path, seed, image_ext, cache_dir)
+    succeeded = failed = 0
+    if workers <= 1:
+        results = map(_render_job, jobs)
+        for _, ok in results:
+            succeeded, failed = succeeded + ok, failed + (not ok)
+    else:
+        with Pool(processes=workers) as pool:
+            for _, ok in pool.imap_unordered(_render_job, jobs, chunksize=chunksize):
+                succeeded, failed = succeeded + ok, failed + (not ok)
+    print(f"{jsonl_path}: 已渲染 {succeeded} 张到 {output_dir}，失败 {failed} 条")
+    return succeeded, failed
+
+def render_all_jsonl_in_folder(folder_path, output_dir, **kwargs):
+    """
+    批量渲染文件夹中的所有标注文件，每个文件输出到 output_dir 下的同名子目录，参数见 render_jsonl_to_images。
+    """
+    jsonl_files = sorted(f for f in os.listdir(folder_path) if f.endswith('.jsonl'))
+    for jsonl_file in jsonl_files:
+        render_jsonl_to_images(os.path.join(folder_path, jsonl_file),
+                               os.path.join(output_dir, os.path.splitext(jsonl_file)[0]), **kwargs)
+
+class ThumbnailLRU:
+    """
+    按字节数限制的缩略图LRU缓存，键为记录下标，值为BGR图像。只在主线程中访问。
+    """
+
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._items = OrderedDict()
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def get(self, key):
+        image = self._items.get(key)
+        if image is not None:
+            self._items.move_to_end(key)
+        return image
+
+    def put(self, key, image):
+        if key in self._items:
+            self.nbytes -= self._items.pop(key).nbytes
+        self._items[key] = image
+        self.nbytes += image.nbytes
+        while self.nbytes > self.max_bytes and len(self._items) > 1:
+            _, evicted = self._items.popitem(last=False)
+            self.nbytes -= evicted.nbytes
+
+class MosaicViewer:
+    """
+    分页的网格审阅视图：每页 rows x cols 个样本。
+
+    缩略图在后台线程池中解码、缩小并绘制（OpenCV 解码与缩放时释放GIL），
+    当前页前后 prefetch_pages 页提前准备，已绘制的缩略图保存在按字节数限制的LRU缓存中，
+    前后翻页无需等待。记录通过偏移索引直接定位，不读取整个文件。
+
+    Args:
+        jsonl_path (str): 标注文件路径。
+        indices (list): 要审阅的记录下标，默认为全部记录。
+        rows, cols (int): 每页的行数、列数。
+        tile_size (int): 每个缩略图格子的边长（像素）。
+        threads (int): 后台线程数。
+        cache_bytes (int): 缩略图缓存的字节数上限。
+        prefetch_pages (int): 向前、向后各预取的页数。
+        font_path (str): 中文字体文件路径，见 _put_texts。
+        cache_dir (str): 缩略图与叠加图的磁盘缓存目录，见 RenderCache，再次审阅时不必重新解码原图。
+    """
+
+    def __init__(self, jsonl_path, indices=None, rows=3, cols=4, tile_size=320, threads=8,
+                 cache_bytes=256 * 1024 * 1024, prefetch_pages=2, font_path=None, cache_dir=None):
+        from concurrent.futures import ThreadPoolExecutor
+        self.records = IndexedJsonl(jsonl_path)
+        self.indices = list(range(len(self.records))) if indices is None else list(indices)
+        self.rows, self.cols = rows, cols
+        self.tile_size = tile_size
+        self.prefetch_pages = prefetch_pages
+        self.font_path = font_path
+        self.cache = ThumbnailLRU(cache_bytes)
+        self.render_cache = RenderCache(cache_dir) if cache_dir else None
+        self._executor = ThreadPoolExecutor(max_workers=threads)
+        self._pending = {}
+
+    @property
+    def page_size(self):
+        return self.rows * self.cols
+
+    def __len__(self):
+        # 总页数
+        return max(1, -(-len(self.indices) // self.page_size))
+
+    def page_indices(self, page):
+        return self.indices[page * self.page_size:(page + 1) * self.page_size]
+
+    def _render_tile(self, index):
+        # 后台线程中执行：渲染一条记录，贴到固定大小的灰底格子中央，左上角标注记录下标
+        size = self.tile_size
+        tile = np.full((size, size, 3), 64, dtype=np.uint8)
+        try:
+            image = render_record(self.records[index], size, self.font_path, self.render_cache)
+        except Exception as e:
+            print(f"渲染第 {index} 条记录时发生错误: {e}")
+            image = None
+        if image is None:
+            return _put_texts(tile, [(f'#{index} unreadable', (8, 24), (0, 0, 255))], self.font_path)
+        image, _ = _fit_image(image, size)
+        height, width = image.shape[:2]
+        top, left = (size - height) // 2, (size - width) // 2
+        tile[top:top + height, left:left + width] = image
+        cv2.putText(tile, f'#{index}', (6, 20), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2, cv2.LINE_AA)
+        return tile
+
+    def _submit(self, index):
+        if index not in self.cache and index not in self._pending:
+            self._pending[index] = self._executor.submit(self._render_tile, index)
+
+    def prefetch(self, page):
+        """提交 page 及其前后 prefetch_pages 页的渲染任务，取消已离开该范围的任务。"""
+        pages = [page] + [p for k in range(1, self.prefetch_pages + 1) for p in (page + k, page - k)]
+        wanted = set()
+        for p in pages:
+            if 0 <= p < len(self):
+                for index in self.page_indices(p):
+                    wanted.add(index)
+                    self._submit(index)
+        for index in [i for i in self._pending if i not in wanted]:
+            if self._pending[index].cancel():
+                del self._pending[index]
+
+    def tile(self, index):
+        """返回一个缩略图格子，缓存中没有时等待（或开始）渲染。"""
+        tile = self.cache.get(index)
+        if tile is None:
+            self._submit(index)
+            tile = self._pending.pop(index).result()
+            self.cache.put(index, tile)
+        return tile
+
+    def page(self, page):
+        """拼出第 page 页的网格图（BGR），并预取前后页。"""
+        self.prefetch(page)
+        # 已在后台完成的任务先移入缓存
+        for index in [i for i, future in self._pending.items() if future.done()]:
+            self.cache.put(index, self._pending.pop(index).result())
+        size = self.tile_size
+        mosaic = np.full((self.rows * size, self.cols * size, 3), 32, dtype=np.uint8)
+        for k, index in enumerate(self.page_indices(page)):
+            row, col = divmod(k, self.cols)
+            mosaic[row * size:(row + 1) * size, col * size:(col + 1) * size] = self.tile(index)
+        return mosaic
+
+    def show(self, page=0):
+        """
+        在窗口中审阅：→/PageDown/空格 下一页，←/PageUp 上一页，Home/End 首页/末页，q 关闭。
+        """
+        plt = _pyplot()
+        fig, ax = plt.subplots(figsize=(self.cols * 3, self.rows * 3))
+        ax.axis('off')
+        state = {'page': page}
+        artist = ax.imshow(cv2.cvtColor(self.page(page), cv2.COLOR_BGR2RGB))
+        ax.set_title(f'{page + 1}/{len(self)}')
+
+        def on_key(event):
+            moves = {'right': 1, 'pagedown': 1, ' ': 1, 'left': -1, 'pageup': -1}
+            if event.key in moves:
+                new_page = min(max(state['page'] + moves[event.key], 0), len(self) - 1)
+            elif event.key in ('home', 'end'):
+                new_page = 0 if event.key == 'home' else len(self) - 1
+            else:
+                return
+            if new_page != state['page']:
+                state['page'] = new_page
+                artist.set_data(cv2.cvtColor(self.page(new_page), cv2.COLOR_BGR2RGB))
+                ax.set_title(f'{new_page + 1}/{len(self)}')
+                fig.canvas.draw_idle()
+
+        fig.canvas.mpl_connect('key_press_event', on_key)
+        plt.tight_layout()
+        plt.show()
+
+    def save_pages(self, output_dir, image_ext='.jpg'):
+        """将每一页保存为图片，返回保存的文件路径列表。"""
+        os.makedirs(output_dir, exist_ok=True)
+        paths = []
+        for page in range(len(self)):
+            path = os.path.join(output_dir, f'page_{page:05d}{image_ext}')
+            cv2.imwrite(path, self.page(page))
+            paths.append(path)
+        return paths
+
+    def close(self):
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        self._pending.clear()
+        self.records.close()
+        if self.render_cache is not None:
+            self.render_cache.save()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def review_jsonl(jsonl_path, rows=3, cols=4, sample=None, seed=None, caption=None, **kwargs):
+    """
+    以网格分页方式审阅标注文件，sample、seed、caption 的含义同 load_and_visualize_jsonl，其余参数见 MosaicViewer。
+    """
+    indices = None
+    if caption is not None:
+        with CaptionIndex(jsonl_path) as captions:
+            indices = captions.query(caption)
+        if sample is not None and sample < len(indices):
+            indices = sorted(random.Random(seed).sample(indices, sample))
+    elif sample is not None:
+        with IndexedJsonl(jsonl_path) as records:
+            indices = records.sample_indices(sample, seed)
+    with MosaicViewer(jsonl_path, indices, rows, cols, **kwargs) as viewer:
+        viewer.show()
+
+if __name__ == '__main__':
+    # 示例：可视化文件夹中的所有标注文件
+    folder_path = 'D:/code/data_extract/save/new/'  # 请替换为你的文件夹路径
+    visualize_all_jsonl_in_folder(folder_path)
@@ -0,0 +1,475 @@
+import ctypes
+import ctypes.util
+import multiprocessing
+import os
+import select
+import signal
+import struct
+import threading
+import time
+from multiprocessing.connection import wait
+
+from vary2qwen_discover import LabelWalker
+from vary2qwen_manifest import ConversionManifest
+from vary2qwen_metrics import ConversionMetrics
+from vary2qwen_probe import ImageSizeProbe
+
+# 监视模式：标注人员全天持续往标注目录中添加 json，监视模式常驻运行，只转换新增或修改的文件，
+# 按与增量模式相同的哈希划分追加到 {name}_train.jsonl / {name}_val.jsonl，不再反复全量转换。
+#   - Linux 上用 inotify（ctypes 调用 libc）监听目录，新文件写完（IN_CLOSE_WRITE）或移入（IN_MOVED_TO）
+#     后一秒内写出，不扫描目录；inotify 不可用或指定 poll_interval 时改为轮询，只重新列出 mtime 变化的目录；
+#   - 转换结果与清单 {name}.manifest.jsonl 共用增量模式的检查点机制：每批文件写完后落盘并提交检查点，
+#     进程中途退出时未提交的内容会在下次启动时截断，输出中不会出现半批记录；
+#   - 修改或删除的文件在输出中留下的旧记录，在空闲 compact_idle 秒后或退出时压缩掉。
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_ONLYDIR
+INOTIFY_EVENT = struct.Struct('iIII')
+
+# watch_label_dir 接受的数据集选项，配置文件中的其他转换选项（如 streaming、dedup）在监视模式下忽略
+WATCH_OPTIONS = ('split_by', 'poll_interval', 'settle', 'max_delay', 'rescan_interval', 'compact_idle', 'index',
+                 'probe_sizes', 'size_cache', 'include', 'exclude', 'recursive', 'walk_threads', 'workers')
+
+_libc = None
+
+
+def _inotify_libc():
+    global _libc
+    if _libc is None:
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+            _libc = libc if hasattr(libc, 'inotify_init1') else False
+        except OSError:
+            _libc = False
+    return _libc or None
+
+
+class InotifyWatcher:
+    """
+    用 inotify 监听标注目录（recursive 时包括各级子目录，新建的子目录自动加入监听）。
+    事件队列溢出时 rescan_needed 置为真，由调用方全量核对一次。
+    """
+
+    def __init__(self, label_dir, walker):
+        self.libc = _inotify_libc()
+        if self.libc is None:
+            raise OSError("当前系统不支持 inotify")
+        self.walker = walker
+        self.rescan_needed = False
+        self.fd = self.libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            self._raise(label_dir)
+        self.dirs = {}
+        try:
+            self._add_tree(label_dir, '')
+        except OSError:
+            self.close()
+            raise
+
+    @staticmethod
+    def _raise(path):
+        errno = ctypes.get_errno()
+        raise OSError(errno, os.strerror(errno), path)
+
+    def _add_tree(self, path, prefix, found=None):
+        # 监听 path 及其子目录；found 不为 None 时把其中已有的标注文件加入 found（新建目录中监听前写入的文件）
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            self._raise(path)
+        self.dirs[wd] = (path, prefix)
+        if not self.walker.recursive and found is None:
+            return
+        with os.scandir(path) as entries:
+            for entry in entries:
+                name = prefix + entry.name
+                if entry.is_dir(follow_symlinks=False):
+                    if self.walker.match_dir(name):
+                        self._add_tree(entry.path, name + '/', found)
+                elif found is not None and self.walker.match_file(name) and entry.is_file():
+                    found[name] = entry.path
+
+    def read(self, timeout):
+        """
+        等待至多 timeout 秒，返回 (changed, removed)：changed 为 {相对路径: 路径}，
+        removed 为删除的文件相对路径的集合，以 / 结尾的表示整个子目录被删除或移走。
+        """
+        changed, removed = {}, set()
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return changed, removed
+        data = os.read(self.fd, 1024 * 1024)
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+            raw_name = data[offset + INOTIFY_EVENT.size:offset + INOTIFY_EVENT.size + length].rstrip(b'\0')
+            offset += INOTIFY_EVENT.size + length
+            if mask & IN_Q_OVERFLOW:
+                self.rescan_needed = True
+                continue
+            if wd not in self.dirs:
+                continue
+            path, prefix = self.dirs[wd]
+            if mask & IN_IGNORED:
+                del self.dirs[wd]
+                continue
+            if not raw_name:
+                continue
+            name = prefix + os.fsdecode(raw_name)
+            full_path = os.path.join(path, os.fsdecode(raw_name))
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO) and self.walker.match_dir(name):
+                    try:
+                        self._add_tree(full_path, name + '/', changed)
+                    except FileNotFoundError:
+                        pass
+                elif mask & (IN_DELETE | IN_MOVED_FROM):
+                    removed.add(name + '/')
+            elif self.walker.match_file(name):
+                if mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                    changed[name] = full_path
+                    removed.discard(name)
+                elif mask & (IN_DELETE | IN_MOVED_FROM):
+                    removed.add(name)
+                    changed.pop(name, None)
+        return changed, removed
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+class PollingWatcher:
+    """
+    轮询监视：每 interval 秒 stat 一次各目录，只重新列出 mtime 变化的目录，与上次列出的文件名比较。
+    目录 mtime 只随增删文件变化，就地改写已有文件不会被发现，需配合 rescan_interval 定期全量核对。
+    """
+
+    def __init__(self, label_dir, walker, interval=2.0):
+        self.walker = walker
+        self.interval = interval
+        self.rescan_needed = False
+        self.dirs = {}
+        self._next_poll = time.monotonic() + interval
+        self._scan(label_dir, '', None, set())
+
+    def _scan(self, path, prefix, changed, removed):
+        names, subdirs = set(), []
+        scanned_at = time.time_ns()
+        mtime = os.stat(path).st_mtime_ns
+        with os.scandir(path) as entries:
+            for entry in entries:
+                name = prefix + entry.name
+                if entry.is_dir(follow_symlinks=False):
+                    if self.walker.match_dir(name):
+                        subdirs.append((entry.path, name + '/'))
+                elif self.walker.match_file(name) and entry.is_file():
+                    names.add(entry.name)
+        old = self.dirs.get(path)
+        if changed is not None:
+            old_names = old[2] if old else set()
+            for file_name in names - old_names:
+                changed[prefix + file_name] = os.path.join(path, file_name)
+            removed.update(prefix + file_name for file_name in old_names - names)
+        # mtime 与列出时间过于接近时，同一时间粒度内随后新增的文件不会再改变 mtime，下次轮询仍需重新列出
+        if scanned_at - mtime < 2 * 10 ** 9:
+            mtime = None
+        self.dirs[path] = [prefix, mtime, names]
+        for subdir, sub_prefix in subdirs:
+            if subdir not in self.dirs:
+                try:
+                    self._scan(subdir, sub_prefix, changed, removed)
+                except FileNotFoundError:
+                    pass
+
+    def read(self, timeout):
+        """同 InotifyWatcher.read。"""
+        changed, removed = {}, set()
+        delay = self._next_poll - time.monotonic()
+        if delay > timeout:
+            time.sleep(timeout)
+            return changed, removed
+        time.sleep(max(0, delay))
+        self._next_poll = time.monotonic() + self.interval
+        for path, (prefix, mtime, _) in list(self.dirs.items()):
+            if path not in self.dirs:
+                continue
+            try:
+                if os.stat(path).st_mtime_ns == mtime:
+                    continue
+                self._scan(path, prefix, changed, removed)
+            except FileNotFoundError:
+                for other in [p for p, state in self.dirs.items() if state[0].startswith(prefix)]:
+                    del self.dirs[other]
+                if prefix:
+                    removed.add(prefix)
+        return changed, removed
+
+    def close(self):
+        pass
+
+
+def open_watcher(label_dir, walker, poll_interval=None):
+    """poll_interval 为 None 时优先使用 inotify，不可用（非 Linux 或监听数达到上限）时退回每 2 秒轮询。"""
+    if poll_interval is None:
+        try:
+            return InotifyWatcher(label_dir, walker)
+        except OSError as e:
+            print(f"无法使用 inotify 监视 {label_dir}（{e}），改为轮询")
+            poll_interval = 2.0
+    return PollingWatcher(label_dir, walker, poll_interval)
+
+
+class WatchSession:
+    """
+    监视模式下一个数据集的增量写出状态：清单、按哈希划分的输出文件与累计指标。
+    """
+
+    def __init__(self, name, label_dir, img_dir, output_dir, split_ratio=0.8, split_by='image', walker=None,
+                 probe_sizes=None, index=False, size_cache=None):
+        from vary2qwen_tets import SplitWriter, split_key_fn
+        self.name = name
+        self.label_dir = label_dir
+        self.img_dir = img_dir
+        self.output_dir = output_dir
+        self.split_ratio = split_ratio
+        self.split_key = split_key_fn(split_by)
+        self.walker = walker or LabelWalker()
+        self.probe_sizes = probe_sizes
+        # 整个监视期间共用一个尺寸探测器，每批写出后保存新探测到的尺寸
+        self.size_probe = ImageSizeProbe(size_cache) if probe_sizes else None
+        self.index = index
+        self.metrics = ConversionMetrics()
+        self.totals = {'converted': 0, 'touched': 0, 'removed': 0, 'records': 0}
+        self.output_paths = SplitWriter.output_paths(output_dir, name)
+        self.manifest = ConversionManifest.load(os.path.join(output_dir, f'{name}.manifest.jsonl'))
+        self.manifest.recover(self.output_paths)
+        self.writer = self._open_writer()
+
+    def _open_writer(self):
+        from vary2qwen_tets import SplitWriter
+        return SplitWriter(self.output_dir, self.name, self.split_ratio, self.split_key, self.metrics,
+                           append=True)
+
+    def apply(self, changed, removed):
+        """
+        转换 changed（{相对路径: 路径}）中新增或修改的文件并移除 removed 中的文件，写完后提交检查点。
+        大小和mtime未变的文件跳过。
+        """
+        from vary2qwen_tets import apply_file_result, iter_file_results
+        start = time.perf_counter()
+        counts = {'converted': 0, 'touched': 0, 'removed': 0, 'records': 0}
+        for name in removed:
+            if name.endswith('/'):
+                names = [f for f in self.manifest.files if f.startswith(name)]
+            else:
+                names = [name] if name in self.manifest.files else []
+            for label_file in names:
+                self.manifest.remove(label_file)
+            counts['removed'] += len(names)
+
+        stats, pending, label_paths = {}, [], []
+        for label_file, path in sorted(changed.items()):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                if label_file in self.manifest.files:
+                    self.manifest.remove(label_file)
+                    counts['removed'] += 1
+                continue
+            if not self.manifest.unchanged(label_file, stat):
+                stats[label_file] = stat
+                pending.append(label_file)
+                label_paths.append(path)
+
+        # 新文件通常很少，在当前进程中转换，省去进程池的启动开销
+        results = iter_file_results(label_paths, self.img_dir, workers=1, with_sha1=True,
+                                    probe_sizes=self.probe_sizes, size_probe=self.size_probe)
+        for label_file, result in zip(pending, results):
+            self.metrics.merge(result.metrics)
+            outcome = apply_file_result(self.manifest, self.writer, label_file, stats[label_file], result)
+            if outcome is not None:
+                counts[outcome] += 1
+            if outcome == 'converted':
+                counts['records'] += len(result.records)
+
+        if self.size_probe is not None:
+            self.size_probe.save()
+        if not (counts['converted'] or counts['touched'] or counts['removed']):
+            return counts
+        self.manifest.checkpoint(self.writer.sync())
+        if self.index and counts['converted']:
+            from vary2qwen_tets import index_output_files
+            index_output_files(self.output_dir, self.name)
+        for key, n in counts.items():
+            self.totals[key] += n
+        print(f"{self.name}: 新转换 {counts['converted']} 个文件（{counts['records']} 条记录），"
+              f"仅更新时间 {counts['touched']} 个，删除 {counts['removed']} 个，用时 {time.perf_counter() - start:.2f}s")
+        return counts
+
+    def rescan(self):
+        """全量核对标注目录：转换所有大小或mtime变化的文件，移除已不存在的文件。"""
+        changed = {entry.name: entry.path for entry in self.walker.walk(self.label_dir)}
+        removed = {label_file for label_file in self.manifest.files if label_file not in changed}
+        return self.apply(changed, removed)
+
+    def compact(self):
+        """压缩掉修改或删除的文件留下的旧记录。输出文件被重写，写出器需重新打开。"""
+        if not self.manifest.compaction_needed:
+            return
+        start = time.perf_counter()
+        self.writer.close()
+        self.manifest.compact(self.output_paths)
+        self.writer = self._open_writer()
+        if self.index:
+            from vary2qwen_tets import index_output_files
+            index_output_files(self.output_dir, self.name, rebuild=True)
+        print(f"{self.name}: 已压缩输出文件，用时 {time.perf_counter() - start:.2f}s")
+
+    def close(self):
+        self.compact()
+        self.writer.close()
+
+
+def watch_label_dir(name, label_dir, img_dir, output_dir, split_ratio=0.8, split_by='image', poll_interval=None,
+                    settle=0.2, max_delay=1.0, rescan_interval=None, compact_idle=60.0, index=False,
+                    probe_sizes=None, size_cache=None, include=None, exclude=None, recursive=False, walk_threads=8,
+                    workers=1, stop=None):
+    """
+    持续监视一个标注目录，增量转换新增或修改的标注文件，直到 stop（threading.Event 或
+    multiprocessing.Event）被设置或收到 Ctrl-C，退出前写出已到达的文件并提交。
+
+    启动时先开始监听，再以增量模式（见 vary2qwen_tets.process_label_dir_incremental）补齐停止期间的变化，
+    补齐期间到达的文件随后由监听事件处理，不会遗漏。之后每批文件在最后一个事件后 settle 秒、
+    或第一个事件后 max_delay 秒写出，输出与增量模式完全一致。
+
+    Args:
+        poll_interval (float): 给定时改用轮询，每隔该秒数检查一次，见 PollingWatcher。
+        settle (float): 等待同一批文件陆续到达的静默时间（秒）。
+        max_delay (float): 一批文件从到达到写出的最长等待时间（秒）。
+        rescan_interval (float): 每隔多少秒全量核对一次标注目录；轮询模式下默认 600 秒，用于发现就地改写的文件。
+        compact_idle (float): 需要压缩时，空闲多少秒后压缩输出文件，None 表示只在退出时压缩。
+        workers (int): 启动时补齐所用的转换进程数。
+        其余参数见 vary2qwen_tets.process_label_dir。
+    Returns:
+        dict: 监视期间转换、仅更新、删除的文件数与写出的记录数。
+    """
+    from vary2qwen_tets import process_label_dir
+    stop = stop or threading.Event()
+    walker = LabelWalker(include, exclude, recursive, walk_threads)
+    watcher = open_watcher(label_dir, walker, poll_interval)
+    if rescan_interval is None and isinstance(watcher, PollingWatcher):
+        rescan_interval = 600.0
+    try:
+        process_label_dir(name, label_dir, img_dir, output_dir, split_ratio, workers=workers, incremental=True,
+                          split_by=split_by, probe_sizes=probe_sizes, size_cache=size_cache, index=index,
+                          include=include, exclude=exclude, recursive=recursive, walk_threads=walk_threads)
+        session = WatchSession(name, label_dir, img_dir, output_dir, split_ratio, split_by, walker,
+                               probe_sizes, index, size_cache)
+        print(f"开始监视 {label_dir}（{'inotify' if isinstance(watcher, InotifyWatcher) else '轮询'}）")
+        try:
+            changed, removed = {}, set()
+            first_event = None
+            last_activity = last_rescan = time.monotonic()
+            while not stop.is_set():
+                try:
+                    new_changed, new_removed = watcher.read(settle if first_event is not None else 0.5)
+                except KeyboardInterrupt:
+                    break
+                now = time.monotonic()
+                for label_file in new_removed:
+                    changed.pop(label_file, None)
+                removed.difference_update(new_changed)
+                changed.update(new_changed)
+                removed.update(new_removed)
+                if (new_changed or new_removed) and first_event is None:
+                    first_event = now
+
+                if watcher.rescan_needed or (rescan_interval and now - last_rescan >= rescan_interval):
+                    watcher.rescan_needed = False
+                    session.rescan()
+                    changed, removed = {}, set()
+                    first_event = None
+                    last_rescan = last_activity = time.monotonic()
+                elif first_event is not None and (not (new_changed or new_removed) or now - first_event >= max_delay):
+                    session.apply(changed, removed)
+                    changed, removed = {}, set()
+                    first_event = None
+                    last_activity = time.monotonic()
+                elif (compact_idle is not None and first_event is None and session.manifest.compaction_needed
+                      and now - last_activity >= compact_idle):
+                    session.compact()
+            if changed or removed:
+                session.apply(changed, removed)
+        finally:
+            session.close()
+    finally:
+        watcher.close()
+    print(f"{name} 停止监视: 共转换 {session.totals['converted']} 个文件（{session.totals['records']} 条记录），"
+          f"删除 {session.totals['removed']} 个")
+    return session.totals
+
+
+def _watch_job(conn, stop, name, dataset, output_dir, split_ratio, options):
+    # 监视进程忽略 Ctrl-C，由主进程设置 stop 后自行写完当前批次退出，不会在写出途中被打断
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    try:
+        conn.send(watch_label_dir(name, dataset['annotations'], dataset['images'], output_dir, split_ratio,
+                                  stop=stop, **options))
+    except BaseException as e:
+        print(f"{name} 监视失败: {e}")
+        conn.send({'error': str(e)})
+    finally:
+        conn.close()
+
+
+def watch_datasets(datasets, output_dir, split_ratio=0.8, **options):
+    """
+    同时监视多个数据集（格式同 vary2qwen_tets.process_datasets），每个数据集一个进程，Ctrl-C 时全部停止。
+    数据集选项中 WATCH_OPTIONS 以外的转换选项被忽略，其余参数见 watch_label_dir。
+
+    Returns:
+        dict: 每个数据集的监视汇总，失败的数据集为 {'error': 错误信息}。
+    """
+    context = multiprocessing.get_context()
+    stop = context.Event()
+    jobs = {}
+    for name, dataset in datasets.items():
+        dataset_options = dict(options, **dataset.get('options', {}))
+        ignored = sorted(key for key in dataset_options if key not in WATCH_OPTIONS)
+        if ignored:
+            print(f"{name}: 监视模式忽略选项 {', '.join(ignored)}")
+        dataset_options = {key: value for key, value in dataset_options.items() if key in WATCH_OPTIONS}
+        conn, child_conn = context.Pipe(duplex=False)
+        process = context.Process(target=_watch_job, name=f'vary2qwen-watch-{name}',
+                                  args=(child_conn, stop, name, dataset, output_dir, split_ratio, dataset_options))
+        process.start()
+        child_conn.close()
+        jobs[conn] = (name, process)
+
+    totals = {}
+    pending = list(jobs)
+    while pending:
+        try:
+            ready = wait(pending)
+        except KeyboardInterrupt:
+            print("正在停止监视，写出已到达的文件……")
+            stop.set()
+            continue
+        for conn in ready:
+            name, process = jobs[conn]
+            try:
+                totals[name] = conn.recv()
+            except EOFError:
+                totals[name] = {'error': f"监视进程异常退出，退出码 {process.exitcode}"}
+            process.join()
+            pending.remove(conn)
+    return totals